@@ -12,21 +12,42 @@ Created on Mon Jun 10 22:48:10 2019
 #4.23714034E-05
 # alias python='winpty python'
 
-import psutil
 import os
-import win32com.client as win32
+import sys
+import logging
+import argparse
 import pandas as pd
 #import numpy as np
 import time as time
 
-aspen = win32.Dispatch('Apwn.Document')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import py_aspen
+import aspen_sweep
+import aspen_metrics
+import aspen_dataset
+import aspen_surrogate
+import aspen_sensitivity
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resume', action='store_true', help='skip the cases already in the journal of a previous run')
+parser.add_argument('--excel', action='store_true', help='also export the results to an xlsx workbook (needs xlsxwriter)')
+parser.add_argument('--sensitivity', choices=['morris', 'sobol'],
+                    help='run a global sensitivity design over the variable ranges instead of the full grid')
+parser.add_argument('--screen', action='store_true', help='pre-screen the cases with a surrogate model (needs scikit-learn)')
+args = parser.parse_args()
+
+logger = logging.getLogger('py_aspen.clhg')
+py_aspen.configure_logging('3RCLHG_4variable_log.jsonl', level=logging.INFO)
 
 file_name = 'CLHG_UOP_noPSA_P1P2_noUtCalcback.bkp'
-
-aspen.InitFromArchive2(os.path.abspath(file_name))
+# every finished case is appended here at once, so a crash loses at most the running case
+journal_file = 'Fe32_SC_AirT_CT_journal.csv'
+dataset_dir = 'Fe32_SC_AirT_CT'
+if args.sensitivity:
+    journal_file = 'Fe32_SC_AirT_CT_{}_journal.csv'.format(args.sensitivity)
+    dataset_dir = 'Fe32_SC_AirT_CT_{}'.format(args.sensitivity)
 
 #block, stream, component name
-ppp=0
 solids=['FE2O3','FE3O4','FE0947O','FE'] #reducer bot molar flow
 wequips=['2001Y01','2002Y01','1008Y01','8401P01','1202P01'] #electricity
 gmfs=['S10-01','H2PROD','S10-10','S81-62','S81-62O'] #Mass flow
@@ -42,26 +63,6 @@ cus=['1202E02','1202E03','1203E03','1203E04','1201E02'] #heat duty
 
 cal=['S11-50','S10-12','OG5','S11-20','RG5','S11-10'] # for size calculation
 
-###temp1=['re_bot_temp','ox_bot_temp','combustor_temp']
-
-# create dataframe with the variables before
-df_rb=pd.DataFrame(columns=solids) #reducer bottom iron oxide molar flow rate
-df_ob=pd.DataFrame(columns=solids) #oxidizer bottom iron oxide molar flow rate
-df_e=pd.DataFrame(columns=wequips)  #electricity
-df_mf=pd.DataFrame(columns=gmfs+['S11-07','PureCO2']) #mass flow rate
-df_vf=pd.DataFrame(columns=vfs) #volume flow rate
-df_nf=pd.DataFrame(columns=nfs+['Fe2O3In']+['PureH2']+['ReducerCarbon']) #molar flow rate
-df_err=pd.DataFrame(columns=['error']) #error number
-df_t=pd.DataFrame(columns=sts+gts)
-df_mfr=pd.DataFrame(columns=mfrs)
-df_hr=pd.DataFrame(columns=hrs)
-df_ci=pd.DataFrame(columns=cis)
-df_co=pd.DataFrame(columns=cos)
-
-df_rou = pd.DataFrame(columns=cal)
-df_vis= pd.DataFrame(columns=cal)
-######df_co=pd.DataFrame(columns=temp1)
-
 #Sensitivity points
 df_tc=pd.DataFrame(columns=['VarRange'])
 
@@ -100,247 +101,160 @@ dw=100
 w=3
 df_tc.at[5,'VarRange']='Steam preheat temperature varies from '+str(w_lb)+'C to '+str(w_lb+dw*(w-1))+'C, increment '+str(dw)+'C'
 
+# Sweep spec: variables are listed from the outermost to the innermost loop,
+# case k of the result table is the same case as row k of the old nested loops.
+# how to find a node path: customize>> variable explorer
+spec = {
+    'variables': [
+        {'name': 'fewt', 'path': r'\Data\Streams\S11-07\Input\FLOW\CISOLID\FE2O3', 'start': q_lb, 'step': dq, 'num': q},
+        {'name': 'Inp_rbsc', 'path': r'\Data\Flowsheeting Options\Design-Spec\REDSCONV\Input\EXPR2',
+         'start': p_lb, 'step': dp, 'num': p, 'as_str': True},
+        {'name': 'Red_T', 'path': r'\Data\Streams\S11-07\Input\TEMP\CISOLID', 'start': n_lb, 'step': dn, 'num': n},
+        {'name': 'Steam_T', 'path': r'\Data\Blocks\HRSG\Input\VALUE\S84-03', 'start': w_lb, 'step': dw, 'num': w},
+        {'name': 'Air_T', 'path': r'\Data\Blocks\HRSG\Input\VALUE\S10-11', 'start': m_lb, 'step': dm, 'num': m},
+    ],
+    #oxygen carrier composition setting
+    'derived': [
+        {'name': 'tiwt', 'path': r'\Data\Streams\S11-07\Input\FLOW\CISOLID\TIO2', 'expr': 0.21},
+        {'name': 'alwt', 'path': r'\Data\Streams\S11-07\Input\FLOW\CISOLID\AL2O3', 'expr': '1.0 - fewt - tiwt'},
+    ],
+    # These variable have values only after running.
+    # the list is compiled once into an output manifest, each node is read once per case
+    'outputs': [
+        {'name': 'rb_{}', 'path': r'\Data\Streams\S11-02\Output\MOLEFLOW\CISOLID\{}', 'each': solids},
+        {'name': 'ob_{}', 'path': r'\Data\Streams\S11-03\Output\MOLEFLOW\CISOLID\{}', 'each': solids},
+        {'name': 'e_{}', 'path': r'\Data\Blocks\{}\Output\WNET', 'each': wequips},
+        {'name': 'mf_{}', 'path': r'\Data\Streams\{}\Output\MASSFLMX\MIXED', 'each': gmfs},
+        {'name': 'mf_S11-07', 'path': r'\Data\Streams\S11-07\Output\MASSFLMX\CISOLID'},
+        {'name': 'mf_PureCO2', 'path': r'\Data\Streams\S20-10\Output\MASSFLOW\MIXED\CO2'},
+        {'name': 'vf_{}', 'path': r'\Data\Streams\{}\Output\VOLFLMX\MIXED', 'each': vfs},
+        {'name': 't_{}', 'path': r'\Data\Streams\{}\Output\TEMP_OUT\CISOLID', 'each': sts},
+        {'name': 't_{}', 'path': r'\Data\Streams\{}\Output\TEMP_OUT\MIXED', 'each': gts},
+        {'name': 'mfr_{}', 'path': r'\Data\Streams\S11-07\Output\MASSFRAC\CISOLID\{}', 'each': mfrs},
+        {'name': 'hr_{}', 'path': r'\Data\Blocks\HRSG\Output\QCALC\{}', 'sign': -1, 'each': hrs},
+        # HMX_FLOW == ENTHALPY FLOW GCAL/hr
+        {'name': 'ci_{}', 'path': r'\Data\Streams\{}\Output\HMX_FLOW\$TOTAL', 'each': cis},
+        {'name': 'co_{}', 'path': r'\Data\Streams\{}\Output\HMX_FLOW\$TOTAL', 'each': cos},
+        {'name': 'rou_{}', 'path': r'\Data\Streams\{}\Output\RHOMX_MASS\MIXED', 'each': cal},
+        # VISCO READ_VAL holds one element per stream in cal, read as a whole once per case
+        *[{'name': 'vis_'+cali, 'path': r'\Data\Flowsheeting Options\Calculator\VISCO\Output\READ_VAL', 'element': kk}
+          for kk, cali in enumerate(cal)],
+        {'name': 'nf_S10-01', 'path': r'\Data\Streams\S10-01\Output\MOLEFLMX\MIXED'},
+        {'name': 'nf_Fe2O3In', 'path': r'\Data\Streams\S11-07\Output\MOLEFLOW\CISOLID\FE2O3'},
+        {'name': 'nf_PureH2', 'path': r'\Data\Streams\H2PROD\Output\MOLEFLOW\MIXED\H2'},
+        {'name': 'nf_ReducerCarbon', 'path': r'\Data\Streams\S11-02\Output\MOLEFLOW\CISOLID\CARBON'},
+    ],
+}
+
+pyaspen = py_aspen.PyASPENPlus()
+pyaspen.init_app(ap_version=None)
+# restart only our own engine when it degrades, instead of killing every Aspen process each 50 cases
+pyaspen.recycler = py_aspen.EngineRecycler(max_rss_mb=2048, max_handles=10000, max_latency_ratio=3.0)
+# a run still going after 10 min is stopped and recorded as 'timeout'; failed runs skip the output reads
+pyaspen.run_timeout = 600
+pyaspen.load_ap_file(file_name, os.getcwd())
+
+# Summary metrics, evaluated over the whole result table at once.
+# scalable metrics are normalized to 4632.96 kg/hr H2 production
+metrics = (
+    #unscalable variables
+    [{'name': 'Fe2O3 wt', 'expr': '`mfr_FE2O3`'},
+     {'name': 'RBSC', 'expr': '1 - (`rb_FE0947O` + `rb_FE3O4`*4) / (`nf_Fe2O3In`*3)'},
+     {'name': 'OBSC', 'expr': '1 - (`ob_FE0947O` + `ob_FE3O4`*4) / (`nf_Fe2O3In`*3)'},
+     {'name': 'H2NGR', 'expr': '`nf_PureH2` / `nf_S10-01`'},
+     {'name': 'NGInT', 'unit': 'C', 'expr': '`t_S10-06`'},
+     {'name': 'STInT', 'unit': 'C', 'expr': '`t_STGEN`'},
+     {'name': 'AirInT', 'unit': 'C', 'expr': '`t_S10-12`'},
+     {'name': 'RedBT', 'unit': 'C', 'expr': '`t_S11-02`'},
+     {'name': 'OxBT', 'unit': 'C', 'expr': '`t_S11-03`'},
+     {'name': 'CombT', 'unit': 'C', 'expr': '`t_S11-07`'}]
+    + [{'name': cali, 'unit': 'kg/cum', 'expr': '`rou_{}`'.format(cali)} for cali in cal]
+    + [{'name': cali, 'unit': 'N-SEC/SQM', 'expr': '`vis_{}`'.format(cali)} for cali in cal]
+    #scalable variables
+    + [{'name': 'NGMole', 'unit': 'kmol/hr', 'expr': '`nf_S10-01`', 'scalable': True},
+       {'name': 'SolidFlow', 'unit': 'kg/hr', 'expr': '`mf_S11-07`', 'scalable': True},
+       {'name': 'H2Mass', 'unit': 'kg/hr', 'expr': '`mf_H2PROD`', 'scalable': True},
+       {'name': 'CLHRSG', 'unit': 'Gcal/hr', 'expr': '`hr_S11-10` + `hr_S11-20` + `hr_S11-50`', 'scalable': True}]
+    + [{'name': name, 'unit': 'Gcal/hr', 'expr': '`ci_{}` - `co_{}`'.format(ci, co), 'scalable': True}
+       for name, ci, co in zip(['RC1', 'RC2', 'OC1', 'OC2', 'CC'], cis, cos)]
+    + [{'name': 'AirMass', 'unit': 'kg/hr', 'expr': '`mf_S10-10`', 'scalable': True},
+       {'name': 'H2vf', 'unit': 'm3/hr', 'expr': '`vf_S12-16`', 'scalable': True},
+       {'name': 'CO2vf', 'unit': 'm3/hr', 'expr': '`vf_S12-54`', 'scalable': True},
+       {'name': 'RGvf', 'unit': 'm3/hr', 'expr': '`vf_S12-20`', 'scalable': True},
+       {'name': 'OGvf', 'unit': 'm3/hr', 'expr': '`vf_S12-02`', 'scalable': True},
+       {'name': 'CGvf', 'unit': 'm3/hr', 'expr': '`vf_CGC1`', 'scalable': True},
+       {'name': 'Electricity', 'unit': 'kW', 'expr': ' + '.join('`e_{}`'.format(equip) for equip in wequips),
+        'scalable': True},
+       {'name': 'NGMass', 'unit': 'kg/hr', 'expr': '`mf_S10-01`', 'scalable': True},
+       {'name': 'SteamOut', 'unit': 'kg/hr', 'expr': '`mf_S81-62O` - `mf_S81-62`', 'scalable': True},
+       {'name': 'CO2Mass', 'unit': 'kg/hr', 'expr': '`mf_PureCO2`', 'scalable': True}]
+    + [{'name': cali, 'unit': 'm3/hr', 'expr': '`vf_{}`'.format(cali), 'scalable': True} for cali in cal]
+)
+summary = aspen_metrics.MetricTable(metrics, basis='`mf_H2PROD`', basis_value=4632.96)
+
 t0=time.time()
 
-##Case count for memory dump
-case_count = 0
 
-for l in range(q):
-    #oxygen carrier composition setting
-    fewt=q_lb+l*dq
-    tiwt=0.21
-    alwt=1.0-fewt-tiwt
-    #？？？ how to findnode: customize>> variable explorer
-    # findnode 放在变量前面是赋值，放在后面是取值。
-    aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\FE2O3").Value=fewt
-    aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\TIO2").Value=tiwt
-    aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\AL2O3").Value=alwt
-    #Application.Tree.FindNode("\Data\Blocks\CBOIL1\Input\TEMP")
-    for k in range(p):
-        #reducer bottom solid conversion
-        Inp_rbsc=p_lb+k*dp
-        aspen.Tree.FindNode("\Data\Flowsheeting Options\Design-Spec\REDSCONV\Input\EXPR2").Value=str(Inp_rbsc)
-
-        for j in range(n):
-            #Reducer top T and combustor outlet T, in degree C
-            Red_T=n_lb+j*dn
-            aspen.Tree.FindNode("\Data\Streams\S11-07\Input\TEMP\CISOLID").Value=Red_T
-            
-            for wi in range(w):
-                Steam_T=w_lb+wi*dw
-                aspen.Tree.FindNode("\Data\Blocks\HRSG\Input\VALUE\S84-03").Value=Steam_T
-
-                for i in range(m):
-                    print("i = ",i,";j = ",j,"k = ",k,"l = ",l,"w =",wi,";second:",time.time()-t0)
-                    #Air preheat temperature, in degree C
-                    Air_T=m_lb+i*dm
-                    aspen.Tree.FindNode("\Data\Blocks\HRSG\Input\VALUE\S10-11").Value=Air_T
-                 #   print('Air_T')
-                    #Model run
-                    aspen.Reinit()
-                    aspen.Engine.Run2()
-        
-                    errall=''
-                    errormessage=[]
-
-
-
-
-                    for e in aspen.Tree.FindNode("\Data\Results Summary\Run-Status\Output\PER_ERROR").Elements:   
-                        print (e.Value)
-                        errormessage += e.value
-                        if '=' in errormessage:
-                            break
-                    """
-                    if ppp==1:
-                        print(aspen)
-                        print(aspen.Tree.FindNode("\Data\Streams\S11-02\Output\MOLEFLOW\CISOLID\{}".format(solid)).Value)
-    
-                    """
-                    errall=errall.join(errormessage)
-                    if 'error' in errall:
-                        errall='error'
-                    else:
-                        errall = 'OK'
-# l in q; k in p; j in n; i in m;
-#Error message
-#mer=aspen.Tree.FindNode("\Data\Results Summary\Run-Status\Output\PER_ERROR").Value
-#if mer=1:
-#    print
-
-#Data record
-
-#df_out=pd.DataFrame(columns = solids)
-
-# These variable have values only after running
-# {} symbol can be used to substitute a variable
-                        for solid in solids:
-                            df_rb.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(solid)]=aspen.Tree.FindNode("\Data\Streams\S11-02\Output\MOLEFLOW\CISOLID\{}".format(solid)).Value
-                            df_ob.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(solid)]=aspen.Tree.FindNode("\Data\Streams\S11-03\Output\MOLEFLOW\CISOLID\{}".format(solid)).Value
-    # l in q; k in p; j in n; i in m; 
-                        for equip in wequips:
-                            df_e.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(equip)]=aspen.Tree.FindNode("\Data\Blocks\{}\Output\WNET".format(equip)).Value
-                    
-                        for mf in gmfs:
-                            df_mf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(mf)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\MASSFLMX\MIXED".format(mf)).Value
-        
-                        df_mf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'S11-07']=aspen.Tree.FindNode("\Data\Streams\S11-07\Output\MASSFLMX\CISOLID").Value
-                        df_mf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'PureCO2']=aspen.Tree.FindNode("\Data\Streams\S20-10\Output\MASSFLOW\MIXED\CO2").Value
-            
-                        for vf in vfs:
-                            df_vf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(vf)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\VOLFLMX\MIXED".format(vf)).Value
-            
-                        for st in sts:
-                            df_t.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(st)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\TEMP_OUT\CISOLID".format(st)).Value
-            
-                        for gt in gts:
-                            df_t.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(gt)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\TEMP_OUT\MIXED".format(gt)).Value
-                
-                        for mfr in mfrs:
-                            df_mfr.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(mfr)]=aspen.Tree.FindNode("\Data\Streams\S11-07\Output\MASSFRAC\CISOLID\{}".format(mfr)).Value
-                
-                        for hr in hrs:
-                            df_hr.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(hr)]=-aspen.Tree.FindNode("\Data\Blocks\HRSG\Output\QCALC\{}".format(hr)).Value
-                
-                            # HMX_FLOW == ENTHALPY FLOW GCAL/hr
-                        for ci in cis:
-                            df_ci.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(ci)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\HMX_FLOW\$TOTAL".format(ci)).Value
-                
-                        for co in cos:
-                            df_co.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(co)]=aspen.Tree.FindNode("\Data\Streams\{}\Output\HMX_FLOW\$TOTAL".format(co)).Value
-                        
-                        kk=0;
-                        for cali in cal:
-                            df_rou.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(cali)]=aspen.Tree.FindNode("Data\Streams\{}\Output\RHOMX_MASS\MIXED".format(cali)).Value
-                            df_vis.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'{}'.format(cali)]=aspen.Tree.FindNode("\Data\Flowsheeting Options\Calculator\VISCO\Output\READ_VAL").Elements.Item(kk).value
-                            kk=kk+1
-                            
-                        df_nf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'S10-01']=aspen.Tree.FindNode("\Data\Streams\S10-01\Output\MOLEFLMX\MIXED").Value
-                        df_nf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'Fe2O3In']=aspen.Tree.FindNode("\Data\Streams\S11-07\Output\MOLEFLOW\CISOLID\FE2O3").Value
-                        df_nf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'PureH2']=aspen.Tree.FindNode("\Data\Streams\H2PROD\Output\MOLEFLOW\MIXED\H2").Value
-                        df_nf.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'ReducerCarbon']=aspen.Tree.FindNode("\Data\Streams\S11-02\Output\MOLEFLOW\CISOLID\CARBON").Value
-                    df_err.at[l*m*n*w*p+k*m*n*w+j*m*w+wi*m+i+1,'error']=errall
-                    case_count += 1
-                    print ('Case ', case_count, 'Complete')
-                
-                ##Restart
-                
-                    if case_count %50 == 0 or case_count == m*n*q*p*w:
-                        print('RESTART ASPEN')
-                        for proc in psutil.process_iter():
-                            # check whether the process name matches
-                            # print(proc.name())
-                            if any(procstr in proc.name() for procstr in\
-                                       ['AspenPlus','Aspen','apmain']):
-                                print(f'Killing {proc.name()}')
-                                proc.kill()                            
-                                time.sleep(2)
-                    #aspen.Close()
-                        if case_count != m*n*q*p*w:
-                            aspen = win32.Dispatch('Apwn.Document')
-                            aspen.InitFromArchive2(os.path.abspath(file_name))
-                            #value input for current loop
-                            aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\FE2O3").Value=fewt
-                            aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\TIO2").Value=tiwt
-                            aspen.Tree.FindNode("\Data\Streams\S11-07\Input\FLOW\CISOLID\AL2O3").Value=alwt
-                            aspen.Tree.FindNode("\Data\Flowsheeting Options\Design-Spec\REDSCONV\Input\EXPR2").Value=str(Inp_rbsc)
-                            aspen.Tree.FindNode("\Data\Blocks\HRSG\Input\VALUE\S84-03").Value=Steam_T
-                            aspen.Tree.FindNode("\Data\Streams\S11-07\Input\TEMP\CISOLID").Value=Red_T
-
-                    #aspen.Tree.FindNode("\Data\Streams\S11-07\Input\TEMP\CISOLID").Value=Red_T
-                    #aspen.Reinit()
-                    #aspen.Engine.Run2()
-                 
+def case_done(index, result):
+    logger.info('case complete', extra={'case': index + 1, 'status': result['status'],
+                                        'elapsed': time.time() - t0})
+
+
+screen = None
+if args.screen:
+    # skip the cases a surrogate trained on the finished cases predicts to fail, run the rest most informative first
+    screen = aspen_surrogate.SurrogateScreen(targets=['H2NGR', 'RBSC', 'Electricity(kW)'], derive=summary.evaluate)
+runner = aspen_sweep.SweepRunner(aspen_sweep.SweepSpec.from_dict(spec), session=pyaspen, journal_path=journal_file,
+                                 screen=screen)
+if args.sensitivity:
+    # which variables drive H2 yield and electricity: 10 Morris trajectories take 50 cases, 32 Sobol base samples
+    # take 192, instead of the 420 of the full grid; the ranking with confidence intervals goes to a csv
+    analysis = aspen_sensitivity.SensitivityAnalysis(runner, targets=['H2NGR', 'Electricity(kW)'], method=args.sensitivity,
+                                                     n=10 if args.sensitivity == 'morris' else 32, derive=summary.evaluate)
+    df_sens = analysis.run(callback=case_done, resume=args.resume)
+    print(df_sens)
+    df_sens.to_csv('Fe32_SC_AirT_CT_{}.csv'.format(args.sensitivity))
+else:
+    runner.run(callback=case_done, resume=args.resume)
+
 t=time.time()-t0
 print("Running time:",t,"seconds")
-    
-df_prop=pd.DataFrame()
-df_scale=pd.DataFrame()
-
-df_qi=df_ci
-df_qi.columns=cus
-df_qo=df_co
-df_qo.columns=cus
-df_Q=df_qi-df_qo
-
-#unscalable variables
-df_prop['Fe2O3 wt']=df_mfr['FE2O3']
-df_prop['RBSC']=1-(df_rb['FE0947O']+df_rb['FE3O4']*4).divide(df_nf['Fe2O3In']*3)
-df_prop['OBSC']=1-(df_ob['FE0947O']+df_ob['FE3O4']*4).divide(df_nf['Fe2O3In']*3)
-df_prop['H2NGR']=df_nf['PureH2'].divide(df_nf['S10-01'])
-df_prop['NGInT(C)']=df_t['S10-06']
-df_prop['STInT(C)']=df_t['STGEN']
-df_prop['AirInT(C)']=df_t['S10-12']
-df_prop['RedBT(C)']=df_t['S11-02']
-df_prop['OxBT(C)']=df_t['S11-03']
-df_prop['CombT(C)']=df_t['S11-07']
-df_prop['error']=df_err['error']
-
-df_prop['S11-50(kg/cum)']=df_rou['S11-50']
-df_prop['S10-12(kg/cum)']=df_rou['S10-12']
-df_prop['OG5(kg/cum)']=df_rou['OG5']
-df_prop['S11-20(kg/cum)']=df_rou['S11-20']
-df_prop['RG5(kg/cum)']=df_rou['RG5']
-df_prop['S11-10(kg/cum)']=df_rou['S11-10']
-
-df_prop['S11-50(N-SEC/SQM)']=df_vis['S11-50']
-df_prop['S10-12(N-SEC/SQM)']=df_vis['S10-12']
-df_prop['OG5(N-SEC/SQM)']=df_vis['OG5']
-df_prop['S11-20(N-SEC/SQM)']=df_vis['S11-20']
-df_prop['RG5(N-SEC/SQM)']=df_vis['RG5']
-df_prop['S11-10(N-SEC/SQM)']=df_vis['S11-10']
-
-
-
-#scalable variables
-df_scale['NGMole(kmol/hr)']=df_nf['S10-01']
-df_scale['SolidFlow(kg/hr)']=df_mf['S11-07']
-df_scale['H2Mass(kg/hr)']=df_mf['H2PROD']
-df_scale['CLHRSG(Gcal/hr)']=df_hr['S11-10']+df_hr['S11-20']+df_hr['S11-50']
-df_scale['RC1(Gcal/hr)']=df_Q['1202E02']
-df_scale['RC2(Gcal/hr)']=df_Q['1202E03']
-df_scale['OC1(Gcal/hr)']=df_Q['1203E03']
-df_scale['OC2(Gcal/hr)']=df_Q['1203E04']
-df_scale['CC(Gcal/hr)']=df_Q['1201E02']
-df_scale['AirMass(kg/hr)']=df_mf['S10-10']
-df_scale['H2vf(m3/hr)']=df_vf['S12-16']
-df_scale['CO2vf(m3/hr)']=df_vf['S12-54']
-df_scale['RGvf(m3/hr)']=df_vf['S12-20']
-df_scale['OGvf(m3/hr)']=df_vf['S12-02']
-df_scale['CGvf(m3/hr)']=df_vf['CGC1']
-df_scale['Electricity(kW)']=df_e.sum(axis=1)
-df_scale['NGMass(kg/hr)']=df_mf['S10-01']
-df_scale['SteamOut(kg/hr)']=df_mf['S81-62O']-df_mf['S81-62']
-df_scale['CO2Mass(kg/hr)']=df_mf['PureCO2']
-df_scale['S11-50(m3/hr)']=df_vf['S11-50']
-df_scale['S10-12(m3/hr)']=df_vf['S10-12']
-df_scale['OG5(m3/hr)']=df_vf['OG5']
-df_scale['S11-20(m3/hr)']=df_vf['S11-20']
-df_scale['RG5(m3/hr)']=df_vf['RG5']
-df_scale['S11-10(m3/hr)']=df_vf['S11-10']
-
-
-
-#scale to 4632 kg/hr H2 production
-df_all=pd.DataFrame(columns=list(df_prop)+list(df_scale))
-
-for pr in list(df_prop):
-    df_all['{}'.format(pr)]=df_prop['{}'.format(pr)]
-
-for sc in list(df_scale):
-    df_all['{}'.format(sc)]=df_scale['{}'.format(sc)].divide(df_mf['H2PROD'])*4632.96
-
-#aspen.Close()
-
-with pd.ExcelWriter('Fe32_SC_AirT_CT.xlsx') as writer:
-    df_tc.to_excel(writer, sheet_name='Info')
-    df_all.to_excel(writer, sheet_name='Summary')
-    df_e.to_excel(writer, sheet_name='Electricity')
-    df_mf.to_excel(writer, sheet_name='Mass Flow')
-    df_mfr.to_excel(writer, sheet_name='Mass Frac')
-    df_nf.to_excel(writer, sheet_name='Mole Flow')
-    df_rb.to_excel(writer, sheet_name='Reducer Bottom Mole Flow')
-    df_ob.to_excel(writer, sheet_name='Oxidizer Bottom Mole Flow')
-    df_t.to_excel(writer, sheet_name='Stream temp')
-    df_vf.to_excel(writer, sheet_name='Volume flow')
-    df_Q.to_excel(writer, sheet_name='Heat Duty')
\ No newline at end of file
+print("Output reads:",runner.spec.manifest.read_stats())
+
+pyaspen.terminate_engine()
+
+# the results are built from the journal, which holds the cases of this and any earlier resumed run.
+# they are saved as a Parquet dataset, one directory per Fe2O3 wt% of the grid, with the variable ranges embedded;
+# load it with aspen_dataset.read_dataset(dataset_dir), which memory-maps the files, instead of parsing the xlsx
+aspen_dataset.write_dataset(aspen_sweep.read_journal(journal_file), dataset_dir,
+                            metadata={'VarRange': df_tc['VarRange'].tolist(), 'spec': spec},
+                            partition_by=None if args.sensitivity else ['fewt'])
+
+if args.excel:
+    def outputs(prefix, names):
+        """one group of outputs of the result table, columns named by stream/block"""
+        return lambda df: df[[prefix+name for name in names]].set_axis(names, axis=1)
+
+    def summary_sheet(df):
+        df_all = summary.evaluate(df)
+        df_all.insert(df_all.columns.get_loc('CombT(C)')+1, 'error', df['status'])
+        return df_all
+
+    # heat duty of each cooler: enthalpy flow in minus enthalpy flow out
+    heat_duty = aspen_metrics.MetricTable([{'name': cu, 'expr': '`ci_{}` - `co_{}`'.format(ci, co)}
+                                           for cu, ci, co in zip(cus, cis, cos)])
+
+    # the workbook is streamed from the dataset a batch of cases at a time, the Info sheet holds VarRange
+    aspen_dataset.export_excel(dataset_dir, 'Fe32_SC_AirT_CT.xlsx', {
+        'Summary': summary_sheet,
+        'Electricity': outputs('e_', wequips),
+        'Mass Flow': outputs('mf_', gmfs+['S11-07','PureCO2']),
+        'Mass Frac': outputs('mfr_', mfrs),
+        'Mole Flow': outputs('nf_', nfs+['Fe2O3In']+['PureH2']+['ReducerCarbon']),
+        'Reducer Bottom Mole Flow': outputs('rb_', solids), #reducer bottom iron oxide molar flow rate
+        'Oxidizer Bottom Mole Flow': outputs('ob_', solids), #oxidizer bottom iron oxide molar flow rate
+        'Stream temp': outputs('t_', sts+gts),
+        'Volume flow': outputs('vf_', vfs),
+        'Heat Duty': heat_duty.evaluate,
+        'Cases': lambda df: df,
+    })
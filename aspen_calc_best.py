@@ -1,5 +1,5 @@
 import os
-import time
+import logging
 
 from openpyxl import Workbook, load_workbook
 
@@ -12,6 +12,9 @@ import pandas as pd
 import psutil
 
 
+logger = logging.getLogger('py_aspen.calibration')
+
+
 def get_pid(process_name):
     for proc in psutil.process_iter():
         if proc.name() == process_name:
@@ -241,25 +244,14 @@ def get_call_address(filename):
 
     print("Created df_aspen_out_getcall")
 
-    # Create a dictionary to store all new column data
-    new_columns = {}
-    # Store REGEN_LIQ column data
-    for j in range(1, 42):
-        column_name = f'REGEN_LIQ_{j}'
-        column_value = extract_node_value((export_data_getcall.iloc[10, 13]).rsplit('\\', 1)[0] + f'\\{j}' + "\")")
-        new_columns[column_name] = column_value
-
-    # Store ABSORBER_LIQ column data
-    for j in range(1, 91):
-        column_name = f'ABSORBER_LIQ_{j}'
-        column_value = extract_node_value((export_data_getcall.iloc[20, 13]).rsplit('\\', 1)[0] + f'\\{j}' + "\")")
-        new_columns[column_name] = column_value
-
-    # Convert the dictionary to a DataFrame
-    new_columns_df = pd.DataFrame([new_columns])
+    # Stage profiles are read as whole Elements collections, so only the parent node is stored
+    profile_columns = {}
+    for column_name, row in (('REGEN_LIQ', 10), ('ABSORBER_LIQ', 20)):
+        profile_columns[column_name] = extract_node_value(
+            (export_data_getcall.iloc[row, 13]).rsplit('\\', 1)[0] + "\")")
 
-    # Merge the new DataFrame with the original df_aspen_out_getcall
-    df_aspen_out_getcall = pd.concat([df_aspen_out_getcall, new_columns_df], axis=1)
+    # Merge the profile addresses with the original df_aspen_out_getcall
+    df_aspen_out_getcall = pd.concat([df_aspen_out_getcall, pd.DataFrame([profile_columns])], axis=1)
 
     print("Processed additional REGEN_LIQ and ABSORBER_LIQ columns")
 
@@ -311,30 +303,33 @@ def check_convergence(stream_in_add_che, stream_back_add_che):
             pyaspen.run_simulation(reinit=True)
         i0 = 1
         """
-        print("Ran Aspen simulation in convergence check")
         aspen_runs += 1
-        print(f"Total counts: {aspen_runs}")
         last_error = pyaspen.result_error()
-        print(last_error)
+        pyaspen.checkpoint(last_error)
+        logger.info('convergence check run', extra={'runs': aspen_runs, 'status': last_error,
+                                                    'solve_time': pyaspen.last_solve_time})
         if last_error == "error":
             flowrate = pyaspen.get_target_value1(ABSLEAN_FR) - 100
             pyaspen.assign_node_value1(flowrate, ABSLEAN_FR)
             divergence += 100
-            print(f"ABSLEAN flowrate: {flowrate}, divergence: {divergence}, divergence0: {diver0}")
+            logger.warning('ABSLEAN flowrate reduced', extra={'flowrate': flowrate, 'divergence': divergence,
+                                                              'divergence0': diver0})
 
     stream_in_values = pyaspen.get_target_value1(stream_in_add_che)
     stream_back_values = pyaspen.get_target_value1(stream_back_add_che)
-    print(np.array(stream_back_values))
-    print(np.array(stream_in_values))
     relative_error = np.abs((np.array(stream_back_values) - np.array(stream_in_values)) / np.array(stream_in_values))
     rmsre = np.sqrt(np.mean(relative_error ** 2))
-    print("relative error RMSRE of H2O in Stream S6")
-    print(rmsre)
+    logger.info('H2O recycle check', extra={'stream_in': stream_in_values, 'stream_back': stream_back_values,
+                                            'rmsre': rmsre})
     return rmsre
 
 
-def run_aspen(t_h2oin: int, aspen_file: str, direct: str, target_temp: float,
-              duty_range: (float, float), num_points: int):
+def scan_duty(t_h2oin: int, target_temp: float, duty_range: (float, float), num_points: int):
+    """
+    Evaluates num_points intercooler duties evenly spaced on duty_range, reducing the ABSLEAN flowrate
+    until each run converges. Returns the duty whose stage 25 liquid temperature is closest to target_temp
+    and its distance to it.
+    """
     global divergence
     global pyaspen
     global aspen_runs
@@ -357,51 +352,202 @@ def run_aspen(t_h2oin: int, aspen_file: str, direct: str, target_temp: float,
                 pyaspen.run_simulation(reinit=True)
             i1 = 1
             """
-            print("Ran Aspen simulation in duty loop")
             aspen_runs += 1
-            print(f"Total counts: {aspen_runs}")
             last_error = pyaspen.result_error()
-            print(last_error)
+            pyaspen.checkpoint(last_error)
+            logger.info('duty loop run', extra={'runs': aspen_runs, 'duty': duty, 'status': last_error,
+                                                'solve_time': pyaspen.last_solve_time})
             if last_error == "error":
                 flowrate = pyaspen.get_target_value1(ABSLEAN_FR) - 100
                 pyaspen.assign_node_value1(flowrate, ABSLEAN_FR)
                 divergence += 100
-                print(f"ABSLEAN flowrate: {flowrate}, divergence: {divergence}, divergence0: {diver0}")
+                logger.warning('ABSLEAN flowrate reduced', extra={'flowrate': flowrate, 'divergence': divergence,
+                                                                  'divergence0': diver0})
 
-        print(f"intercooler duty:")
-        print(duty)
         last_error = pyaspen.result_error()
-        print(last_error)
         current_temp = pyaspen.get_target_value1(r"\Data\Blocks\ABSORBER\Output\TLIQ\25")
-        print("input temp for H2OIN:")
-        print(t_h2oin)
-        print("absorber stage 25 temp:")
-        print(current_temp)
-        print("absorber stage 26 temp:")
-        print(pyaspen.get_target_value1(r"\Data\Blocks\ABSORBER\Output\TLIQ\26"))
+        logger.info('intercooler duty evaluated', extra={'duty': duty, 'status': last_error, 't_h2oin': t_h2oin,
+                                                         'tliq_25': current_temp})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('absorber stage 26 temperature',
+                         extra={'tliq_26': pyaspen.get_target_value1(r"\Data\Blocks\ABSORBER\Output\TLIQ\26")})
         diff = abs(current_temp - target_temp)
         if diff < smallest_diff and last_error == 'OK':
             smallest_diff = diff
             closest_duty = duty
-            print(f"smallest difference of temperature for Stage 25: {smallest_diff}")
-
-        # restart
-        if round(aspen_runs) % 30 == 0:
-            print('RESTART ASPEN')
-            for proc_run in psutil.process_iter():
-                if any(procstr in proc_run.name() for procstr in ['AspenPlus', 'Aspen', 'apmain']):
-                    print(f'Killing {proc_run.name()}')
-                    proc_run.kill()
-                    time.sleep(2)
-
-            pyaspen = py_aspen.PyASPENPlus()
-            pyaspen.init_app("11.0")
-            print("Initialized Aspen application")
-            pyaspen.load_ap_file(aspen_file, direct)
-            import_initial_conditions(df_excel_in_value, df_aspen_in)
-            flowrate = pyaspen.get_target_value1(ABSLEAN_FR) - divergence - diver0
-            pyaspen.assign_node_value1(flowrate, ABSLEAN_FR)
-            pyaspen.assign_node_value1(t_h2oin, r'\Data\Streams\H2OIN\Input\TEMP\MIXED')
+            logger.info('closer stage 25 temperature', extra={'duty': duty, 'smallest_diff': smallest_diff})
+
+        # restart this session's engine only when its health degrades; the restart re-applies
+        # every input written so far (initial conditions, ABSLEAN flowrate, H2OIN temperature, duty)
+        pyaspen.recycle_if_needed()
+
+    return closest_duty, smallest_diff
+
+
+def find_root(f, a: float, b: float, tol: float, xtol: float = 1e-6, method: str = 'brent', max_evals: int = 10,
+              max_failures: int = 3, x0: float = None):
+    """
+    Bracketed root finding of f on [a, b] with Brent's method or the Illinois variant of regula falsi.
+    With a guess x0 (e.g. the previous solution) the bracket is narrowed around it: x0 and a are evaluated,
+    and if they do not bracket the root, a point just past the secant estimate beyond x0 is tried before b.
+    f(x) returns None when the evaluation fails; the point is then pulled halfway towards the best point
+    (a quarter of the way into the bracket for its ends), at most max_failures times in a row, so the
+    bracket shrinks away from the failed region.
+    Stops when |f| <= tol, the bracket is narrower than xtol or max_evals evaluations are used.
+    Returns (best x, f at best x, number of evaluations, last evaluated x); best x is None when
+    [a, b] does not bracket a root.
+    """
+    evals = [0]
+    best = [None, None]
+    last = [None]
+
+    def probe(x, toward, pull=0.5):
+        for _ in range(max_failures + 1):
+            if evals[0] >= max_evals:
+                return None, None
+            evals[0] += 1
+            last[0] = x
+            fx = f(x)
+            if fx is not None and np.isfinite(fx):
+                if best[1] is None or abs(fx) < abs(best[1]):
+                    best[:] = [x, fx]
+                return x, fx
+            x += (toward - x) * pull
+        return None, None
+
+    x = None
+    if x0 is not None and min(a, b) < x0 < max(a, b):
+        x, fx = probe(x0, (a + b) / 2)
+        if x is not None and abs(fx) <= tol:
+            return x, fx, evals[0], last[0]
+    a, fa = probe(a, b, 0.25)
+    if a is None:
+        return None, None, evals[0], last[0]
+    bracketed = False
+    if x is not None and fa * fx <= 0:
+        b, fb, bracketed = x, fx, True
+    elif x is not None:
+        s = x + 1.5 * (-fx * (x - a) / (fx - fa)) if fx != fa else b
+        a, fa = x, fx
+        if min(x, b) < s < max(x, b):
+            s, fs = probe(s, x)
+            if s is not None and fs * fx <= 0:
+                b, fb, bracketed = s, fs, True
+            elif s is not None:
+                a, fa = s, fs
+    if not bracketed:
+        b, fb = probe(b, a, 0.25)
+        if b is None or fa * fb > 0:
+            return None, None, evals[0], last[0]
+
+    def done(width):
+        return abs(best[1]) <= tol or width <= xtol or evals[0] >= max_evals
+
+    if method == 'illinois':
+        side = 0
+        while not done(abs(b - a)):
+            s, fs = probe((a * fb - b * fa) / (fb - fa), a if abs(fa) < abs(fb) else b)
+            if s is None:
+                break
+            if fs * fb > 0:
+                b, fb = s, fs
+                if side == -1:
+                    fa /= 2
+                side = -1
+            elif fs * fa > 0:
+                a, fa = s, fs
+                if side == 1:
+                    fb /= 2
+                side = 1
+            else:
+                break
+    elif method == 'brent':
+        # cur is the best point so far, blk the other end of the bracket and pre the previous point
+        pre, fpre, cur, fcur = a, fa, b, fb
+        blk, fblk = pre, fpre
+        step = last_step = cur - pre
+        while True:
+            if fpre * fcur < 0:
+                blk, fblk = pre, fpre
+                step = last_step = cur - pre
+            if abs(fblk) < abs(fcur):
+                pre, cur, blk = cur, blk, cur
+                fpre, fcur, fblk = fcur, fblk, fcur
+            bisect = (blk - cur) / 2
+            if done(2 * abs(bisect)):
+                break
+            if abs(last_step) > xtol / 2 and abs(fcur) < abs(fpre):
+                if pre == blk:  # secant
+                    trial = -fcur * (cur - pre) / (fcur - fpre)
+                else:  # inverse quadratic interpolation
+                    dpre, dblk = (fpre - fcur) / (pre - cur), (fblk - fcur) / (blk - cur)
+                    trial = -fcur * (fblk * dblk - fpre * dpre) / (dblk * dpre * (fblk - fpre))
+                if 2 * abs(trial) < min(abs(last_step), 3 * abs(bisect) - xtol / 2):
+                    last_step, step = step, trial
+                else:
+                    last_step = step = bisect
+            else:
+                last_step = step = bisect
+            pre, fpre = cur, fcur
+            cur, fcur = probe(cur + (step if abs(step) > xtol / 2 else np.copysign(xtol / 2, bisect)), pre)
+            if cur is None:
+                break
+    else:
+        raise ValueError(f'unknown root finding method: {method}')
+    return best[0], best[1], evals[0], last[0]
+
+
+def run_aspen(t_h2oin: int, target_temp: float, duty_range: (float, float), num_points: int,
+              method: str = 'brent', tol: float = 0.05, max_evals: int = 8):
+    """
+    Sets the stage 25 intercooler duty so that the stage 25 liquid temperature reaches target_temp.
+    method 'brent' or 'illinois' solves TLIQ(duty) - target_temp = 0 on duty_range to within tol C;
+    'scan' (and the root finding when duty_range does not bracket the target) evaluates num_points
+    duties evenly spaced on duty_range and keeps the closest one.
+    The root finding starts from the duty solved by the previous call, which is usually close.
+    The loaded .bkp file is restarted by pyaspen.recycler when needed; t_h2oin is only logged.
+    """
+    global pyaspen
+    global aspen_runs
+    global last_error
+    global solved_duty
+
+    closest_duty = None
+    if method != 'scan':
+        def tliq_error(duty):
+            global aspen_runs
+            global last_error
+            pyaspen.assign_node_value1(duty, r"\Data\Blocks\ABSORBER\Input\HEATER_DUTY\25")
+            pyaspen.run_simulation(reinit=True)
+            aspen_runs += 1
+            last_error = pyaspen.result_error()
+            pyaspen.checkpoint(last_error)
+            current_temp = None
+            if last_error == 'OK':
+                current_temp = pyaspen.get_target_value1(r"\Data\Blocks\ABSORBER\Output\TLIQ\25")
+            logger.info('intercooler duty evaluated', extra={'duty': duty, 'status': last_error, 't_h2oin': t_h2oin,
+                                                             'tliq_25': current_temp, 'method': method,
+                                                             'runs': aspen_runs,
+                                                             'solve_time': pyaspen.last_solve_time})
+            pyaspen.recycle_if_needed()
+            return None if current_temp is None else current_temp - target_temp
+
+        closest_duty, diff, evals, last_duty = find_root(tliq_error, duty_range[0], duty_range[1], tol,
+                                                         method=method, max_evals=max_evals, x0=solved_duty)
+        if closest_duty is None:
+            logger.warning('duty range does not bracket the target temperature, scanning it',
+                           extra={'duty_range': list(duty_range), 'evals': evals, 't_h2oin': t_h2oin})
+        else:
+            smallest_diff = abs(diff)
+            logger.info('intercooler duty solved', extra={'duty': closest_duty, 'smallest_diff': smallest_diff,
+                                                          'evals': evals, 'method': method})
+            solved_duty = closest_duty
+            if closest_duty == last_duty and last_error == 'OK':
+                return smallest_diff  # the flowsheet already holds the solution
+
+    if closest_duty is None:
+        closest_duty, smallest_diff = scan_duty(t_h2oin, target_temp, duty_range, num_points)
+        solved_duty = closest_duty
 
     pyaspen.assign_node_value1(closest_duty, r"\Data\Blocks\ABSORBER\Input\HEATER_DUTY\25")
     pyaspen.run_simulation()
@@ -421,7 +567,13 @@ def export_data(df_aspen_out_exp: pd.DataFrame):
     df_aspen_out_value = {}
     for key in df_aspen_out_exp.columns:
         address = df_aspen_out_exp[key].iloc[0]
-        df_aspen_out_value[key] = pyaspen.get_target_value1(str(address))
+        if key in PROFILE_OUTPUTS:
+            # One traversal per profile, expanded to REGEN_LIQ_1, REGEN_LIQ_2, ...
+            labels, values = pyaspen.get_profile(str(address))
+            for label, value in zip(labels, values):
+                df_aspen_out_value[f'{key}_{label}'] = float(value)
+        else:
+            df_aspen_out_value[key] = pyaspen.get_target_value1(str(address))
 
     df_aspen_out_value = pd.DataFrame.from_dict(df_aspen_out_value, orient='index', columns=['Value'])
 
@@ -517,10 +669,14 @@ for i in range(1, 703):  # 1 to 702 (corresponding to 'A' to 'ZZ')
 
 print("Column index mapping created successfully.")
 ABSLEAN_FR = r"\Data\Streams\ABSLEAN\Input\TOTFLOW\MIXED"
+PROFILE_OUTPUTS = ('REGEN_LIQ', 'ABSORBER_LIQ')  # outputs read as whole stage profiles
+
+py_aspen.configure_logging('aspen_calc_best_log.jsonl', level=logging.INFO)
 
 file_name = r'address.xlsx'
 aspen_runs = 1
 last_error = 'OK'
+solved_duty = None  # intercooler duty solved in the previous H2OIN loop, the next loop starts from it
 df_excel_addr, df_aspen_in, df_aspen_out, df_excel_input, df_excel_in_value = get_call_address(file_name)
 print("Completed get_call_address function")
 
@@ -529,6 +685,8 @@ file_dir = os.getcwd()
 
 pyaspen = py_aspen.PyASPENPlus()
 pyaspen.init_app("11.0")
+pyaspen.recycler = py_aspen.EngineRecycler(max_rss_mb=2048, max_handles=10000, max_latency_ratio=3.0)
+pyaspen.snapshot_interval = 5  # save a converged snapshot every 5 converged runs; restarts resume from it
 print("Initialized Aspen application")
 
 pyaspen.load_ap_file(aspen_file_name, file_dir)
@@ -546,17 +704,14 @@ error1 = 0.01  # relative error for H2O convergence allowed
 gasin_temp = pyaspen.get_target_value1(r'\Data\Streams\GASIN\Input\TEMP\MIXED')
 while check_convergence(stream_in_add, stream_out_add) > error1:
     count += 1
-    print(f"Ran Aspen simulation with loop {count} start!")
     if count > 20:
-        print(f"The simulation does not converge as expected, but has run {count - 1} loops")
+        logger.warning('H2OIN loop did not converge', extra={'loops': count - 1})
         break
     T_H2Oin = (gasin_temp - 10 + count * 1)
     pyaspen.assign_node_value1(T_H2Oin, r'\Data\Streams\H2OIN\Input\TEMP\MIXED')
-    print(f"Start simulate H2OIN temp = {T_H2Oin}")
-    print("assign node value finished")
-    small_diff = run_aspen(T_H2Oin, aspen_file_name, file_dir, 40, (-35, -5), 5)
-    print(
-        f"Ran Aspen simulation with loop {count} finished, H2OIn has a temperature of {T_H2Oin}, the intercooling temperature difference is {small_diff}")
+    with py_aspen.case_context(f'h2oin-{count}'):
+        small_diff = run_aspen(T_H2Oin, 40, (-35, -5), 5, method='brent', tol=0.05)
+    logger.info('H2OIN loop finished', extra={'loop': count, 't_h2oin': T_H2Oin, 'smallest_diff': small_diff})
 
 export_data(df_aspen_out)
 print("Exported data from Aspen to Excel")
@@ -564,9 +719,5 @@ print("Exported data from Aspen to Excel")
 pyaspen.close_app()
 print("Closed Aspen application")
 
-for proc in psutil.process_iter():
-    if any(procstr in proc.name() for procstr in ['AspenPlus', 'Aspen', 'apmain']):
-        print(f'Killing {proc.name()}')
-        proc.kill()
-        time.sleep(2)
+pyaspen.terminate_engine()
 print("Terminated AspenPlus process")
@@ -0,0 +1,147 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+METADATA_KEY = b'aspen_sweep'  # 数据集 schema 中存放扫描元数据的键
+COMMON_METADATA = '_common_metadata'
+
+
+def write_dataset(frame: pd.DataFrame, path: str, metadata: dict = None, partition_by: list = None,
+                  rows_per_file: int = None, compression: str = 'zstd'):
+    """将结果表写为分区的 Parquet 数据集, 需要 pyarrow
+
+    每列保留类型(输出为 float64, status 为字符串, 工况序号为索引), metadata 以 JSON 存入 schema,
+    完整的 schema 另存于 _common_metadata, 读取时不依赖分区目录名推断类型.
+
+    :param frame: 结果表, 如 SweepRunner.run 或 aspen_sweep.read_journal 的结果
+    :param path: 数据集目录, 已存在时其中的数据文件被覆盖
+    :param metadata: 扫描的说明, 如 {'VarRange': [...]}, 须可转为 JSON, defaults to None
+    :param partition_by: 按这些列分目录存放(hive 风格, 如 fewt=0.25/), defaults to None(不分区)
+    :param rows_per_file: 每个文件的最大行数, defaults to None(不限)
+    :param compression: 压缩方式, defaults to 'zstd'
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    partition_by = list(partition_by or [])
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    info = {'metadata': metadata or {}, 'partition_by': partition_by}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           METADATA_KEY: json.dumps(info).encode()})
+
+    options = {}
+    if rows_per_file:
+        options = {'max_rows_per_file': rows_per_file, 'max_rows_per_group': rows_per_file}
+    partitioning = None
+    if partition_by:
+        partitioning = ds.partitioning(pa.schema([table.schema.field(name) for name in partition_by]), flavor='hive')
+    ds.write_dataset(table, path, format='parquet', partitioning=partitioning,
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+                     existing_data_behavior='delete_matching', **options)
+    pq.write_metadata(table.schema, os.path.join(path, COMMON_METADATA))
+
+
+def read_schema(path: str):
+    """数据集的完整 schema 和扫描元数据(见 write_dataset)"""
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(os.path.join(path, COMMON_METADATA))
+    info = json.loads(schema.metadata[METADATA_KEY])
+    return schema, info
+
+
+def open_dataset(path: str):
+    """以 pyarrow.dataset.Dataset 打开数据集, 可按列和条件流式读取(to_batches), 分区列按原类型解析"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    schema, info = read_schema(path)
+    partitioning = None
+    if info['partition_by']:
+        partitioning = ds.partitioning(pa.schema([schema.field(name) for name in info['partition_by']]),
+                                       flavor='hive')
+    return ds.dataset(path, schema=schema, format='parquet', partitioning=partitioning,
+                      exclude_invalid_files=True)
+
+
+def read_dataset(path: str, columns: list = None, filter=None, memory_map: bool = True) -> pd.DataFrame:
+    """读取数据集, 需要 pyarrow
+
+    文件以内存映射方式读取, 不整体复制到内存; 只读需要的列, filter 可按分区列跳过整个目录.
+
+    :param path: 数据集目录
+    :param columns: 读取的列, defaults to None(全部)
+    :param filter: pyarrow 过滤表达式, 如 pyarrow.dataset.field('fewt') == 0.25, defaults to None
+    :param memory_map: 是否内存映射, defaults to True
+    :return: 结果表, 行按工况序号排列, 元数据在 attrs['sweep']
+    """
+    import pyarrow.parquet as pq
+    schema, info = read_schema(path)
+    table = pq.read_table(path, schema=schema, partitioning='hive' if info['partition_by'] else None,
+                          columns=None if columns is None else _with_index(schema, columns),
+                          filters=filter, memory_map=memory_map)
+    table = table.select([name for name in schema.names if name in table.column_names])
+    frame = table.replace_schema_metadata(schema.metadata).to_pandas()
+    frame = frame.sort_index(kind='stable')
+    frame.attrs['sweep'] = info['metadata']
+    return frame
+
+
+def _with_index(schema, columns: list) -> list:
+    """加上 pandas 索引列, 使读取部分列时仍保留工况序号"""
+    pandas = json.loads(schema.metadata.get(b'pandas', b'{}'))
+    index = [name for name in pandas.get('index_columns', []) if isinstance(name, str)]
+    return index + [name for name in columns if name not in index]
+
+
+def export_excel(source: str, path: str, sheets: dict, info_sheet: str = 'Info', batch_size: int = 4096):
+    """由数据集流式导出 Excel, 需要 pyarrow 和 xlsxwriter
+
+    工作簿以 constant_memory 模式逐行写出, 数据集按批读取, 内存占用与工况数无关.
+    NaN 写为空单元格, ±inf(如除以为0的产量)写为 Excel 的 #DIV/0! 错误值.
+
+    :param source: 数据集目录(见 write_dataset)
+    :param path: Excel 文件
+    :param sheets: {工作表名: 列名列表, 或由一批结果计算该表的函数 f(frame) -> DataFrame}
+    :param info_sheet: 写入元数据中各列表(如 VarRange)的工作表, None 时不写, defaults to 'Info'
+    :param batch_size: 每批读取的行数, defaults to 4096
+    """
+    import xlsxwriter
+
+    dataset = open_dataset(source)
+    _, info = read_schema(source)
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        if info_sheet is not None:
+            lists = {key: value for key, value in info['metadata'].items() if isinstance(value, list)}
+            worksheet = workbook.add_worksheet(info_sheet)
+            worksheet.write_row(0, 1, list(lists), bold)
+            for row in range(max((len(value) for value in lists.values()), default=0)):
+                worksheet.write(row + 1, 0, row + 1, bold)
+                worksheet.write_row(row + 1, 1, [value[row] if row < len(value) else None for value in lists.values()])
+
+        worksheets = {name: workbook.add_worksheet(name) for name in sheets}
+        rows = dict.fromkeys(sheets, 0)
+        for batch in dataset.to_batches(batch_size=batch_size):
+            frame = batch.to_pandas()
+            for name, sheet in sheets.items():
+                part = sheet(frame) if callable(sheet) else frame[list(sheet)]
+                rows[name] = _write_frame(worksheets[name], part, rows[name], bold)
+    finally:
+        workbook.close()
+
+
+def _write_frame(worksheet, frame: pd.DataFrame, row: int, header_format) -> int:
+    """按 DataFrame.to_excel 的布局接着第 row 行写入, 首次写入时先写表头, 返回下一行"""
+    if row == 0:
+        worksheet.write(0, 0, frame.index.name, header_format)
+        worksheet.write_row(0, 1, [str(column) for column in frame.columns], header_format)
+        row = 1
+    values = frame.astype(object).where(frame.notna(), None).to_numpy()
+    for index, line in zip(frame.index, values):
+        worksheet.write(row, 0, index.item() if isinstance(index, np.generic) else index, header_format)
+        worksheet.write_row(row, 1, line)
+        row += 1
+    return row
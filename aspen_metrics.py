@@ -0,0 +1,78 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+_COLUMN = re.compile(r'`([^`]+)`')
+
+
+class MetricTable(object):
+    """声明式的派生指标表, 在整个结果表上一次性向量化计算
+
+    每个指标为 {name, expr, unit, scalable}:
+
+    - expr: NumPy 表达式, 结果表的列用反引号引用(列名可含 - 等符号), 如 1 - `rb_FE3O4` * 4 / `nf_Fe2O3In`;
+      也可引用之前的指标名(未折算的值)和 np; 同名不同单位的指标以最后一个为准
+    - unit: 单位, 给出时列名为 name(unit), defaults to None
+    - scalable: 是否随规模变化, 为 True 时按 basis 折算到 basis_value 的生产规模, defaults to False
+
+    :param metrics: 指标列表
+    :param basis: 规模基准的表达式, 如 `mf_H2PROD`, defaults to None(不折算)
+    :param basis_value: 折算到的基准值, 如 4632.96 kg/h 产氢, defaults to 1.0
+    """
+
+    def __init__(self, metrics: list, basis: str = None, basis_value: float = 1.0):
+        self.metrics = [dict(m) for m in metrics]
+        labels = [self.label(m) for m in self.metrics]
+        duplicated = sorted({label for label in labels if labels.count(label) > 1})
+        if duplicated:
+            raise ValueError(f'duplicated metrics: {duplicated}')
+
+        self.columns = []  # 各表达式引用的结果表列
+        self._code = [self._compile(str(m['expr'])) for m in self.metrics]
+        self._basis = None if basis is None else self._compile(basis)
+        self.basis_value = basis_value
+
+    def _compile(self, expr: str):
+        def replace(match):
+            if match.group(1) not in self.columns:
+                self.columns.append(match.group(1))
+            return f'_c{self.columns.index(match.group(1))}'
+        return compile(_COLUMN.sub(replace, expr), expr, 'eval')
+
+    @staticmethod
+    def label(metric: dict) -> str:
+        """指标在结果中的列名"""
+        return metric['name'] if metric.get('unit') is None else f"{metric['name']}({metric['unit']})"
+
+    def evaluate(self, source, index=None) -> pd.DataFrame:
+        """计算全部指标
+
+        :param source: 结果表(DataFrame), 或提供 column(name) 的 aspen_sweep.ResultStore
+        :param index: 结果的行索引, defaults to source 的索引
+        :return: 每个工况一行, 每个指标一列, 列名见 label
+        """
+        if hasattr(source, 'column'):
+            column = source.column
+        else:
+            def column(name):
+                return source[name].to_numpy(dtype=float)
+        try:
+            namespace = {f'_c{i}': column(name) for i, name in enumerate(self.columns)}
+        except KeyError as e:
+            raise KeyError(f'metric refers to unknown column {e}') from None
+        namespace['np'] = np
+        n = len(source.index) if index is None else len(index)
+
+        values = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = None
+            if self._basis is not None:
+                scale = self.basis_value / eval(self._basis, {'__builtins__': {}}, namespace)
+            for metric, code in zip(self.metrics, self._code):
+                value = np.broadcast_to(eval(code, {'__builtins__': {}}, namespace), n)
+                namespace[metric['name']] = value
+                if scale is not None and metric.get('scalable'):
+                    value = value * scale
+                values[self.label(metric)] = value
+        return pd.DataFrame(values, index=source.index if index is None else index)
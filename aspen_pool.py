@@ -0,0 +1,382 @@
+import os
+import shutil
+import collections
+import asyncio
+import tempfile
+import traceback
+import multiprocessing as mp
+import multiprocessing.util
+import multiprocessing.connection
+from concurrent.futures import ProcessPoolExecutor
+
+import py_aspen
+
+
+class _StartLock(object):
+    """记录持有者进程号的启动锁, 持有者在启动 ASPEN 时崩溃后, 主进程可以代为释放"""
+
+    def __init__(self, ctx):
+        self._lock = ctx.Lock()
+        self._owner = ctx.Value('i', 0, lock=False)
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._owner.value = os.getpid()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._owner.value = 0
+        self._lock.release()
+        return False
+
+    def release_from(self, pid: int) -> bool:
+        """若锁由已退出的进程 pid 持有则释放, 返回是否释放"""
+        if pid is None or self._owner.value != pid:
+            return False
+        self._owner.value = 0
+        self._lock.release()
+        return True
+
+
+def _open_session(backend, aspen_file: str, file_dir: str, ap_version: str, work_dir: str, cache_path: str,
+                  recycler, start_lock) -> py_aspen.PyASPENPlus:
+    """在工作进程中复制 .bkp 到 work_dir 并开启独立的 ASPEN 实例"""
+    os.makedirs(work_dir, exist_ok=True)
+    shutil.copy2(os.path.join(file_dir, aspen_file), work_dir)
+    session = py_aspen.PyASPENPlus(backend)
+    # 首次启动和之后的 restart 都逐个进行, 以便各进程准确识别自己的 ASPEN 进程
+    session.start_lock = start_lock
+    session.init_app(ap_version)
+    session.load_ap_file(aspen_file, work_dir)
+    session.recycler = recycler
+    if cache_path is not None:
+        session.result_cache = py_aspen.ResultCache(cache_path)
+    return session
+
+
+def _close_session(session: py_aspen.PyASPENPlus):
+    if session is not None and session.app is not None:
+        try:
+            session.close_app()
+        except Exception:
+            pass
+
+
+def _worker_main(worker_id: int, backend, aspen_file: str, file_dir: str, ap_version: str, work_dir: str,
+                 cache_path: str, recycler, start_lock, tasks, results):
+    """工作进程: 持有独立的 ASPEN 实例和 .bkp 副本, 从自己的任务队列中逐个取出工况计算
+
+    结果经由本进程独占的管道同步发送, 进程崩溃时不会留下未写完的消息或占用其他进程共用的锁.
+    """
+    session = None
+    try:
+        session = _open_session(backend, aspen_file, file_dir, ap_version, work_dir, cache_path, recycler,
+                                start_lock)
+        results.send(('ready', worker_id, os.getpid()))
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            index, inputs, outputs, reinit, profiles = task
+            try:
+                result = session.run_case(inputs, outputs, reinit, case_id=index, profiles=profiles)
+            except Exception as e:
+                result = {'outputs': {}, 'status': py_aspen.RunOutcome.ERROR, 'solve_time': None,
+                          'exception': repr(e)}
+            result['worker'] = worker_id
+            results.send(('done', worker_id, (index, result)))
+    except Exception:
+        results.send(('failed', worker_id, traceback.format_exc()))
+    finally:
+        _close_session(session)
+
+
+class AspenWorkerPool(object):
+    """多进程 ASPEN 工况计算池
+
+    每个工作进程各自开启一个 ASPEN 实例并载入自己的 .bkp 副本, 主进程每次只向空闲的进程分发一个工况,
+    结果按工况顺序合并. 工作进程意外退出时, 分发给它的工况记为 error 并重新启动该进程;
+    同一进程连续 max_respawns 次未能启动就退出时报错.
+    使用 spawn 方式创建进程, 调用脚本需放在 if __name__ == '__main__' 之下.
+
+    :param aspen_file: ASPEN文件名
+    :param file_dir: ASPEN文件所处目录, defaults to 当前目录
+    :param n_workers: 工作进程数, 不应超过许可证允许的并发引擎数, defaults to 2
+    :param backend: 模拟器后端, 需可被 pickle, defaults to py_aspen.ComBackend()
+    :param ap_version: ASPEN Plus版本号, defaults to '10.0'
+    :param work_dir: 存放各进程 .bkp 副本的目录, defaults to 临时目录
+    :param poll: 检查工作进程存活状态的间隔(s), defaults to 1.0
+    :param cache_path: 各进程共用的 ResultCache 数据库路径, defaults to None(不使用缓存)
+    :param recycler: 各进程使用的 EngineRecycler, defaults to None(不主动重启)
+    :param max_respawns: 同一进程连续重启的最大次数, defaults to 3
+    """
+
+    def __init__(self, aspen_file: str, file_dir: str = None, n_workers: int = 2, backend=None,
+                 ap_version: str = '10.0', work_dir: str = None, poll: float = 1.0, cache_path: str = None,
+                 recycler: py_aspen.EngineRecycler = None, max_respawns: int = 3):
+        self.aspen_file = aspen_file
+        self.file_dir = os.getcwd() if file_dir is None else file_dir
+        self.n_workers = n_workers
+        self.backend = py_aspen.ComBackend() if backend is None else backend
+        self.ap_version = ap_version
+        self.poll = poll
+        self.cache_path = None if cache_path is None else os.path.abspath(cache_path)
+        self.recycler = recycler
+        self.max_respawns = max_respawns
+
+        self._own_work_dir = work_dir is None
+        self.work_dir = tempfile.mkdtemp(prefix='aspen_pool_') if work_dir is None else work_dir
+        self._ctx = mp.get_context('spawn')
+        self._start_lock = _StartLock(self._ctx)
+        self._started = False
+        self._workers = {}
+        self._inboxes = {}  # worker_id -> 该进程的任务队列
+        self._outboxes = {}  # 该进程的结果管道的读取端 -> worker_id
+        self._idle = set()  # 已载入文件, 等待分发工况的进程
+        self._respawns = {}  # worker_id -> 上次就绪以来的重启次数
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _spawn(self, worker_id: int):
+        # 每次启动使用新的任务队列和结果管道, 退出的进程未取走的任务不会被新进程执行
+        self._inboxes[worker_id] = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.backend, self.aspen_file, self.file_dir, self.ap_version,
+                  os.path.join(self.work_dir, f'worker_{worker_id}'), self.cache_path, self.recycler,
+                  self._start_lock, self._inboxes[worker_id], writer),
+            daemon=True,
+        )
+        process.start()
+        writer.close()  # 只由工作进程持有写入端, 进程退出后读取端收到 EOF
+        self._outboxes = {conn: w for conn, w in self._outboxes.items() if w != worker_id}
+        self._outboxes[reader] = worker_id
+        self._workers[worker_id] = process
+
+    def start(self):
+        """启动全部工作进程"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._started = True
+        self._idle = set()
+        self._respawns = {}
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+
+    def map_cases(self, cases: list, outputs: list, reinit: bool = True, callback=None, profiles: list = None) -> list:
+        """并行计算一组工况
+
+        :param cases: 工况列表, 每个工况为 {调用地址: 值}
+        :param outputs: 待读取的调用地址列表, 或 py_aspen.OutputManifest
+        :param reinit: 是否重新初始化迭代参数设置, defaults to True
+        :param callback: 每个工况完成时调用 callback(index, result), defaults to None
+        :param profiles: 整体读取的数组型节点地址, defaults to None
+        :return: 与 cases 顺序一致的结果列表, 每项同 PyASPENPlus.run_case 的返回值并附带 worker
+        """
+        if not self._started:
+            self.start()
+
+        pending = collections.deque(enumerate(cases))
+        results = [None] * len(cases)
+        in_flight = {}  # worker_id -> 已分发给该进程的工况序号
+        remaining = len(cases)
+        while remaining:
+            while pending and self._idle:
+                worker_id = self._idle.pop()
+                index, inputs = pending.popleft()
+                in_flight[worker_id] = index
+                self._inboxes[worker_id].put((index, dict(inputs), outputs, reinit, list(profiles or [])))
+            message = self._receive()
+            if message is None:
+                remaining -= self._reap(in_flight, results, callback)
+                continue
+
+            kind, worker_id, payload = message
+            if kind == 'ready':
+                self._respawns[worker_id] = 0
+                self._idle.add(worker_id)
+            elif kind == 'done':
+                index, result = payload
+                if in_flight.get(worker_id) != index:
+                    continue  # 已由 _reap 记为 error
+                del in_flight[worker_id]
+                self._idle.add(worker_id)
+                results[index] = result
+                remaining -= 1
+                if callback is not None:
+                    callback(index, result)
+            elif kind == 'failed':
+                self.close()
+                raise RuntimeError(f'ASPEN worker {worker_id} failed to start:\n{payload}')
+        return results
+
+    def _receive(self):
+        """等待任一工作进程的消息, poll 秒内没有消息或有进程退出时返回 None"""
+        for conn in mp.connection.wait(list(self._outboxes), timeout=self.poll):
+            try:
+                return conn.recv()
+            except EOFError:
+                self._workers[self._outboxes[conn]].join(self.poll)  # 等待进程退出, 由 _reap 重启
+        return None
+
+    def _reap(self, in_flight: dict, results: list, callback) -> int:
+        """重启意外退出的工作进程, 返回因此记为 error 的工况数"""
+        lost = 0
+        for worker_id, process in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            self._idle.discard(worker_id)
+            if self._start_lock.release_from(process.pid):
+                py_aspen.logger.warning('ASPEN worker exited while starting, start lock released',
+                                        extra={'worker': worker_id})
+            index = in_flight.pop(worker_id, None)
+            if index is not None:
+                results[index] = {'outputs': {}, 'status': py_aspen.RunOutcome.ERROR, 'solve_time': None,
+                                  'exception': f'worker exited with code {process.exitcode}',
+                                  'worker': worker_id}
+                lost += 1
+                if callback is not None:
+                    callback(index, results[index])
+            self._respawns[worker_id] = self._respawns.get(worker_id, 0) + 1
+            if self._respawns[worker_id] > self.max_respawns:
+                self.close()
+                raise RuntimeError(f'ASPEN worker {worker_id} exited {self.max_respawns + 1} times in a row, '
+                                   f'last exit code {process.exitcode}')
+            py_aspen.logger.warning('ASPEN worker exited, restarting',
+                                    extra={'worker': worker_id, 'exitcode': process.exitcode})
+            self._spawn(worker_id)
+        return lost
+
+    def close(self):
+        """结束全部工作进程并删除 .bkp 副本"""
+        if self._started:
+            for inbox in self._inboxes.values():
+                inbox.put(None)
+            for process in self._workers.values():
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
+            for conn in self._outboxes:
+                conn.close()
+            self._workers = {}
+            self._inboxes = {}
+            self._outboxes = {}
+            self._idle = set()
+            self._started = False
+        if self._own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+_session = None  # AsyncAspenSession 的进程中持有的 PyASPENPlus
+
+
+def _init_async_session(*args):
+    global _session
+    _session = _open_session(*args)
+    multiprocessing.util.Finalize(None, _close_session, args=(_session,), exitpriority=10)
+
+
+def _async_session_run(inputs: dict, outputs: list, reinit: bool, case_id, profiles: list) -> dict:
+    return _session.run_case(inputs, outputs, reinit, case_id=case_id, profiles=profiles)
+
+
+def _async_session_ping() -> int:
+    return os.getpid()
+
+
+class AsyncAspenSession(object):
+    """在独立进程中运行一个 ASPEN 引擎的 asyncio 接口
+
+    等待模拟结束时不阻塞事件循环::
+
+        async with AsyncAspenSession('cstr.bkp') as session:
+            result = await session.run(inputs, outputs)
+
+    参数含义同 AspenWorkerPool; start_lock 用于与其他会话错开启动, defaults to 新建的锁
+    """
+
+    def __init__(self, aspen_file: str, file_dir: str = None, backend=None, ap_version: str = '10.0',
+                 work_dir: str = None, cache_path: str = None, recycler: py_aspen.EngineRecycler = None,
+                 start_lock=None):
+        ctx = mp.get_context('spawn')
+        self._own_work_dir = work_dir is None
+        self.work_dir = tempfile.mkdtemp(prefix='aspen_session_') if work_dir is None else work_dir
+        file_dir = os.getcwd() if file_dir is None else file_dir
+        self._executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=ctx, initializer=_init_async_session,
+            initargs=(py_aspen.ComBackend() if backend is None else backend, aspen_file, file_dir, ap_version,
+                      self.work_dir, None if cache_path is None else os.path.abspath(cache_path), recycler,
+                      ctx.Lock() if start_lock is None else start_lock),
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self) -> int:
+        """启动引擎进程并载入文件, 返回进程 PID"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, _async_session_ping)
+
+    async def run(self, inputs: dict, outputs: list, reinit: bool = True, case_id=None, profiles: list = None) -> dict:
+        """运行一个工况, 返回值同 PyASPENPlus.run_case"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, _async_session_run, dict(inputs), outputs, reinit, case_id, list(profiles or []))
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        if self._own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class AsyncAspenPool(object):
+    """多个 AsyncAspenSession 组成的异步计算池, 用 asyncio.gather 分发工况
+
+    :param n_sessions: 引擎进程数
+    :param max_concurrency: 同时进行的工况数上限, defaults to n_sessions
+    其余参数含义同 AspenWorkerPool
+    """
+
+    def __init__(self, aspen_file: str, file_dir: str = None, n_sessions: int = 2, backend=None,
+                 ap_version: str = '10.0', cache_path: str = None, recycler: py_aspen.EngineRecycler = None,
+                 max_concurrency: int = None):
+        start_lock = mp.get_context('spawn').Lock()
+        self.sessions = [AsyncAspenSession(aspen_file, file_dir, backend, ap_version, cache_path=cache_path,
+                                           recycler=recycler, start_lock=start_lock)
+                         for _ in range(n_sessions)]
+        self._semaphore = asyncio.Semaphore(n_sessions if max_concurrency is None else max_concurrency)
+        self._idle = asyncio.Queue()
+        for session in self.sessions:
+            self._idle.put_nowait(session)
+
+    async def __aenter__(self):
+        await asyncio.gather(*(session.start() for session in self.sessions))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def run(self, inputs: dict, outputs: list, reinit: bool = True, case_id=None, profiles: list = None) -> dict:
+        """在空闲的引擎上运行一个工况"""
+        async with self._semaphore:
+            session = await self._idle.get()
+            try:
+                return await session.run(inputs, outputs, reinit, case_id, profiles)
+            finally:
+                self._idle.put_nowait(session)
+
+    async def map_cases(self, cases: list, outputs: list, reinit: bool = True, profiles: list = None) -> list:
+        """并行计算一组工况, 结果与 cases 顺序一致"""
+        return await asyncio.gather(*(self.run(inputs, outputs, reinit, case_id=index, profiles=profiles)
+                                      for index, inputs in enumerate(cases)))
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in self.sessions))
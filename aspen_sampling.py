@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+import py_aspen
+
+
+def latin_hypercube(n: int, d: int, seed=None) -> np.ndarray:
+    """拉丁超立方抽样
+
+    每个维度被等分为 n 段, 每段恰好落入一个样本点, 相同样本数下比独立均匀抽样覆盖更均匀.
+
+    :param n: 样本数
+    :param d: 维数
+    :param seed: 随机数种子, defaults to None
+    :return: (n, d) 的数组, 取值在 [0, 1) 内
+    """
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((d, n)), axis=1).T
+    return (strata + rng.random((n, d))) / n
+
+
+def sobol(n: int, d: int, seed=None, scramble: bool = True) -> np.ndarray:
+    """Sobol 低差异序列, 需要 scipy
+
+    :param n: 样本数, 取2的整数次幂时均匀性最好
+    :param d: 维数
+    :param seed: 扰乱所用的随机数种子, defaults to None
+    :param scramble: 是否扰乱(Owen scrambling), defaults to True
+    :return: (n, d) 的数组, 取值在 [0, 1) 内
+    """
+    from scipy.stats import qmc
+    return qmc.Sobol(d, scramble=scramble, seed=seed).random(n)
+
+
+SAMPLERS = {
+    'lhs': latin_hypercube,
+    'sobol': sobol,
+}
+
+
+def scale_samples(unit: np.ndarray, bounds: list) -> np.ndarray:
+    """将 [0, 1) 内的样本映射到各变量的取值范围
+
+    :param unit: (n, d) 的样本
+    :param bounds: 各变量的 [下限, 上限]
+    :return: (n, d) 的数组
+    """
+    lower, upper = np.asarray(bounds, dtype=float).T
+    return lower + unit * (upper - lower)
+
+
+def unit_samples(points: np.ndarray, bounds: list) -> np.ndarray:
+    """scale_samples 的逆变换, 上下限相同的变量映射为0"""
+    lower, upper = np.asarray(bounds, dtype=float).T
+    span = np.where(upper > lower, upper - lower, 1.0)
+    return (np.asarray(points, dtype=float) - lower) / span
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    finite = values[np.isfinite(values)]
+    scale = finite.std() if finite.size > 1 else 0.0
+    return values / scale if scale > 0 else np.zeros_like(values)
+
+
+def refine_samples(unit: np.ndarray, targets: np.ndarray, ok: np.ndarray, n_new: int, k: int = None,
+                   flip_weight: float = 1.0, min_distance: float = 1e-3) -> np.ndarray:
+    """在输出变化最快或运行状态翻转的区域加密样本
+
+    对每个样本点与其 k 个最近邻构成的边打分: 各输出(按标准差归一化)的变化率(两端差值除以边长)的最大值,
+    两端一个正常一个出错时再加 flip_weight 倍的最大变化率, flip_weight 为1时状态翻转不低于最陡的边(同分时优先);
+    取得分最高的 n_new 条边的中点作为新样本.
+
+    :param unit: 已有样本, (n, d), 取值在 [0, 1] 内
+    :param targets: 已有样本的输出, (n, m), 出错样本的输出不参与打分
+    :param ok: 已有样本是否正常收敛, (n,)
+    :param n_new: 新样本数
+    :param k: 最近邻数, defaults to 2 * d
+    :param flip_weight: 状态翻转的得分(相对于最大变化率), defaults to 1.0
+    :param min_distance: 与已有样本的最小距离, 更近的候选点被舍弃, defaults to 1e-3
+    :return: (<= n_new, d) 的新样本
+    """
+    unit = np.asarray(unit, dtype=float)
+    n, d = unit.shape
+    if n < 2 or n_new <= 0:
+        return np.empty((0, d))
+    ok = np.asarray(ok, dtype=bool)
+    targets = np.array(targets, dtype=float).reshape(n, -1)
+    targets[~ok] = np.nan  # 出错工况的读数不可信, 只计状态翻转
+    targets = np.column_stack([_normalize(targets[:, j]) for j in range(targets.shape[1])])
+    k = min(2 * d if k is None else k, n - 1)
+
+    distance = np.sqrt(((unit[:, None, :] - unit[None, :, :]) ** 2).sum(axis=-1))
+    np.fill_diagonal(distance, np.inf)
+    neighbours = np.argsort(distance, axis=1)[:, :k]
+    i = np.repeat(np.arange(n), k)
+    j = neighbours.ravel()
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    edges = np.unique(np.column_stack([i, j]), axis=0)
+    i, j = edges[:, 0], edges[:, 1]
+
+    change = np.abs(targets[i] - targets[j])
+    change = np.where(np.isfinite(change), change, 0.0).max(axis=1) if change.size else np.zeros(len(i))
+    length = distance[i, j]
+    rate = np.divide(change, length, out=np.zeros(len(i)), where=length > 0)
+    scale = rate.max() if rate.max() > 0 else 1.0  # 没有变化时只按状态翻转打分
+    flip = ok[i] != ok[j]
+    score = rate + flip_weight * scale * flip
+
+    selected = []
+    existing = unit
+    for edge in np.lexsort((~flip, -score)):
+        if len(selected) == n_new or score[edge] <= 0:
+            break
+        point = (unit[i[edge]] + unit[j[edge]]) / 2
+        if np.sqrt(((existing - point) ** 2).sum(axis=1)).min() < min_distance:
+            continue
+        selected.append(point)
+        existing = np.vstack([existing, point])
+    return np.array(selected).reshape(-1, d)
+
+
+class AdaptiveRefiner(object):
+    """先按 SweepSpec 的抽样运行初始工况, 再逐轮在输出变化最快或运行状态翻转处加密
+
+    :param runner: aspen_sweep.SweepRunner, 其设置需使用 lhs 或 sobol 抽样
+    :param targets: 用于判断变化快慢的输出, 为结果表的列名, 或由结果表计算一列的函数 f(table)
+    :param batch: 每轮新增的工况数, defaults to 8
+    :param k: 最近邻数, 见 refine_samples, defaults to None
+    :param flip_weight: 状态翻转的得分, 见 refine_samples, defaults to 1.0
+    """
+
+    def __init__(self, runner, targets: list, batch: int = 8, k: int = None, flip_weight: float = 1.0):
+        self.runner = runner
+        self.targets = list(targets)
+        self.batch = batch
+        self.k = k
+        self.flip_weight = flip_weight
+
+    def _target_values(self, table: pd.DataFrame) -> np.ndarray:
+        columns = []
+        for target in self.targets:
+            values = target(table) if callable(target) else table[target]
+            columns.append(np.asarray(values, dtype=float))
+        return np.column_stack(columns)
+
+    def run(self, rounds: int = 3, callback=None, resume: bool = False) -> pd.DataFrame:
+        """运行初始工况和 rounds 轮加密
+
+        抽样和加密都是确定的, 因此配合 SweepRunner 的日志可用 resume 续算.
+
+        :param rounds: 加密轮数, defaults to 3
+        :param callback: 见 SweepRunner.run, defaults to None
+        :param resume: 见 SweepRunner.run, defaults to False
+        :return: 全部工况的结果表, 另有 round 列记录工况所属的轮次(0为初始工况)
+        """
+        spec = self.runner.spec
+        names = [v['name'] for v in spec.variables]
+        bounds = spec.bounds
+
+        results = self.runner.run(callback=callback, resume=resume).assign(round=0)
+        for round_ in range(1, rounds + 1):
+            unit = unit_samples(results[names].to_numpy(float), bounds)
+            ok = results['status'].isin(py_aspen.USABLE_STATUSES).to_numpy()
+            points = refine_samples(unit, self._target_values(results), ok, self.batch, k=self.k,
+                                    flip_weight=self.flip_weight)
+            if len(points) == 0:
+                break
+            table = spec.case_table(scale_samples(points, bounds), start=results.index.max() + 1)
+            # 续算时日志中已有本轮之前的工况, 本轮的工况若已完成也会被跳过
+            new = self.runner.run(callback=callback, resume=True, table=table).assign(round=round_)
+            results = pd.concat([results, new])
+        return results
@@ -0,0 +1,213 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+import aspen_sampling
+
+
+def morris_design(r: int, d: int, levels: int = 4, seed=None) -> np.ndarray:
+    """Morris 轨迹设计
+
+    每条轨迹从 levels 个等分水平组成的网格上的随机点出发, 按随机顺序每次只改变一个变量,
+    步长 delta = levels / (2 (levels - 1)), d 个变量共 d + 1 个点; 每步得到该变量的一个基本效应.
+
+    :param r: 轨迹数
+    :param d: 维数
+    :param levels: 网格水平数(偶数), defaults to 4
+    :param seed: 随机数种子, defaults to None
+    :return: (r * (d + 1), d) 的数组, 取值在 [0, 1] 内, 按轨迹依次排列
+    """
+    if levels < 2 or levels % 2:
+        raise ValueError(f'levels must be an even number >= 2, got {levels}')
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    start = rng.integers(0, levels // 2, (r, d)) / (levels - 1)
+    direction = rng.choice([-1.0, 1.0], (r, d))
+    start = start + delta * (direction < 0)  # 向下走的变量从上半部分出发
+    order = np.argsort(rng.random((r, d)), axis=1)
+
+    # 第 k 个点已改变了 order 中的前 k 个变量
+    changed = np.zeros((r, d + 1, d))
+    steps = np.arange(1, d + 1)[:, None] > np.arange(d)[None, :]  # (d, d), 第 k 行前 k + 1 个为真
+    changed[:, 1:, :] = np.take_along_axis(np.broadcast_to(steps, (r, d, d)),
+                                           np.argsort(order, axis=1)[:, None, :], axis=2)
+    points = start[:, None, :] + changed * (direction * delta)[:, None, :]
+    return points.reshape(-1, d)
+
+
+def morris_indices(unit: np.ndarray, y: np.ndarray, d: int, n_boot: int = 1000, conf: float = 0.95,
+                   seed=None) -> pd.DataFrame:
+    """由 Morris 轨迹上的输出计算基本效应的统计量
+
+    输出为 NaN(工况出错)的步不参与统计.
+
+    :param unit: morris_design 的样本
+    :param y: 各样本的输出
+    :param d: 维数
+    :param n_boot: bootstrap 次数, defaults to 1000
+    :param conf: 置信水平, defaults to 0.95
+    :param seed: bootstrap 的随机数种子, defaults to None
+    :return: 每个变量一行, 列为 mu, mu_star, mu_star_conf(置信区间半宽), sigma, n(有效的基本效应数)
+    """
+    unit = np.asarray(unit, dtype=float).reshape(-1, d + 1, d)
+    y = np.asarray(y, dtype=float).reshape(-1, d + 1)
+    step = np.diff(unit, axis=1)  # (r, d, d), 每步只有一个变量非零
+    variable = np.abs(step).argmax(axis=2)
+    delta = np.take_along_axis(step, variable[:, :, None], axis=2)[:, :, 0]
+    effects = np.full((len(unit), d), np.nan)
+    np.put_along_axis(effects, variable, np.diff(y, axis=1) / delta, axis=1)
+
+    valid = np.isfinite(effects)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = np.nansum(effects, axis=0) / count
+        mu_star = np.nansum(np.abs(effects), axis=0) / count
+        sigma = np.sqrt(np.nansum((effects - mu) ** 2, axis=0) / (count - 1))
+
+        rng = np.random.default_rng(seed)
+        resample = rng.integers(0, len(effects), (n_boot, len(effects)))
+        boot = np.nan_to_num(np.abs(effects))[resample].sum(axis=1) / valid[resample].sum(axis=1)
+    mu_star_conf = NormalDist().inv_cdf(0.5 + conf / 2) * np.nanstd(boot, axis=0, ddof=1)
+    return pd.DataFrame({'mu': mu, 'mu_star': mu_star, 'mu_star_conf': mu_star_conf, 'sigma': sigma, 'n': count})
+
+
+def saltelli_design(n: int, d: int, sampler: str = 'sobol', seed=None) -> np.ndarray:
+    """Saltelli 设计, 用于估计 Sobol 一阶和总效应指数
+
+    由 2d 维的抽样得到两个基础样本矩阵 A, B; 对每个基础样本依次排列 A, AB_1 ... AB_d, B,
+    其中 AB_i 为 A 的第 i 列换成 B 的第 i 列, 相邻的工况只有一个变量不同.
+
+    :param n: 基础样本数, sobol 抽样时取2的整数次幂
+    :param d: 维数
+    :param sampler: aspen_sampling.SAMPLERS 中的抽样方法, defaults to 'sobol'(需要 scipy)
+    :param seed: 随机数种子, defaults to None
+    :return: (n * (d + 2), d) 的数组, 取值在 [0, 1) 内
+    """
+    base = aspen_sampling.SAMPLERS[sampler](n, 2 * d, seed=seed)
+    a, b = base[:, :d], base[:, d:]
+    blocks = np.repeat(a[:, None, :], d + 2, axis=1)
+    index = np.arange(d)
+    blocks[:, 1 + index, index] = b[:, index]
+    blocks[:, -1] = b
+    return blocks.reshape(-1, d)
+
+
+def sobol_indices(y: np.ndarray, d: int, n_boot: int = 1000, conf: float = 0.95, seed=None) -> pd.DataFrame:
+    """由 Saltelli 设计上的输出计算 Sobol 一阶指数(Saltelli 2010)和总效应指数(Jansen)
+
+    含 NaN(工况出错)的基础样本整组舍弃; 置信区间由对基础样本的 bootstrap 估计.
+
+    :param y: saltelli_design 各样本的输出
+    :param d: 维数
+    :param n_boot: bootstrap 次数, defaults to 1000
+    :param conf: 置信水平, defaults to 0.95
+    :param seed: bootstrap 的随机数种子, defaults to None
+    :return: 每个变量一行, 列为 S1, S1_conf, ST, ST_conf(置信区间半宽), n(有效的基础样本数)
+    """
+    y = np.asarray(y, dtype=float).reshape(-1, d + 2)
+    y = y[np.isfinite(y).all(axis=1)]
+
+    def estimate(blocks):
+        f_a, f_ab, f_b = blocks[..., :1], blocks[..., 1:-1], blocks[..., -1:]
+        variance = np.var(np.concatenate([f_a, f_b], axis=-2), axis=(-2, -1))[..., None]
+        first = np.mean(f_b * (f_ab - f_a), axis=-2) / variance
+        total = 0.5 * np.mean((f_a - f_ab) ** 2, axis=-2) / variance
+        return first, total
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        first, total = estimate(y)
+        rng = np.random.default_rng(seed)
+        boot_first, boot_total = estimate(y[rng.integers(0, len(y), (n_boot, len(y)))]) if len(y) else (first, total)
+    z = NormalDist().inv_cdf(0.5 + conf / 2)
+    return pd.DataFrame({'S1': first, 'S1_conf': z * np.nanstd(boot_first, axis=0, ddof=1),
+                         'ST': total, 'ST_conf': z * np.nanstd(boot_total, axis=0, ddof=1),
+                         'n': len(y)})
+
+
+class SensitivityAnalysis(object):
+    """在 SweepRunner 上做全局敏感性分析
+
+    在 SweepSpec 各变量的 bounds 内生成 Morris 或 Saltelli 设计, 交给 runner 运行
+    (runner 带 pool 时并行, 带日志时可续算), 再对每个目标计算各变量的敏感性指数并排序.
+    上下限相同的变量不参与分析.
+
+    所需工况数: morris 为 n * (变量数 + 1), sobol 为 n * (变量数 + 2).
+
+    :param runner: aspen_sweep.SweepRunner
+    :param targets: 分析的目标, 为结果表(或 derive 得到的表)的列名
+    :param method: morris(筛选, 按 mu_star 排序)或 sobol(方差分解, 按 ST 排序), defaults to 'morris'
+    :param n: morris 的轨迹数或 sobol 的基础样本数, defaults to 10
+    :param derive: 由结果表计算目标列的函数, 如 aspen_metrics.MetricTable.evaluate, defaults to None
+    :param levels: morris 的网格水平数, defaults to 4
+    :param sampler: sobol 的基础抽样方法, 见 saltelli_design, defaults to 'sobol'
+    :param seed: 随机数种子, 续算时须与之前相同, defaults to 0
+    :param conf: 置信水平, defaults to 0.95
+    :param n_boot: bootstrap 次数, defaults to 1000
+    """
+
+    def __init__(self, runner, targets: list, method: str = 'morris', n: int = 10, derive=None, levels: int = 4,
+                 sampler: str = 'sobol', seed=0, conf: float = 0.95, n_boot: int = 1000):
+        if method not in ('morris', 'sobol'):
+            raise ValueError(f'unknown sensitivity method: {method}')
+        self.runner = runner
+        self.targets = list(targets)
+        self.method = method
+        self.n = n
+        self.derive = derive
+        self.levels = levels
+        self.sampler = sampler
+        self.seed = seed
+        self.conf = conf
+        self.n_boot = n_boot
+
+        spec = runner.spec
+        bounds = np.asarray(spec.bounds, dtype=float)
+        self.factors = [v['name'] for v, (lower, upper) in zip(spec.variables, bounds) if upper > lower]
+        if not self.factors:
+            raise ValueError('no variable of the sweep spec has a range')
+        self._varying = bounds[:, 1] > bounds[:, 0]
+        self._bounds = bounds
+
+    def design(self) -> pd.DataFrame:
+        """设计的工况表, 不变的变量取其下限"""
+        d = len(self.factors)
+        if self.method == 'morris':
+            unit = morris_design(self.n, d, self.levels, seed=self.seed)
+        else:
+            unit = saltelli_design(self.n, d, self.sampler, seed=self.seed)
+        points = np.tile(self._bounds[:, 0], (len(unit), 1))
+        points[:, self._varying] = aspen_sampling.scale_samples(unit, self._bounds[self._varying])
+        return self.runner.spec.case_table(points)
+
+    def run(self, callback=None, resume: bool = False) -> pd.DataFrame:
+        """运行设计并计算敏感性指数
+
+        :param callback: 见 SweepRunner.run, defaults to None
+        :param resume: 见 SweepRunner.run, defaults to False
+        :return: 见 analyze
+        """
+        self.results = self.runner.run(callback=callback, resume=resume, table=self.design())
+        return self.analyze(self.results)
+
+    def analyze(self, results: pd.DataFrame) -> pd.DataFrame:
+        """计算敏感性指数
+
+        :param results: 设计的结果表(按 design 的工况顺序)
+        :return: 以 (target, variable) 为索引, 每个目标内按影响从大到小排列, rank 列为名次
+        """
+        values = results if self.derive is None else self.derive(results)
+        unit = aspen_sampling.unit_samples(results[self.factors].to_numpy(float), self._bounds[self._varying])
+        d = len(self.factors)
+        tables = {}
+        for target in self.targets:
+            y = np.asarray(values[target], dtype=float)
+            if self.method == 'morris':
+                table, key = morris_indices(unit, y, d, self.n_boot, self.conf, seed=self.seed), 'mu_star'
+            else:
+                table, key = sobol_indices(y, d, self.n_boot, self.conf, seed=self.seed), 'ST'
+            table.index = pd.Index(self.factors, name='variable')
+            table = table.sort_values(key, ascending=False)
+            table['rank'] = np.arange(1, d + 1)
+            tables[target] = table
+        return pd.concat(tables, names=['target'])
@@ -0,0 +1,169 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import py_aspen
+
+SKIPPED = 'skipped'  # 被代理模型跳过, 未交给 ASPEN 计算的工况
+
+
+def _make_regressor(model: str):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    if model == 'gp':
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+        kernel = ConstantKernel() * RBF() + WhiteKernel(noise_level=1e-3)
+        return make_pipeline(StandardScaler(), GaussianProcessRegressor(kernel, normalize_y=True))
+    from sklearn.ensemble import GradientBoostingRegressor
+    return [make_pipeline(StandardScaler(), GradientBoostingRegressor(loss='quantile', alpha=alpha))
+            for alpha in (0.16, 0.5, 0.84)]
+
+
+def _make_classifier(model: str):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    if model == 'gp':
+        from sklearn.gaussian_process import GaussianProcessClassifier
+        return make_pipeline(StandardScaler(), GaussianProcessClassifier())
+    from sklearn.ensemble import GradientBoostingClassifier
+    return make_pipeline(StandardScaler(), GradientBoostingClassifier())
+
+
+class SurrogateScreen(object):
+    """用已完成工况训练的代理模型预筛待算工况, 需要 scikit-learn
+
+    每批工况运行前用全部已完成的工况重新训练代理模型, 预测待算工况的各目标输出(均值和标准差)和失败概率:
+    失败概率不低于 skip_failure 的工况跳过, 不低于 defer_failure 或被 worth 判为价值低的工况推迟到最后,
+    其余按预期信息量(预测的相对不确定度和失败与否的不确定度)从大到小运行.
+    已完成的工况不足 min_cases 时不筛选, 在待算工况中均匀地取一批运行.
+
+    :param targets: 预测的目标, 为结果表(或 derive 得到的表)的列名
+    :param features: 模型输入, defaults to SweepSpec 中的变量
+    :param model: gp(高斯过程)或 gbm(梯度提升, 以分位数回归估计不确定度), defaults to 'gp'
+    :param derive: 由结果表计算目标列的函数, 如 aspen_metrics.MetricTable.evaluate, defaults to None
+    :param worth: 由预测值判断工况是否值得计算的函数 f(predictions) -> 布尔数组, defaults to None
+    :param min_cases: 开始筛选所需的已完成工况数, defaults to 10
+    :param batch: 每批运行的工况数, defaults to 10
+    :param skip_failure: 跳过工况的失败概率, defaults to 0.9
+    :param defer_failure: 推迟工况的失败概率, defaults to 0.5
+    """
+
+    def __init__(self, targets: list, features: list = None, model: str = 'gp', derive=None, worth=None,
+                 min_cases: int = 10, batch: int = 10, skip_failure: float = 0.9, defer_failure: float = 0.5):
+        if model not in ('gp', 'gbm'):
+            raise ValueError(f'unknown surrogate model: {model}')
+        self.targets = list(targets)
+        self.features = None if features is None else list(features)
+        self.model = model
+        self.derive = derive
+        self.worth = worth
+        self.min_cases = min_cases
+        self.batch = batch
+        self.skip_failure = skip_failure
+        self.defer_failure = defer_failure
+
+        self._regressors = {}
+        self._scales = {}
+        self._classifier = None
+        self._p_fail = np.nan  # 训练集中只有一类结果(全部成功或全部失败)时的失败概率
+        self.fits = 0
+
+    @property
+    def columns(self) -> list:
+        """预测结果的列名"""
+        columns = []
+        for target in self.targets:
+            columns += [f'pred_{target}', f'pred_{target}_std']
+        return columns + ['pred_p_fail']
+
+    def fit(self, results: pd.DataFrame) -> bool:
+        """用已完成的工况训练
+
+        :param results: 结果表, 未运行和被跳过的工况(status 为空或 skipped)不参与训练
+        :return: 已完成的工况是否足够, 不足时不训练
+        """
+        done = results[results['status'].notna() & (results['status'] != SKIPPED)]
+        if len(done) < self.min_cases:
+            return False
+        x = done[self.features].to_numpy(float)
+        ok = done['status'].isin(py_aspen.USABLE_STATUSES).to_numpy()
+        values = done if self.derive is None else self.derive(done)
+
+        from sklearn.exceptions import ConvergenceWarning
+        with warnings.catch_warnings():
+            # 工况少时超参数常收敛到边界, 不影响筛选
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            self._fit(x, ok, values)
+        self.fits += 1
+        return True
+
+    def _fit(self, x: np.ndarray, ok: np.ndarray, values: pd.DataFrame):
+        self._regressors, self._scales = {}, {}
+        for target in self.targets:
+            y = np.asarray(values[target], dtype=float)
+            usable = ok & np.isfinite(y)
+            if usable.sum() < 2:
+                continue
+            regressor = _make_regressor(self.model)
+            for r in (regressor if isinstance(regressor, list) else [regressor]):
+                r.fit(x[usable], y[usable])
+            self._regressors[target] = regressor
+            self._scales[target] = y[usable].std() or 1.0
+
+        self._classifier = None
+        self._p_fail = 0.0 if ok.all() else 1.0 if not ok.any() else None
+        if self._p_fail is None:
+            self._classifier = _make_classifier(self.model)
+            self._classifier.fit(x, ~ok)
+
+    def predict(self, table: pd.DataFrame) -> pd.DataFrame:
+        """预测各目标的均值, 标准差和失败概率, 未训练的目标为 NaN"""
+        x = table[self.features].to_numpy(float)
+        predictions = pd.DataFrame(np.nan, index=table.index, columns=self.columns)
+        for target, regressor in self._regressors.items():
+            if isinstance(regressor, list):
+                low, mean, high = (r.predict(x) for r in regressor)
+                std = np.abs(high - low) / 2
+            else:
+                mean, std = regressor.predict(x, return_std=True)
+            predictions[f'pred_{target}'] = mean
+            predictions[f'pred_{target}_std'] = std
+        if self._classifier is not None:
+            predictions['pred_p_fail'] = self._classifier.predict_proba(x)[:, 1]
+        else:
+            predictions['pred_p_fail'] = self._p_fail
+        return predictions
+
+    def plan(self, results: pd.DataFrame, candidates: pd.DataFrame) -> tuple:
+        """选出下一批运行的工况
+
+        :param results: 当前的结果表(含未运行的工况)
+        :param candidates: 待算工况, 为工况表中的若干行
+        :return: (下一批运行的工况序号, 跳过的工况序号, 各待算工况的预测值)
+        """
+        if self.features is None:
+            raise ValueError('features of the surrogate are not set')
+        if not self.fit(results):
+            count = min(self.batch, len(candidates))
+            spread = np.unique(np.linspace(0, len(candidates) - 1, count).round().astype(int))
+            return candidates.index[spread].tolist(), [], pd.DataFrame(np.nan, index=candidates.index,
+                                                                         columns=self.columns)
+
+        predictions = self.predict(candidates)
+        p_fail = predictions['pred_p_fail'].to_numpy()
+        skip = p_fail >= self.skip_failure
+        defer = (p_fail >= self.defer_failure) & ~skip
+        if self.worth is not None:
+            defer |= ~np.asarray(self.worth(predictions), dtype=bool) & ~skip
+
+        # 预期信息量: 各目标相对不确定度的最大值 + 失败与否的不确定度
+        score = np.zeros(len(candidates))
+        for target in self._regressors:
+            score = np.fmax(score, predictions[f'pred_{target}_std'].to_numpy() / self._scales[target])
+        score += np.nan_to_num(4 * p_fail * (1 - p_fail))
+
+        order = np.lexsort((-score, defer))  # 先按是否推迟, 再按信息量从大到小
+        order = order[~skip[order]]
+        return (candidates.index[order[:self.batch]].tolist(), candidates.index[skip].tolist(), predictions)
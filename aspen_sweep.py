@@ -0,0 +1,495 @@
+import os
+import csv
+import time
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import py_aspen
+import aspen_sampling
+import aspen_surrogate
+
+WARM_COLUMNS = ['iterations', 'warm', 'attempts', 'warm_solve_time']  # 热启动运行时结果表中的附加列
+
+
+def serpentine_order(shape: tuple) -> list:
+    """按蛇形(反射格雷码)顺序遍历网格
+
+    相邻两个工况只有一个变量变化一个步长, 便于用上一个工况的收敛结果热启动.
+
+    :param shape: 各变量的取值个数, 如 (4, 7, 1, 3, 5)
+    :return: 网格下标元组的列表
+    """
+    if not shape:
+        return [()]
+    inner = serpentine_order(tuple(shape[1:]))
+    order = []
+    for i in range(shape[0]):
+        for idx in (inner if i % 2 == 0 else reversed(inner)):
+            order.append((i,) + idx)
+    return order
+
+
+def grid_cases(axes: dict, serpentine: bool = True) -> tuple:
+    """由各输入节点的取值生成全因子工况
+
+    :param axes: {调用地址: 取值列表}, 顺序即嵌套循环由外到内的顺序
+    :param serpentine: 是否按蛇形顺序排列, 否则按嵌套循环顺序, defaults to True
+    :return: (工况列表, 网格下标列表), 每个工况为 {调用地址: 值}
+    """
+    paths = list(axes)
+    shape = tuple(len(axes[path]) for path in paths)
+    order = serpentine_order(shape) if serpentine else list(itertools.product(*(range(n) for n in shape)))
+    cases = [{path: axes[path][i] for path, i in zip(paths, idx)} for idx in order]
+    return cases, order
+
+
+class WarmStartScheduler(object):
+    """按给定顺序热启动(不 Reinit)运行工况, 热启动失败时重新初始化后重算
+
+    :param session: 已载入文件的 PyASPENPlus
+    :param iterations_path: 收敛迭代次数所在的调用地址, 用于比较热启动的效果, defaults to None
+    """
+
+    def __init__(self, session: py_aspen.PyASPENPlus, iterations_path: str = None):
+        self.session = session
+        self.iterations_path = iterations_path
+        self._manifest = (None, None)  # (原输出清单, 追加了迭代次数的清单)
+        self.warm_ok = 0
+        self.fallbacks = 0
+
+    def _run(self, inputs: dict, outputs: list, reinit: bool, case_id=None, profiles: list = None) -> dict:
+        targets = outputs
+        if self.iterations_path is not None:
+            if isinstance(outputs, py_aspen.OutputManifest):
+                if self._manifest[0] is not outputs:
+                    iterations = {'name': self.iterations_path, 'path': self.iterations_path}
+                    self._manifest = (outputs, outputs.extend([iterations]))
+                targets = self._manifest[1]
+            else:
+                targets = list(outputs) + [self.iterations_path]
+        result = self.session.run_case(inputs, targets, reinit=reinit, refresh=reinit, case_id=case_id,
+                                       profiles=profiles)
+        result['iterations'] = None
+        if self.iterations_path is not None:
+            result['iterations'] = result['outputs'].pop(self.iterations_path, None)  # 出错的运行没有读取输出
+        return result
+
+    def run(self, cases: list, outputs: list, order: list = None, callback=None, profiles: list = None) -> list:
+        """运行一组工况
+
+        :param cases: 工况列表, 每个工况为 {调用地址: 值}, 应已按最小变化顺序排列(见 grid_cases)
+        :param outputs: 待读取的调用地址列表, 或 py_aspen.OutputManifest
+        :param order: 运行顺序(工况序号列表), defaults to 按 cases 的顺序
+        :param callback: 每个工况完成时调用 callback(index, result), defaults to None
+        :param profiles: 整体读取的数组型节点地址, defaults to None
+        :return: 与 cases 顺序一致的结果列表, 每项同 PyASPENPlus.run_case 的返回值, 另含
+            warm(最终结果是否来自热启动), attempts(运行次数), iterations(最终一次运行的迭代次数),
+            热启动失败时另含 warm_solve_time(热启动那次运行的求解耗时); 失败的运行不读取输出, 没有迭代次数
+        """
+        results = [None] * len(cases)
+        for index in (range(len(cases)) if order is None else order):
+            result = self._run(cases[index], outputs, reinit=False, case_id=index, profiles=profiles)
+            result['warm'] = True
+            result['attempts'] = 1
+            if result['status'] in py_aspen.USABLE_STATUSES:
+                self.warm_ok += 1
+            else:
+                warm_result = result
+                result = self._run(cases[index], outputs, reinit=True, case_id=index, profiles=profiles)
+                result['warm'] = False
+                result['attempts'] = 2
+                result['warm_solve_time'] = warm_result['solve_time']
+                self.fallbacks += 1
+
+            results[index] = result
+            if callback is not None:
+                callback(index, result)
+        return results
+
+
+class SweepSpec(object):
+    """声明式的多变量扫描设置
+
+    spec 字典(或同结构的 YAML 文件)包含:
+
+    - variables: 扫描变量列表, 顺序即嵌套循环由外到内的顺序, 每项为
+      {name, path, start, step, num} 或 {name, path, values}, 可加 as_str: true 以字符串写入(如 Design-Spec 表达式)
+    - derived: 由表达式计算的输入列表, 每项为 {name, path, expr}, expr 可引用变量及之前的派生输入,
+      如 {name: alwt, path: ..., expr: 1 - fewt - tiwt}; 常数可直接写作 expr: 0.21; path 为空时只作中间量
+    - outputs: 输出列表, 每项为 {name, path}, 可加 sign(乘在读数上, 如 -1), element(读取 path 下第几个元素),
+      dtype 和 each(按模板展开), 编译为一个 py_aspen.OutputManifest
+    - sampling: 可选, {method: lhs 或 sobol, n: 工况数, seed: 随机数种子}, 给出时不做全因子组合,
+      而在各变量的 bounds: [下限, 上限](未给出时取 values 的最小, 最大值)内抽样, 见 aspen_sampling
+
+    :param spec: 扫描设置字典
+    """
+
+    def __init__(self, spec: dict):
+        self.variables = [dict(v) for v in spec.get('variables', [])]
+        self.derived = [dict(d) for d in spec.get('derived', [])]
+        self.manifest = py_aspen.OutputManifest(spec.get('outputs', []))
+        self.outputs = self.manifest.entries
+        self.sampling = dict(spec['sampling']) if spec.get('sampling') else None
+        if self.sampling is not None and self.sampling.get('method') not in aspen_sampling.SAMPLERS:
+            raise ValueError(f"unknown sampling method: {self.sampling.get('method')}")
+        if not self.variables:
+            raise ValueError('sweep spec has no variables')
+        names = [v['name'] for v in self.variables + self.derived + self.outputs]
+        duplicated = sorted({name for name in names if names.count(name) > 1})
+        if duplicated:
+            raise ValueError(f'duplicated names in sweep spec: {duplicated}')
+
+        for v in self.variables:
+            if 'values' in v:
+                v['values'] = list(v['values'])
+            else:
+                v['values'] = (v['start'] + v['step'] * np.arange(v['num'])).tolist()
+            v['bounds'] = list(v.get('bounds') or (min(v['values']), max(v['values'])))
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> 'SweepSpec':
+        return cls(spec)
+
+    @classmethod
+    def from_yaml(cls, path: str) -> 'SweepSpec':
+        import yaml
+        with open(path, encoding='utf-8') as f:
+            return cls(yaml.safe_load(f))
+
+    @property
+    def bounds(self) -> list:
+        """各变量的 [下限, 上限]"""
+        return [v['bounds'] for v in self.variables]
+
+    @property
+    def shape(self) -> tuple:
+        """各变量的取值个数"""
+        return tuple(len(v['values']) for v in self.variables)
+
+    @property
+    def output_paths(self) -> list:
+        """按单值读取的输出调用地址"""
+        return self.manifest.paths
+
+    @property
+    def profile_paths(self) -> list:
+        """需整体读取元素的输出调用地址"""
+        return self.manifest.profiles
+
+    def sample_points(self) -> np.ndarray:
+        """变量取值, (工况数, 变量数); 全因子时按嵌套循环顺序排列"""
+        if self.sampling is None:
+            return np.array(list(itertools.product(*(v['values'] for v in self.variables))), dtype=float)
+        sampler = aspen_sampling.SAMPLERS[self.sampling['method']]
+        unit = sampler(self.sampling['n'], len(self.variables), seed=self.sampling.get('seed'))
+        return aspen_sampling.scale_samples(unit, self.bounds)
+
+    def case_table(self, points: np.ndarray = None, start: int = 1) -> pd.DataFrame:
+        """工况表, 序号从 start 开始, 列为变量及派生输入
+
+        :param points: 变量取值, (工况数, 变量数), defaults to sample_points()
+        :param start: 第一个工况的序号, defaults to 1
+        """
+        if points is None:
+            points = self.sample_points()
+        points = np.asarray(points, dtype=float).reshape(-1, len(self.variables))
+        table = pd.DataFrame(points, columns=[v['name'] for v in self.variables],
+                             index=pd.RangeIndex(start, start + len(points), name='case'))
+        namespace = {'np': np}
+        namespace.update({name: table[name].to_numpy() for name in table.columns})
+        for d in self.derived:
+            value = eval(str(d['expr']), {'__builtins__': {}}, namespace)
+            table[d['name']] = np.broadcast_to(value, len(table))
+            namespace[d['name']] = table[d['name']].to_numpy()
+        return table
+
+    def case_inputs(self, table: pd.DataFrame) -> list:
+        """将工况表转换为 run_case 的输入 [{调用地址: 值}]"""
+        columns = [item for item in self.variables + self.derived if item.get('path')]
+        values = [table[item['name']].tolist() for item in columns]
+        cases = []
+        for row in zip(*values):
+            cases.append({item['path']: str(value) if item.get('as_str') else value
+                          for item, value in zip(columns, row)})
+        return cases
+
+    def grid_order(self) -> list:
+        """按蛇形顺序排列的工况位置(从0开始), 相邻工况只有一个变量变化一个步长; 抽样时按原顺序"""
+        if self.sampling is not None:
+            return list(range(self.sampling['n']))
+        return [int(np.ravel_multi_index(idx, self.shape)) for idx in serpentine_order(self.shape)]
+
+    def output_values(self, values: dict) -> list:
+        """由 run_case(outputs=self.manifest)返回的 outputs 得到按 outputs 顺序排列的读数, 缺失的读数记为 NaN"""
+        return [values.get(name, np.nan) for name in self.manifest.names]
+
+
+class ResultStore(object):
+    """按工况数预分配的列式结果存储
+
+    输出读数存放在一个 (工况数, 输出数) 的 float64 数组中, 按列连续存放, 每列可零拷贝地取出;
+    status 和 solve_time 单独成列. 未写入的工况读数为 NaN, status 为 None.
+
+    :param n_cases: 工况数
+    :param names: 输出名称列表
+    :param index: 结果表的行索引, defaults to 0..n_cases-1
+    :param dtypes: 整理结果表时各列的类型 {输出名: dtype}, 含 NaN 的列保留 float64, defaults to None
+    """
+
+    def __init__(self, n_cases: int, names: list, index=None, dtypes: dict = None):
+        self.names = list(names)
+        self.dtypes = dict(dtypes or {})
+        self.index = pd.RangeIndex(n_cases) if index is None else index
+        self._columns = {name: i for i, name in enumerate(self.names)}
+        self.values = np.full((n_cases, len(self.names)), np.nan, order='F')
+        self.status = np.full(n_cases, None, dtype=object)
+        self.solve_time = np.full(n_cases, np.nan)
+        self.recorded = 0
+
+    def __len__(self):
+        return len(self.status)
+
+    def record(self, position: int, values, status: str, solve_time: float = None):
+        """写入一个工况的结果
+
+        :param position: 工况位置(从0开始)
+        :param values: 按 names 顺序排列的读数, None 记为 NaN
+        :param status: 运行状态
+        :param solve_time: 求解耗时(s), defaults to None
+        """
+        self.values[position] = [np.nan if value is None else value for value in values]
+        if self.status[position] is None:
+            self.recorded += 1
+        self.status[position] = str(status)
+        self.solve_time[position] = np.nan if solve_time is None else solve_time
+
+    def column(self, name: str) -> np.ndarray:
+        """某个输出的全部读数, 为底层数组的视图"""
+        return self.values[:, self._columns[name]]
+
+    def to_frame(self, copy: bool = False) -> pd.DataFrame:
+        """整理为一个 DataFrame, 列为各输出, status 和 solve_time
+
+        :param copy: 是否复制读数, 否则输出列与底层数组共享内存, defaults to False
+        """
+        frame = pd.DataFrame(self.values, index=self.index, columns=self.names, copy=copy)
+        for name, dtype in self.dtypes.items():
+            if not np.isnan(self.column(name)).any():
+                frame[name] = frame[name].astype(dtype)
+        return frame.assign(status=self.status.copy(), solve_time=self.solve_time.copy())
+
+
+def read_journal(path: str) -> pd.DataFrame:
+    """读取 SweepJournal 写出的日志, 每个工况一行, 以工况序号为索引; 同一工况记录多次时取最后一次"""
+    table = pd.read_csv(path, index_col='case')
+    return table[~table.index.duplicated(keep='last')].sort_index()
+
+
+class SweepJournal(object):
+    """逐工况追加写入的 CSV 日志, 每写一行即落盘, 进程或 ASPEN 崩溃时已完成的工况不会丢失
+
+    列为 case(工况序号), 各输入, 各输出, status, solve_time 和 finished(完成时刻).
+    打开已有日志时会丢弃崩溃时写了一半的最后一行.
+
+    :param path: 日志文件路径
+    :param columns: 输入和输出的列名
+    """
+
+    def __init__(self, path: str, columns: list):
+        self.path = path
+        self.columns = ['case'] + list(columns) + ['status', 'solve_time', 'finished']
+        if os.path.exists(path):
+            self._truncate_partial_line()
+            with open(path, newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f), None)
+            if header is not None and header != self.columns:
+                raise ValueError(f'journal {path} was written for different columns')
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if new:
+            self._write(self.columns)
+
+    def _truncate_partial_line(self):
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _write(self, row: list):
+        self._writer.writerow(row)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, case, values: list, status: str, solve_time: float = None):
+        """写入一个工况
+
+        :param case: 工况序号
+        :param values: 按 columns 顺序排列的输入和输出
+        :param status: 运行状态
+        :param solve_time: 求解耗时(s), defaults to None
+        """
+        self._write([case] + list(values) + [status, solve_time, time.time()])
+
+    def read(self) -> pd.DataFrame:
+        return read_journal(self.path)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class SweepRunner(object):
+    """按 SweepSpec 运行全部工况, 返回整理好的结果表
+
+    session, pool 二选一: 给出 pool(AspenWorkerPool)时并行运行, 否则在 session 上依次运行;
+    warm_start 为 True 时按蛇形顺序热启动运行(见 WarmStartScheduler), 结果表和日志中另记录 WARM_COLUMNS:
+    最终一次运行的迭代次数, 是否来自热启动, 运行次数和热启动失败时那次运行的求解耗时.
+
+    :param spec: 扫描设置
+    :param session: 已载入文件的 PyASPENPlus, defaults to None
+    :param pool: 已启动的 AspenWorkerPool, defaults to None
+    :param warm_start: 是否热启动运行, 仅用于 session, defaults to False
+    :param iterations_path: 收敛迭代次数所在的调用地址, 见 WarmStartScheduler, defaults to None
+    :param journal_path: 逐工况写入结果的日志文件(见 SweepJournal), defaults to None
+    :param screen: 预筛工况的代理模型(见 aspen_surrogate.SurrogateScreen), 给出时分批运行,
+        每批之前用已完成的工况训练, 跳过大概率失败的工况(status 记为 skipped), 预测值与结果一并记录, defaults to None
+    """
+
+    def __init__(self, spec: SweepSpec, session: py_aspen.PyASPENPlus = None, pool=None,
+                 warm_start: bool = False, iterations_path: str = None, journal_path: str = None, screen=None):
+        if (session is None) == (pool is None):
+            raise ValueError('exactly one of session and pool must be given')
+        self.spec = spec
+        self.session = session
+        self.pool = pool
+        self.warm_start = warm_start
+        self.iterations_path = iterations_path
+        self.journal_path = journal_path
+        self.screen = screen
+        if screen is not None and screen.features is None:
+            screen.features = [v['name'] for v in spec.variables]
+        self.store = None  # 最近一次运行的 ResultStore
+        self.predictions = None  # 最近一次运行中各工况运行前的代理模型预测值
+        self.warm_stats = None  # 最近一次热启动运行中各工况的 WARM_COLUMNS
+
+    def _execute(self, cases: list, positions: list, on_result):
+        """按 positions 的顺序运行工况"""
+        manifest = self.spec.manifest
+        if self.pool is not None:
+            self.pool.map_cases([cases[index] for index in positions], manifest,
+                                callback=lambda i, result: on_result(positions[i], result))
+        elif self.warm_start:
+            scheduler = WarmStartScheduler(self.session, self.iterations_path)
+            scheduler.run(cases, manifest, order=positions, callback=on_result)
+        else:
+            for index in positions:
+                on_result(index, self.session.run_case(cases[index], manifest, case_id=index))
+
+    def _load_journal(self, table: pd.DataFrame, store: ResultStore, extras: list = ()) -> list:
+        """将日志中已完成的工况写入 store 和 extras 中的各附加列表, 返回其位置"""
+        done = read_journal(self.journal_path)
+        done = done[done.index.isin(table.index)]
+        inputs = table.loc[done.index]
+        if not np.allclose(done[inputs.columns].to_numpy(float), inputs.to_numpy(float), equal_nan=True):
+            raise ValueError(f'journal {self.journal_path} does not match the sweep spec')
+        positions = table.index.get_indexer(done.index).tolist()
+        for position, values, status, solve_time in zip(positions, done[store.names].to_numpy(float),
+                                                        done['status'], done['solve_time']):
+            store.record(position, values, status, solve_time)
+        for extra in extras:
+            extra.loc[done.index] = done[extra.columns].to_numpy(float)
+        return positions
+
+    def run(self, callback=None, resume: bool = False, table: pd.DataFrame = None) -> pd.DataFrame:
+        """运行全部工况
+
+        :param callback: 每个工况完成时调用 callback(index, result), index 从0开始, defaults to None
+        :param resume: 是否跳过日志中已完成的工况, 否则日志已存在时报错, defaults to False
+        :param table: 待运行的工况表(见 SweepSpec.case_table), defaults to 设置中的全部工况
+        :return: 每个工况一行, 列为变量, 派生输入, 各输出, status 和 solve_time,
+            热启动运行时另有 WARM_COLUMNS, 预筛时另有各预测值
+        """
+        full = table is None
+        table = self.spec.case_table() if full else table
+        cases = self.spec.case_inputs(table)
+        manifest = self.spec.manifest
+        store = ResultStore(len(cases), manifest.names, index=table.index, dtypes=manifest.dtypes)
+        self.store = store
+        predictions = None
+        if self.screen is not None:
+            predictions = pd.DataFrame(np.nan, index=table.index, columns=self.screen.columns)
+        self.predictions = predictions
+        warm = None
+        if self.warm_start and self.pool is None:
+            warm = pd.DataFrame(np.nan, index=table.index, columns=WARM_COLUMNS)
+        self.warm_stats = warm
+        extras = [extra for extra in (warm, predictions) if extra is not None]
+
+        pending = list(range(len(cases)))
+        journal = None
+        if self.journal_path is not None:
+            existed = os.path.exists(self.journal_path)
+            if existed and not resume:
+                raise FileExistsError(f'journal {self.journal_path} exists, resume it or remove it first')
+            extra_columns = [column for extra in extras for column in extra.columns]
+            journal = SweepJournal(self.journal_path, list(table.columns) + store.names + extra_columns)
+            if existed:
+                try:
+                    done = set(self._load_journal(table, store, extras))
+                except Exception:
+                    journal.close()
+                    raise
+                pending = [index for index in pending if index not in done]
+
+        def on_result(index, result):
+            values = self.spec.output_values(result['outputs'])
+            store.record(index, values, result['status'], result['solve_time'])
+            if warm is not None:
+                # 预筛跳过的工况没有运行, 各列保留 NaN
+                warm.iloc[index] = [np.nan if result.get(name) is None else float(result[name])
+                                    for name in WARM_COLUMNS]
+            if journal is not None:
+                extra = [value for extra in extras for value in extra.iloc[index].tolist()]
+                journal.append(table.index[index], table.iloc[index].tolist() + values + extra, result['status'],
+                               result['solve_time'])
+            if callback is not None:
+                callback(index, result)
+
+        try:
+            if self.screen is None:
+                if self.warm_start and full:
+                    todo = set(pending)
+                    pending = [index for index in self.spec.grid_order() if index in todo]
+                self._execute(cases, pending, on_result)
+            else:
+                self._run_screened(table, cases, pending, on_result)
+        finally:
+            if journal is not None:
+                journal.close()
+
+        if warm is not None:
+            extras[0] = warm.astype({'warm': 'boolean', 'attempts': 'Int64'})
+        return pd.concat([table, store.to_frame()] + extras, axis=1)
+
+    def _run_screened(self, table: pd.DataFrame, cases: list, pending: list, on_result):
+        """分批运行, 每批之前由代理模型决定跳过哪些工况和下一批运行哪些工况"""
+        skipped = {'outputs': {}, 'status': aspen_surrogate.SKIPPED, 'solve_time': None}
+        pending = list(pending)
+        while pending:
+            results = pd.concat([table, self.store.to_frame()], axis=1)
+            run, skip, predictions = self.screen.plan(results, table.iloc[pending])
+            self.predictions.loc[predictions.index] = predictions.to_numpy(float)
+            run, skip = table.index.get_indexer(run).tolist(), table.index.get_indexer(skip).tolist()
+            for index in skip:
+                on_result(index, skipped)
+            self._execute(cases, run, on_result)
+            finished = set(run) | set(skip)
+            pending = [index for index in pending if index not in finished]
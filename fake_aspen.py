@@ -0,0 +1,262 @@
+import os
+import json
+import time
+
+from py_aspen import AspenBackend
+
+RUN_STATUS = r'\Data\Results Summary\Run-Status\Output'
+RUNID = RUN_STATUS + r'\RUNID'
+PER_ERROR = RUN_STATUS + r'\PER_ERROR'
+
+
+class FakeSimulationError(Exception):
+    """由模型抛出, 表示本次模拟未收敛
+
+    :param message: 写入 PER_ERROR 和 .his 文件的错误信息
+    :param severe: 是否记为 SEVERE ERROR, defaults to False
+    """
+
+    def __init__(self, message: str, severe: bool = False):
+        super().__init__(message)
+        self.severe = severe
+
+
+class FakeElements(object):
+    """节点的 Elements 集合, 元素顺序与写入顺序一致"""
+
+    def __init__(self, nodes: list):
+        self._nodes = nodes
+
+    @property
+    def Count(self):
+        return len(self._nodes)
+
+    def Item(self, key):
+        """按序号(从0开始)或元素名称取元素"""
+        if isinstance(key, int):
+            return self._nodes[key]
+        for node in self._nodes:
+            if node.Name == key:
+                return node
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+class FakeNode(object):
+    """节点树中的一个节点, Value 直接读写文档中的节点字典"""
+
+    def __init__(self, doc, path: str):
+        self._doc = doc
+        self.path = path
+
+    @property
+    def Name(self):
+        return self.path.rsplit('\\', 1)[-1]
+
+    @property
+    def Value(self):
+        return self._doc.tree.get(self.path)
+
+    @Value.setter
+    def Value(self, value):
+        self._doc.set_value(self.path, value)
+
+    # ASPEN COM 对属性名大小写不敏感, 原有代码中也有 e.value 的写法
+    value = Value
+
+    @property
+    def Elements(self):
+        return FakeElements([FakeNode(self._doc, child) for child in self._doc.children(self.path)])
+
+
+class FakeTree(object):
+
+    def __init__(self, doc):
+        self._doc = doc
+
+    def FindNode(self, path: str):
+        if self._doc.has_node(path):
+            return FakeNode(self._doc, path)
+        return None
+
+
+class FakeEngine(object):
+
+    def __init__(self, doc):
+        self._doc = doc
+
+    def Run2(self, run_async: bool = False):
+        self._doc.start_run()
+        if not run_async:
+            time.sleep(self._doc.solve_delay)
+            self._doc.finish_run()
+
+    @property
+    def IsRunning(self):
+        return 1 if self._doc.poll_run() else 0
+
+    def Stop(self):
+        self._doc.stop_run()
+
+
+class FakeAspenDocument(object):
+    """在内存中模拟的 ASPEN Plus 文档
+
+    节点树为 {调用地址: 值} 字典, 子节点由地址的层级关系确定, 如 TLIQ\\1, TLIQ\\2 构成 TLIQ 的 Elements.
+    每次运行时以当前节点树的副本调用 model(tree), 返回的 {调用地址: 值} 写回节点树;
+    model 抛出 FakeSimulationError 表示模拟出错. 结果在 solve_delay 秒后才可见.
+
+    :param model: 流程模型, model(tree: dict) -> dict
+    :param tree: 初始节点树, 相当于 .bkp 文件的内容, defaults to None
+    :param solve_delay: 每次求解的耗时(s), 为 float('inf') 时模拟卡死的运行, defaults to 0.0
+    :param write_history: 是否在 .bkp 所在目录写入 <RUNID>.his 历史文件, defaults to True
+    """
+
+    def __init__(self, model, tree: dict = None, solve_delay: float = 0.0, write_history: bool = True):
+        self.model = model
+        self.base_tree = dict(tree or {})
+        self.solve_delay = solve_delay
+        self.write_history = write_history
+
+        self.Visible = 0
+        self.SuppressDialogs = 1
+        self.Tree = FakeTree(self)
+        self.Engine = FakeEngine(self)
+
+        self.archive_path = None
+        self.run_count = 0
+        self.reinit_count = 0
+        self._pending = None  # (结束时刻, 结果节点, 错误信息)
+        self._reset_tree()
+
+    # ---- 节点树 ---------------------------------------------------------------------------------
+
+    def _reset_tree(self):
+        self.tree = {}
+        self._children = {}
+        for path, value in self.base_tree.items():
+            self.set_value(path, value)
+        self.set_value(PER_ERROR, None)
+        if RUNID not in self.tree:
+            self.set_value(RUNID, 'FAKE')
+
+    def set_value(self, path: str, value):
+        if path not in self.tree:
+            parent = path.rsplit('\\', 1)[0]
+            self._children.setdefault(parent, []).append(path)
+        self.tree[path] = value
+
+    def remove_children(self, path: str):
+        for child in self._children.pop(path, []):
+            self.remove_children(child)
+            self.tree.pop(child, None)
+
+    def has_node(self, path: str) -> bool:
+        return path in self.tree or path in self._children
+
+    def children(self, path: str) -> list:
+        return list(self._children.get(path, []))
+
+    # ---- ASPEN 文档接口 --------------------------------------------------------------------------
+
+    def InitFromArchive2(self, path: str):
+        """载入文件; SaveAs 保存的快照会恢复其中的节点树, 其他文件使用初始节点树"""
+        self.archive_path = path
+        self._pending = None
+        self._reset_tree()
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = None
+        if isinstance(saved, dict) and saved.get('fake_aspen_snapshot'):
+            self.tree, self._children = {}, {}
+            for path_, value in saved['tree']:
+                self.set_value(path_, value)
+        self.set_value(RUNID, os.path.splitext(os.path.basename(path))[0].upper())
+
+    InitFromFile2 = InitFromArchive2
+
+    def SaveAs(self, path: str, overwrite: bool = True):
+        if os.path.exists(path) and not overwrite:
+            raise FileExistsError(path)
+        with open(path, 'w') as f:
+            json.dump({'fake_aspen_snapshot': True, 'tree': list(self.tree.items())}, f, default=str)
+
+    def Reinit(self):
+        self.reinit_count += 1
+
+    def Quit(self):
+        self._pending = None
+
+    def Close(self):
+        self._pending = None
+
+    # ---- 运行 ------------------------------------------------------------------------------------
+
+    def start_run(self):
+        self.run_count += 1
+        error = None
+        try:
+            results = self.model(dict(self.tree)) or {}
+        except FakeSimulationError as e:
+            results, error = {}, e
+        self._pending = (time.perf_counter() + self.solve_delay, results, error)
+
+    def poll_run(self) -> bool:
+        """返回是否仍在运行, 运行结束时写回结果"""
+        if self._pending is None:
+            return False
+        if time.perf_counter() < self._pending[0]:
+            return True
+        self.finish_run()
+        return False
+
+    def finish_run(self):
+        if self._pending is None:
+            return
+        _, results, error = self._pending
+        self._pending = None
+        for path, value in results.items():
+            self.set_value(path, value)
+        self._record_status([] if error is None else [error])
+
+    def stop_run(self):
+        if self._pending is not None:
+            self._pending = None
+            self._record_status([FakeSimulationError('run stopped by user', severe=True)])
+
+    def _record_status(self, errors: list):
+        self.remove_children(PER_ERROR)
+        for i, e in enumerate(errors):
+            self.set_value(f'{PER_ERROR}\\{i + 1}', f"{'severe error' if e.severe else 'error'}: {e}")
+
+        if self.write_history and self.archive_path is not None:
+            his_path = os.path.join(os.path.dirname(self.archive_path), f'{self.tree[RUNID]}.his')
+            with open(his_path, 'a') as f:
+                f.write(f' RUN {self.run_count}\n')
+                for e in errors:
+                    f.write(f" *** {'SEVERE ERROR' if e.severe else 'ERROR'}\n")
+                    f.write(f'     {e}\n')
+                f.write('\n')
+
+
+class FakeAspenBackend(AspenBackend):
+    """返回 FakeAspenDocument 的后端, 参数含义同 FakeAspenDocument
+
+    model 需为模块级函数或可被 pickle 的对象, 以便在多进程中使用.
+    """
+
+    def __init__(self, model, tree: dict = None, solve_delay: float = 0.0, write_history: bool = True):
+        self.model = model
+        self.tree = dict(tree or {})
+        self.solve_delay = solve_delay
+        self.write_history = write_history
+
+    def dispatch(self, prog_id: str):
+        return FakeAspenDocument(self.model, self.tree, self.solve_delay, self.write_history)
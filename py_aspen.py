@@ -1,9 +1,102 @@
-import win32com.client as win32
 import numpy as np
+import abc
 import time
 import sys
 import os
+import re
+import json
+import sqlite3
+import bisect
+import hashlib
+import functools
+import logging
+import logging.handlers
+import contextlib
+import contextvars
+import enum
 import psutil
+from dataclasses import dataclass, field
+
+try:
+    import win32com.client as win32
+except ImportError:  # 非Windows环境下只能使用替代后端, 如 fake_aspen.FakeAspenBackend
+    win32 = None
+
+
+logger = logging.getLogger('py_aspen')
+_log_handler = None  # configure_logging 最近一次添加的 handler
+
+_CASE_ID = contextvars.ContextVar('case_id', default=None)
+
+
+@contextlib.contextmanager
+def case_context(case_id):
+    """在此上下文中产生的日志都带上 case_id, case_id 为 None 时沿用外层的值"""
+    if case_id is None:
+        yield
+        return
+    token = _CASE_ID.set(case_id)
+    try:
+        yield
+    finally:
+        _CASE_ID.reset(token)
+
+
+class _CaseIdFilter(logging.Filter):
+    """在日志产生时(而不是缓冲写出时)记录当前的 case_id"""
+
+    def filter(self, record):
+        if not hasattr(record, 'case_id'):
+            record.case_id = _CASE_ID.get()
+        return True
+
+
+class JsonLineFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON, 包含 extra 中传入的结构化字段(如 case_id, 耗时)"""
+
+    _RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        event = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED:
+                event[key] = value
+        if record.exc_info:
+            event['exc'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+
+def configure_logging(log_file: str = None, level: int = logging.INFO, capacity: int = 1000,
+                      flush_level: int = logging.ERROR) -> logging.Handler:
+    """将 py_aspen 及其子日志(如 py_aspen.calibration)以 JSON 行写出, 经内存缓冲批量写入
+
+    :param log_file: 日志文件路径, defaults to None(标准输出)
+    :param level: 日志级别, 低于该级别的日志(如逐个节点的 DEBUG 信息)不产生任何开销, defaults to logging.INFO
+    :param capacity: 缓冲的日志条数, defaults to 1000
+    :param flush_level: 达到该级别时立即写出缓冲, defaults to logging.ERROR
+    :return: 添加到 py_aspen 日志上的缓冲 handler, 替换此前调用添加的 handler
+    """
+    global _log_handler
+    if _log_handler is not None:
+        # 多次调用(如导入 aspen_calc_best 的脚本再次配置)时每条日志只写出一次
+        logger.removeHandler(_log_handler)
+        previous_target = _log_handler.target
+        _log_handler.close()  # 写出缓冲
+        previous_target.close()
+    target = logging.StreamHandler(sys.stdout) if log_file is None else logging.FileHandler(log_file, encoding='utf-8')
+    target.setFormatter(JsonLineFormatter())
+    handler = logging.handlers.MemoryHandler(capacity, flushLevel=flush_level, target=target)
+    handler.addFilter(_CaseIdFilter())
+    logger.addHandler(handler)
+    _log_handler = handler
+    logger.setLevel(level)
+    logger.propagate = False
+    return handler
 
 
 def get_pid(process_name):
@@ -12,20 +105,553 @@ def get_pid(process_name):
             return proc.pid
 
 
+ASPEN_PROCESS_NAMES = ('AspenPlus', 'Aspen', 'apmain')
+
+
+def get_aspen_pids() -> set:
+    """当前所有 ASPEN 相关进程的 PID"""
+    pids = set()
+    for proc in psutil.process_iter(['name']):
+        name = proc.info['name'] or ''
+        if any(procstr in name for procstr in ASPEN_PROCESS_NAMES):
+            pids.add(proc.pid)
+    return pids
+
+
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
 sys.path.append(BASE_DIR)
 
 
+class SimulationTimeoutError(RuntimeError):
+    """模拟运行超过设定的最长时长"""
+
+
+USABLE_STATUSES = ('OK', 'warnings')
+
+
+class RunOutcome(str, enum.Enum):
+    """一次运行的结果分类, 可直接与字符串比较, 如 outcome == 'OK'
+
+    OK 和 WARNINGS 的结果可用, 其余运行不读取输出.
+    """
+    OK = 'OK'
+    WARNINGS = 'warnings'
+    ERROR = 'error'
+    SEVERE = 'severe'
+    TIMEOUT = 'timeout'
+
+    def __str__(self):
+        return self.value
+
+    @property
+    def usable(self) -> bool:
+        return self.value in USABLE_STATUSES
+
+    @classmethod
+    def classify(cls, messages: str) -> 'RunOutcome':
+        """由 PER_ERROR 中的信息判断结果分类
+
+        与原先的 result_error 一样区分大小写, 只匹配小写的 severe, error 和 warning,
+        因而哪些运行记为出错(如 aspen_calc_best 中重新调整 ABSLEAN 的循环)与原先相同.
+        """
+        if 'severe' in messages:
+            return cls.SEVERE
+        if 'error' in messages:
+            return cls.ERROR
+        if 'warning' in messages:
+            return cls.WARNINGS
+        return cls.OK
+
+
+class AspenBackend(abc.ABC):
+    """模拟器后端接口
+
+    dispatch 返回的文档对象需提供 PyASPENPlus 用到的 ASPEN COM 接口子集:
+    InitFromArchive2(.bkp), InitFromFile2(.apw), SaveAs(path, overwrite)(用于收敛快照),
+    Visible, SuppressDialogs, Reinit, Quit, Close,
+    Engine.Run2 / Engine.IsRunning / Engine.Stop,
+    Tree.FindNode(path) 返回的节点的 Value(可读写), Name 和 Elements(可迭代, 支持 Count/Item),
+    以及 \\Data\\Results Summary\\Run-Status\\Output 下的 RUNID 和 PER_ERROR 节点.
+    """
+
+    @abc.abstractmethod
+    def dispatch(self, prog_id: str):
+        """按 ProgID 开启一个 ASPEN 文档对象"""
+
+
+class ComBackend(AspenBackend):
+    """通过 win32com 连接本机安装的 ASPEN Plus"""
+
+    def dispatch(self, prog_id: str):
+        if win32 is None:
+            raise ImportError('pywin32 is required to dispatch ASPEN Plus through COM')
+        return win32.Dispatch(prog_id)
+
+
+@dataclass
+class HistoryStatus:
+    """.his 历史文件中一段新增内容的检查结果"""
+    severe_errors: int = 0
+    errors: int = 0
+    warnings: int = 0
+    error_blocks: list = field(default_factory=list)  # 每个错误信息块为一个多行字符串
+
+    @property
+    def ok(self) -> bool:
+        return self.severe_errors == 0
+
+
+class HistoryReader(object):
+    """增量读取 .his 历史文件
+
+    为每个文件记录已读取的字节位置, 每次只扫描新追加的内容, 耗时与会话长度无关.
+    末尾不完整的一行留待下次读取; 文件变短(被重新创建)时从头读取.
+    """
+
+    _SEVERE = re.compile(r'SEVERE\s+ERROR')
+    _ERROR = re.compile(r'\*\s*ERROR')
+    _WARNING = re.compile(r'\*\s*WARNING')
+
+    def __init__(self):
+        self._offsets = {}
+
+    def reset(self):
+        self._offsets.clear()
+
+    def read(self, file_path: str) -> HistoryStatus:
+        status = HistoryStatus()
+        offset = self._offsets.get(file_path, 0)
+        if os.path.getsize(file_path) < offset:
+            offset = 0
+
+        block = None  # 正在收集的错误信息块
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                offset += len(raw)
+                line = raw.decode('utf-8', errors='replace').rstrip()
+
+                if self._SEVERE.search(line):
+                    status.severe_errors += 1
+                    block = [line]
+                    status.error_blocks.append(block)
+                elif self._ERROR.search(line):
+                    status.errors += 1
+                    block = [line]
+                    status.error_blocks.append(block)
+                elif self._WARNING.search(line):
+                    status.warnings += 1
+                    block = None
+                elif not line.strip():
+                    block = None
+                elif block is not None:
+                    block.append(line)
+
+        self._offsets[file_path] = offset
+        status.error_blocks = ['\n'.join(b) for b in status.error_blocks]
+        return status
+
+
+class ResultCache(object):
+    """模拟结果的磁盘缓存(SQLite)
+
+    以 .bkp 文件内容哈希和按地址排序、取整后的输入值为键, 保存输出值和运行状态.
+    超出 max_entries 时淘汰最久未使用的工况. 多个进程可共用同一个数据库文件.
+
+    :param db_path: 数据库文件路径
+    :param tolerance: 数值输入的取整精度, defaults to 1e-6
+    :param max_entries: 最多保留的工况数, defaults to 100000
+    """
+
+    def __init__(self, db_path: str, tolerance: float = 1e-6, max_entries: int = 100000):
+        self.db_path = db_path
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results '
+                          '(key TEXT PRIMARY KEY, outputs TEXT, status TEXT, solve_time REAL, last_used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.conn.commit()
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """计算 ASPEN 文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def make_key(self, archive_hash: str, inputs: dict) -> str:
+        items = []
+        for call_address1 in sorted(inputs):
+            value1 = inputs[call_address1]
+            if isinstance(value1, (int, float, np.number)) and not isinstance(value1, bool):
+                value1 = int(round(float(value1) / self.tolerance))
+            items.append([call_address1, value1])
+        return hashlib.sha256(json.dumps([archive_hash, items]).encode()).hexdigest()
+
+    def get(self, key: str, outputs: list):
+        """查找缓存, 仅当所需输出均已缓存时命中, 返回值同 PyASPENPlus.run_case"""
+        row = self.conn.execute('SELECT outputs, status, solve_time FROM results WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            cached = json.loads(row[0])
+            # 不可用的运行没有读取输出, 直接命中
+            if row[1] not in USABLE_STATUSES or all(call_address1 in cached for call_address1 in outputs):
+                self.hits += 1
+                self.conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+                return {
+                    'outputs': {call_address1: cached[call_address1] for call_address1 in outputs
+                                if call_address1 in cached},
+                    'status': RunOutcome(row[1]),
+                    'solve_time': row[2],
+                    'cached': True,
+                }
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: dict):
+        """写入一次模拟结果, 与该工况已缓存的输出合并"""
+        row = self.conn.execute('SELECT outputs FROM results WHERE key = ?', (key,)).fetchone()
+        cached = {} if row is None else json.loads(row[0])
+        cached.update(result['outputs'])
+        self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                          (key, json.dumps(cached, default=float), str(result['status']), result['solve_time'],
+                           time.time()))
+        self.conn.execute('DELETE FROM results WHERE key IN '
+                          '(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self.conn.commit()
+
+    def stats(self) -> dict:
+        size = self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.conn.close()
+
+
+def _as_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class OutputManifest(object):
+    """编译一次的输出清单, 每个工况按清单一次读取全部输出到预分配的 float64 行中
+
+    每项为 {name, path}, 可加:
+
+    - sign: 乘在读数上, 如 -1 表示取负(HRSG 的 QCALC), defaults to 1
+    - element: 读取 path 下第几个元素(整体读取一次, 见 PyASPENPlus.get_profile), defaults to None
+    - dtype: 整理结果表时该列的类型, 如 int64, 含 NaN 时保留 float64, defaults to float64
+    - each: 列表, 给出时 name 和 path 作为模板, 对每个元素 format 展开,
+      如 {name: rb_{}, path: ...\\CISOLID\\{}, each: [FE2O3, FE3O4]}
+
+    多项读取同一节点时只读取一次. 无法转换为数值的读数记为 NaN.
+
+    :param entries: 输出列表
+    """
+
+    def __init__(self, entries: list):
+        self.entries = []
+        for entry in entries:
+            entry = dict(entry)
+            each = entry.pop('each', None)
+            if each is None:
+                self.entries.append(entry)
+            else:
+                self.entries.extend(dict(entry, name=entry['name'].format(x), path=entry['path'].format(x))
+                                    for x in each)
+        self.names = [e['name'] for e in self.entries]
+        duplicated = sorted({name for name in self.names if self.names.count(name) > 1})
+        if duplicated:
+            raise ValueError(f'duplicated output names: {duplicated}')
+
+        # 去重后的调用地址, 按首次出现的顺序
+        self.paths = list(dict.fromkeys(e['path'] for e in self.entries if e.get('element') is None))
+        self.profiles = list(dict.fromkeys(e['path'] for e in self.entries if e.get('element') is not None))
+        self.signs = np.array([e.get('sign', 1) for e in self.entries], dtype=np.float64)
+        self.dtypes = {e['name']: e['dtype'] for e in self.entries if e.get('dtype', 'float64') != 'float64'}
+
+        path_index = {path: i for i, path in enumerate(self.paths)}
+        profile_index = {path: i for i, path in enumerate(self.profiles)}
+        scalar = [(col, path_index[e['path']]) for col, e in enumerate(self.entries) if e.get('element') is None]
+        self._scalar_cols = np.array([col for col, _ in scalar], dtype=np.intp)
+        self._scalar_src = np.array([src for _, src in scalar], dtype=np.intp)
+        self._element_cols = [(col, profile_index[e['path']], e['element'])
+                              for col, e in enumerate(self.entries) if e.get('element') is not None]
+        self._raw = np.empty(len(self.paths), dtype=np.float64)  # 最近一次读取的各调用地址读数
+        self._profile_values = [None] * len(self.profiles)
+
+        self.reads = 0
+        self.read_seconds = 0.0
+        self.max_read_seconds = 0.0
+
+    def __len__(self):
+        return len(self.names)
+
+    def new_row(self) -> np.ndarray:
+        return np.full(len(self.names), np.nan)
+
+    def extend(self, entries: list) -> 'OutputManifest':
+        """在末尾追加输出, 返回新的清单"""
+        return OutputManifest(self.entries + list(entries))
+
+    def fill(self, raw: np.ndarray, profiles: list, out: np.ndarray = None) -> np.ndarray:
+        """由各调用地址的读数得到一行输出
+
+        :param raw: 与 paths 对应的读数
+        :param profiles: 与 profiles 对应的元素读数
+        :param out: 写入的行, defaults to 新建一行
+        """
+        row = self.new_row() if out is None else out
+        row[self._scalar_cols] = raw[self._scalar_src]
+        for col, src, element in self._element_cols:
+            values = profiles[src]
+            row[col] = _as_float(values[element]) if values is not None and element < len(values) else np.nan
+        row *= self.signs
+        return row
+
+    def assemble(self, values: dict, out: np.ndarray = None) -> np.ndarray:
+        """由 {调用地址: 读数}(如 ResultCache 中的结果)得到一行输出"""
+        raw = np.array([_as_float(values.get(path)) for path in self.paths], dtype=np.float64)
+        return self.fill(raw, [values.get(path) for path in self.profiles], out)
+
+    def record_read(self, seconds: float):
+        self.reads += 1
+        self.read_seconds += seconds
+        self.max_read_seconds = max(self.max_read_seconds, seconds)
+
+    def read_stats(self) -> dict:
+        """按清单读取的次数和耗时(s)"""
+        return {
+            'reads': self.reads,
+            'paths': len(self.paths) + len(self.profiles),
+            'outputs': len(self.names),
+            'total': self.read_seconds,
+            'mean': self.read_seconds / self.reads if self.reads else 0.0,
+            'max': self.max_read_seconds,
+        }
+
+
+class EngineRecycler(object):
+    """根据本会话所属 ASPEN 进程的健康状况决定是否重启引擎
+
+    任一条件满足即重启: 进程内存(RSS)超过 max_rss_mb, 句柄数超过 max_handles,
+    最近 window 次求解耗时的中位数超过重启后前 baseline_runs 次中位数的 max_latency_ratio 倍,
+    或自上次重启已运行 max_runs 次. 参数为 None 时不检查该项.
+
+    :param max_rss_mb: 内存上限(MB), defaults to 2048
+    :param max_handles: 句柄数上限(非Windows下为文件描述符数), defaults to 10000
+    :param max_latency_ratio: 求解耗时漂移上限, defaults to 3.0
+    :param baseline_runs: 计算基准耗时的运行次数, defaults to 5
+    :param window: 计算近期耗时的运行次数, defaults to 5
+    :param max_runs: 两次重启之间的最多运行次数, defaults to None
+    """
+
+    def __init__(self, max_rss_mb: float = 2048, max_handles: int = 10000, max_latency_ratio: float = 3.0,
+                 baseline_runs: int = 5, window: int = 5, max_runs: int = None):
+        self.max_rss_mb = max_rss_mb
+        self.max_handles = max_handles
+        self.max_latency_ratio = max_latency_ratio
+        self.baseline_runs = baseline_runs
+        self.window = window
+        self.max_runs = max_runs
+        self.recycles = 0
+
+    @staticmethod
+    def process_stats(pids: set) -> dict:
+        """汇总给定进程的内存(MB)和句柄数, 已退出的进程忽略"""
+        rss, handles = 0, 0
+        for pid in pids:
+            try:
+                proc = psutil.Process(pid)
+                rss += proc.memory_info().rss
+                handles += proc.num_handles() if hasattr(proc, 'num_handles') else proc.num_fds()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return {'rss_mb': rss / 2 ** 20, 'handles': handles}
+
+    def check(self, session) -> str:
+        """返回需要重启的原因, 无需重启时返回 None"""
+        solve_times = session.solve_times[session.runs_at_restart:]
+        if self.max_runs is not None and len(solve_times) >= self.max_runs:
+            return f'{len(solve_times)} runs since last restart'
+
+        if self.max_latency_ratio is not None and len(solve_times) >= self.baseline_runs + self.window:
+            baseline = np.median(solve_times[:self.baseline_runs])
+            recent = np.median(solve_times[-self.window:])
+            if baseline > 0 and recent / baseline > self.max_latency_ratio:
+                return f'solve time drifted from {baseline:.2f} s to {recent:.2f} s'
+
+        if session.engine_pids and (self.max_rss_mb is not None or self.max_handles is not None):
+            stats = self.process_stats(session.engine_pids)
+            if self.max_rss_mb is not None and stats['rss_mb'] > self.max_rss_mb:
+                return f"engine memory {stats['rss_mb']:.0f} MB"
+            if self.max_handles is not None and stats['handles'] > self.max_handles:
+                return f"engine holds {stats['handles']} handles"
+        return None
+
+
+class _NullTimer(object):
+    """关闭计时时使用的空上下文"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _PhaseTimer(object):
+
+    def __init__(self, metrics, phase: str):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.phase, time.perf_counter() - self.t0)
+        return False
+
+
+class Instrumentation(object):
+    """按阶段记录耗时直方图和 COM 调用次数
+
+    阶段: input(写入输入), reinit, solve(求解), output(读取结果), status(解析运行状态), restart(重启).
+    enabled 为 False 时不做任何记录.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+               120.0, 300.0)
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}  # phase -> 各区间计数, 最后一个区间为 +Inf
+        self.sums = {}
+        self.counts = {}
+        self.com_calls = 0
+
+    def phase(self, phase: str):
+        """计时上下文: with metrics.phase('solve'): ..."""
+        return _PhaseTimer(self, phase) if self.enabled else _NULL_TIMER
+
+    def observe(self, phase: str, seconds: float):
+        if not self.enabled:
+            return
+        if phase not in self.histograms:
+            self.histograms[phase] = [0] * (len(self.BUCKETS) + 1)
+            self.sums[phase] = 0.0
+            self.counts[phase] = 0
+        self.histograms[phase][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sums[phase] += seconds
+        self.counts[phase] += 1
+
+    def count_com(self, n: int = 1):
+        if self.enabled:
+            self.com_calls += n
+
+    def to_dict(self) -> dict:
+        return {
+            'com_calls': self.com_calls,
+            'phases': {
+                phase: {
+                    'count': self.counts[phase],
+                    'sum': self.sums[phase],
+                    'buckets': dict(zip([str(b) for b in self.BUCKETS] + ['+Inf'], self.histograms[phase])),
+                }
+                for phase in self.histograms
+            },
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self, prefix: str = 'pyaspen') -> str:
+        """Prometheus 文本格式快照"""
+        lines = [f'# HELP {prefix}_phase_seconds Latency of PyASPENPlus phases.',
+                 f'# TYPE {prefix}_phase_seconds histogram']
+        for phase, hist in self.histograms.items():
+            cumulative = 0
+            for le, n in zip([repr(b) for b in self.BUCKETS] + ['+Inf'], hist):
+                cumulative += n
+                lines.append(f'{prefix}_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_phase_seconds_sum{{phase="{phase}"}} {self.sums[phase]}')
+            lines.append(f'{prefix}_phase_seconds_count{{phase="{phase}"}} {self.counts[phase]}')
+        lines.append(f'# HELP {prefix}_com_calls_total COM calls issued by PyASPENPlus.')
+        lines.append(f'# TYPE {prefix}_com_calls_total counter')
+        lines.append(f'{prefix}_com_calls_total {self.com_calls}')
+        return '\n'.join(lines) + '\n'
+
+
+def _timed(phase: str):
+    """按阶段记录方法耗时, 关闭计时时只多一次属性判断"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return func(self, *args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(phase, time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
 class PyASPENPlus(object):
     """使用Python运行ASPEN模拟"""
 
-    def __init__(self):
+    def __init__(self, backend: AspenBackend = None, instrument: bool = False):
+        """
+        :param backend: 模拟器后端, defaults to ComBackend()
+        :param instrument: 是否记录各阶段耗时和 COM 调用次数(见 self.metrics), defaults to False
+        """
+        self.metrics = Instrumentation(enabled=instrument)
+        self.backend = ComBackend() if backend is None else backend
         self.app = None
+        self._node_cache = {}  # 已解析的节点对象, 以调用地址为键
+        self.node_cache_hits = 0
+        self.node_cache_misses = 0
+        self._input_cache = {}  # 每个输入节点最近一次写入的值
+        self.input_writes = 0
+        self.skipped_writes = 0
+        self.result_cache = None  # ResultCache, 设置后 run_case 会先查找缓存
+        self._archive_hash = None
+        self.history = HistoryReader()
+        self.last_history_status = None
+        self.run_timeout = None  # run_simulation 的默认最长时长(s), None 表示不限
+        self.last_solve_time = None
+        self.solve_times = []  # 每次求解的耗时(s)
+        self.snapshot_interval = None  # 每收敛多少次保存一次快照, None 表示不自动保存
+        self.snapshot_path = None  # 最近一次保存的收敛快照
+        self._converged_runs = 0
+        self.recycler = None  # EngineRecycler, 设置后 run_case 运行前检查引擎状态
+        self.runs_at_restart = 0  # 上次重启时 solve_times 的长度
+        self.engine_pids = set()  # 本会话启动的 ASPEN 进程
+        self.start_lock = None  # 与同时运行的其他会话共用的启动锁, 见 _engine_start
 
     def init_app(self, ap_version: str = '10.0'):
         """开启ASPEN Plus
 
-        :param ap_version: ASPEN Plus版本号, defaults to '10.0'
+        :param ap_version: ASPEN Plus版本号, None 表示本机默认版本, defaults to '10.0'
         """
         version_match = {
             '11.0': '37.0',
@@ -33,97 +659,433 @@ class PyASPENPlus(object):
             '9.0': '35.0',
             '8.8': '34.0',
         }
-        self.app = win32.Dispatch(f'Apwn.Document.{version_match[ap_version]}')
+        self.invalidate()
+        self.ap_version = ap_version
+        # 不指定版本时使用本机默认注册的 ASPEN Plus
+        prog_id = 'Apwn.Document' if ap_version is None else f'Apwn.Document.{version_match[ap_version]}'
+        with self._engine_start():
+            pids_before = get_aspen_pids()
+            self.app = self.backend.dispatch(prog_id)
+            self.engine_pids = get_aspen_pids() - pids_before
+
+    def _engine_start(self):
+        """本会话的 ASPEN 进程由启动前后全部 ASPEN 进程之差识别, 启动期间持有 start_lock,
+        以免把同时启动(包括 restart)的其他会话的进程算作自己的而在 terminate_engine 时误杀"""
+        return contextlib.nullcontext() if self.start_lock is None else self.start_lock
+
+    def load_ap_file(self, file_name: str, file_dir: str = None, visible: bool = False, dialogs: bool = False,
+                     archive_path: str = None):
+        """载入待运行的ASPEN文件
 
-    def load_ap_file(self, file_name: str, file_dir: str = None, visible: bool = False, dialogs: bool = False):
-        """载入待运行的ASPEN文件"""
+        :param archive_path: 实际载入的文件, 用于从收敛快照重启, defaults to file_dir 下的 file_name
+        """
         # 文件类型检查.
         if (not file_name.endswith('.apw')) and (not file_name.endswith('.bkp')):
             raise ValueError('not an valid ASPEN file')
 
         self.file_dir = os.getcwd() if file_dir is None else file_dir  # ASPEN文件所处目录, 默认为当前目录
 
-        self.app.InitFromArchive2(os.path.join(self.file_dir, file_name))
+        self.invalidate()
+        self.history.reset()
+        self.file_name = file_name
+        self._archive_hash = None
+        if archive_path is None:
+            archive_path = os.path.join(self.file_dir, file_name)
+            self.snapshot_path = None  # 快照只对应此前载入的文件
+        with self._engine_start():
+            pids_before = get_aspen_pids()
+            if archive_path.endswith('.apw'):
+                self.app.InitFromFile2(archive_path)
+            else:
+                self.app.InitFromArchive2(archive_path)
+            self.engine_pids |= get_aspen_pids() - pids_before  # 计算引擎可能在载入文件时才启动
         self.app.Visible = 1 if visible else 0
         self.app.SuppressDialogs = 0 if dialogs else 1
+        self._load_options = (visible, dialogs)
+
+        logger.info('ASPEN file loaded', extra={'file': archive_path})
+
+    def _find_node(self, call_address1: str):
+        """按调用地址查找节点, 同一会话内复用已解析的节点对象"""
+        node = self._node_cache.get(call_address1)
+        if node is not None:
+            self.node_cache_hits += 1
+            return node
+
+        self.node_cache_misses += 1
+        self.metrics.count_com()
+        node = self.app.Tree.FindNode(call_address1)
+        if node is not None:  # 未找到的地址不缓存, 以免掩盖后续创建的节点
+            self._node_cache[call_address1] = node
+        return node
+
+    def clear_node_cache(self):
+        """清空节点缓存, 载入文件或重启ASPEN后原节点对象失效"""
+        self._node_cache.clear()
+
+    def node_cache_stats(self) -> dict:
+        """节点缓存命中统计"""
+        return {
+            'size': len(self._node_cache),
+            'hits': self.node_cache_hits,
+            'misses': self.node_cache_misses,
+        }
+
+    def _set_value(self, call_address1: str, value1) -> bool:
+        """写入节点值, 与该节点上次写入的值相同时跳过, 返回是否实际写入"""
+        if call_address1 in self._input_cache and self._input_cache[call_address1] == value1:
+            self.skipped_writes += 1
+            return False
 
-        print(f'The ASPEN file "{file_name}" has been reloaded')
+        self._find_node(call_address1).Value = value1
+        self.metrics.count_com()
+        self._input_cache[call_address1] = value1
+        self.input_writes += 1
+        return True
 
+    def invalidate(self):
+        """清空节点缓存和输入缓存, 重启ASPEN或在外部修改输入后调用"""
+        self.clear_node_cache()
+        self._input_cache.clear()
+
+    def input_cache_stats(self) -> dict:
+        """输入缓存统计"""
+        return {
+            'size': len(self._input_cache),
+            'writes': self.input_writes,
+            'skipped': self.skipped_writes,
+        }
+
+    @_timed('input')
     def assign_node_values(self, nodes: list, values: list, call_address: dict):
+        debug = logger.isEnabledFor(logging.DEBUG)
         for i, node in enumerate(nodes):
             if isinstance(values[i], (float, int)):  # 检查值是否是 float 或者 int 类型
                 if -1e8 <= values[i] <= 1e8:  # 检查值是否在 -1e8 到 1e8 的范围内
                     try:
-                        self.app.Tree.FindNode(call_address[node]).Value = values[i]
-                        print(f"Successful input: {node}: {values[i]} ")
+                        if self._set_value(call_address[node], values[i]) and debug:
+                            logger.debug('input assigned', extra={'node': node, 'value': values[i]})
                     except Exception as e:
-                        print(f"Error setting value for node '{node}' and Value '{values[i]}': {e}")
+                        logger.error('input assignment failed', extra={'node': node, 'value': values[i], 'error': str(e)})
                 else:
-                    print(f"Value {values[i]} for node '{node}' is out of range (-1e8 to +1e8). Skipping assignment.")
+                    logger.warning('input out of range (-1e8 to +1e8), skipped', extra={'node': node, 'value': values[i]})
             else:
-                print(f"Value {values[i]} for node '{node}' is not a numeric type (float or int). Skipping assignment.")
+                logger.warning('input is not numeric, skipped', extra={'node': node, 'value': values[i]})
 
+    @_timed('input')
     def assign_node_value1(self, value1: float, call_address1: str):
-        self.app.Tree.FindNode(call_address1).Value = value1
+        self._set_value(call_address1, value1)
 
-    def run_simulation(self, reinit: bool = True, sleep: float = 2.0):
-        """进行模拟
+    def run_simulation(self, reinit: bool = True, sleep: float = 2.0, timeout: float = None,
+                       min_sleep: float = 0.001, backoff: float = 1.5) -> float:
+        """进行模拟, 引擎结束后立即返回
+
+        检测间隔从 min_sleep 开始按 backoff 倍数增长, 最长不超过 sleep.
 
         :param reinit: 是否重新初始化迭代参数设置, defaults to True
-        :param sleep: 每次检测运行状态的间隔时长, defaults to 2.0
+        :param sleep: 检测运行状态的最长间隔, defaults to 2.0
+        :param timeout: 最长运行时长(s), 超时则停止引擎并抛出 SimulationTimeoutError, defaults to self.run_timeout
+        :param min_sleep: 首次检测运行状态的间隔, defaults to 0.001
+        :param backoff: 检测间隔的增长倍数, defaults to 1.5
+        :return: 本次求解耗时(s)
         """
+        timeout = self.run_timeout if timeout is None else timeout
         if reinit:
-            self.app.Reinit()
+            with self.metrics.phase('reinit'):
+                self.app.Reinit()
+                self.metrics.count_com()
 
-        self.app.Engine.Run2()
+        t0 = time.perf_counter()
+        self.app.Engine.Run2(True)  # 异步运行, 由下方的检测循环等待结束
+        self.metrics.count_com()
+        interval = min_sleep
         while self.app.Engine.IsRunning == 1:
-            time.sleep(sleep)
+            self.metrics.count_com()
+            elapsed = time.perf_counter() - t0
+            if timeout is not None and elapsed >= timeout:
+                self.last_solve_time = elapsed
+                self.metrics.observe('solve', elapsed)
+                try:
+                    self.app.Engine.Stop()
+                except Exception as e:
+                    logger.error('failed to stop the engine after timeout', extra={'error': str(e)})
+                logger.error('simulation timed out', extra={'elapsed': elapsed, 'timeout': timeout})
+                raise SimulationTimeoutError(f'simulation still running after {elapsed:.1f} s (timeout {timeout} s)')
+
+            wait = min(interval, sleep)
+            if timeout is not None:
+                wait = min(wait, timeout - elapsed)
+            time.sleep(wait)
+            interval *= backoff
+
+        self.last_solve_time = time.perf_counter() - t0
+        self.solve_times.append(self.last_solve_time)
+        self.metrics.count_com()  # 最后一次 IsRunning
+        self.metrics.observe('solve', self.last_solve_time)
+        return self.last_solve_time
 
+    @_timed('output')
     def get_target_values(self, target_nodes: list, call_address) -> list:
         """从模拟结果中获得目标值"""
         values = []
         for node in target_nodes:
-            values.append(self.app.Tree.FindNode(call_address[node]).Value)
+            values.append(self._find_node(call_address[node]).Value)
+        self.metrics.count_com(len(target_nodes))
         return values
 
+    @_timed('output')
     def get_target_value1(self, call_address1: str):
         """从模拟结果中获得目标值"""
-        return self.app.Tree.FindNode(call_address1).Value
+        value1 = self._find_node(call_address1).Value
+        self.metrics.count_com()
+        if call_address1 in self._input_cache:  # 读取输入节点时同步输入缓存
+            self._input_cache[call_address1] = value1
+        return value1
 
-    def check_simulation_status(self) -> list:
-        """检查模拟是否收敛等"""
-        value = self.app.Tree.FindNode(r'\Data\Results Summary\Run-Status\Output\RUNID').Value
+    @_timed('output')
+    def get_profile(self, call_address1: str) -> tuple:
+        r"""一次遍历读取数组型节点(如塔板温度分布)的全部元素
+
+        :param call_address1: Elements集合所在的调用地址, 如 r'\Data\Blocks\ABSORBER\Output\TLIQ'
+        :return: (元素标签列表, float64数组), 无法转换为数值的元素记为nan
+        """
+        return self._read_profile(call_address1)
+
+    def _read_profile(self, call_address1: str) -> tuple:
+        """get_profile 的实现, 不单独计时, 以免在 read_manifest 中重复计入 output 阶段"""
+        node = self._find_node(call_address1)
+        if node is None:
+            raise KeyError(f'node "{call_address1}" not found')
+
+        labels, values = [], []
+        for e in node.Elements:
+            labels.append(e.Name)
+            value = e.Value
+            try:
+                values.append(float(value))
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        self.metrics.count_com(1 + 2 * len(labels))
+        return labels, np.array(values, dtype=np.float64)
+
+    @_timed('output')
+    def read_manifest(self, manifest: OutputManifest, out: np.ndarray = None) -> np.ndarray:
+        """按输出清单一次读取全部输出, 每个节点只读取一次
+
+        :param manifest: 输出清单
+        :param out: 写入的行, defaults to 新建一行
+        :return: 与 manifest.names 对应的 float64 行, 已乘以 sign
+        """
+        t0 = time.perf_counter()
+        raw = manifest._raw
+        for i, call_address1 in enumerate(manifest.paths):
+            value1 = self._find_node(call_address1).Value
+            if call_address1 in self._input_cache:  # 读取输入节点时同步输入缓存
+                self._input_cache[call_address1] = value1
+            raw[i] = _as_float(value1)
+        self.metrics.count_com(len(manifest.paths))
+        profiles = manifest._profile_values
+        for i, call_address1 in enumerate(manifest.profiles):
+            profiles[i] = self._read_profile(call_address1)[1]
+        row = manifest.fill(raw, profiles, out)
+        manifest.record_read(time.perf_counter() - t0)
+        return row
+
+    def get_profiles(self, profile_nodes: list, call_address: dict) -> dict:
+        """批量读取多个数组型节点, 返回 {节点名: (元素标签列表, float64数组)}"""
+        return {node: self.get_profile(call_address[node]) for node in profile_nodes}
+
+    @_timed('status')
+    def read_history_status(self) -> HistoryStatus:
+        """读取上次检查之后 .his 历史文件中新增的错误和警告"""
+        value = self._find_node(r'\Data\Results Summary\Run-Status\Output\RUNID').Value
         file_path = os.path.join(self.file_dir, f'{value}.his')
+        self.last_history_status = self.history.read(file_path)
+        return self.last_history_status
 
-        with open(file_path, 'r') as f:
-            isError = np.any(np.array([line.find('SEVERE ERROR') for line in f.readlines()]) >= 0)
-        return [not isError]
+    def check_simulation_status(self) -> list:
+        """检查模拟是否收敛等"""
+        return [self.read_history_status().ok]
 
     def quit_app(self):
+        self.clear_node_cache()
         self.app.Quit()
 
     def close_app(self):
+        self.clear_node_cache()
         self.app.Close()
 
-    def result_error(self):
-        errall = ''
-        errormessage = []
-        node = self.app.Tree.FindNode(r"\Data\Results Summary\Run-Status\Output\PER_ERROR")
+    def terminate_engine(self, timeout: float = 10.0):
+        """只结束本会话启动的 ASPEN 进程, 不影响其他用户或其他工作进程的引擎"""
+        procs = []
+        for pid in self.engine_pids:
+            try:
+                proc = psutil.Process(pid)
+                proc.terminate()
+                procs.append(proc)
+            except psutil.NoSuchProcess:
+                continue
+        _, alive = psutil.wait_procs(procs, timeout=timeout)
+        for proc in alive:
+            proc.kill()
+        self.engine_pids = set()
+        self.app = None
+
+    def save_snapshot(self, snapshot_path: str = None) -> str:
+        """将当前(已收敛的)模拟保存为快照, 重启时从快照载入而不是从原始文件冷启动
+
+        :param snapshot_path: 快照文件路径(.bkp 或 .apw), defaults to file_dir 下的 <文件名>_snapshot.bkp
+        :return: 快照文件路径
+        """
+        if snapshot_path is None:
+            stem = os.path.splitext(self.file_name)[0]
+            snapshot_path = os.path.join(self.file_dir, f'{stem}_snapshot.bkp')
+        root, ext = os.path.splitext(snapshot_path)
+        tmp_path = f'{root}_tmp{ext}'  # 先写临时文件, 保存中途出错时不破坏已有快照
+        self.app.SaveAs(tmp_path, True)
+        self.metrics.count_com()
+        os.replace(tmp_path, snapshot_path)
+        self.snapshot_path = snapshot_path
+        return snapshot_path
+
+    def checkpoint(self, status: str):
+        """记录一次运行结果, 按 snapshot_interval 保存收敛快照
+
+        :param status: run_status 或 result_error 的返回值, 只有结果可用的运行计入
+        """
+        if status not in USABLE_STATUSES or not self.snapshot_interval:
+            return
+        self._converged_runs += 1
+        if self._converged_runs % self.snapshot_interval == 0:
+            try:
+                self.save_snapshot(self.snapshot_path)
+            except Exception as e:
+                logger.error('failed to save snapshot', extra={'error': str(e)})
+
+    @_timed('restart')
+    def restart(self, reason: str = ''):
+        """重启本会话的ASPEN, 载入最近的收敛快照(没有时载入原始文件)并恢复此前写入的全部输入值"""
+        logger.warning('restarting ASPEN', extra={'reason': reason})
+        saved_inputs = dict(self._input_cache)
+        try:
+            self.close_app()
+        except Exception as e:
+            logger.error('failed to close ASPEN before restart', extra={'error': str(e)})
+        self.terminate_engine()
+
+        self.init_app(self.ap_version)
+        snapshot_path = self.snapshot_path if self.snapshot_path and os.path.exists(self.snapshot_path) else None
+        self.load_ap_file(self.file_name, self.file_dir, *self._load_options, archive_path=snapshot_path)
+        self.snapshot_path = snapshot_path
+        for call_address1, value1 in saved_inputs.items():
+            self._set_value(call_address1, value1)
+        self.runs_at_restart = len(self.solve_times)
+        if self.recycler is not None:
+            self.recycler.recycles += 1
+
+    def recycle_if_needed(self) -> bool:
+        """按 self.recycler 的策略检查引擎状态, 必要时重启, 返回是否重启"""
+        if self.recycler is None or self.app is None:
+            return False
+        reason = self.recycler.check(self)
+        if reason is None:
+            return False
+        self.restart(reason)
+        return True
+
+    @_timed('status')
+    def run_status(self) -> RunOutcome:
+        """一次遍历 PER_ERROR 判断上次运行的结果分类, 超时的运行由 run_case 记为 TIMEOUT"""
+        node = self._find_node(r"\Data\Results Summary\Run-Status\Output\PER_ERROR")
         if node is None:
-            return 'error'
-        else:
-            for e in node.Elements:
-                # print(e.Value)
-                errormessage += e.value
-                if '=' in errormessage:
-                    break
-            errall = errall.join(errormessage)
+            return RunOutcome.ERROR
+        messages = []
+        for e in node.Elements:
+            self.metrics.count_com()
+            message = str(e.Value)
+            messages.append(message)
+            if '=' in message:
+                break
+        return RunOutcome.classify('\n'.join(messages))
 
-            if 'error' in errall:
-                errall = 'error'
-            else:
-                errall = 'OK'
-            return errall
+    def result_error(self):
+        """上次运行是否出错, 返回 'error' 或 'OK'(含只有警告的运行)"""
+        return 'OK' if self.run_status().usable else 'error'
+
+    def run_case(self, inputs: dict, outputs: list, reinit: bool = True, refresh: bool = False,
+                 case_id=None, profiles: list = None) -> dict:
+        """赋值、模拟并读取结果, 作为批量计算的基本单元
+
+        :param inputs: {调用地址: 值}, 值可以是字符串(如设计规定的表达式)
+        :param outputs: 待读取的调用地址列表, 或 OutputManifest(此时返回的 outputs 为 {输出名: 值})
+        :param reinit: 是否重新初始化迭代参数设置, defaults to True
+        :param refresh: 忽略已缓存的结果, 重新计算并更新缓存, defaults to False
+        :param case_id: 工况编号, 记录在本次运行产生的日志中, defaults to None
+        :param profiles: 整体读取的数组型节点地址(见 get_profile), 其元素值以列表形式放在 outputs 中, defaults to None
+        :return: {'outputs': {调用地址: 值}, 'status': RunOutcome, 'solve_time': 求解耗时(s)},
+            结果不可用(出错或超时)时不读取输出, outputs 为空(使用 OutputManifest 时全为 NaN);
+            命中 result_cache 时不运行模拟, 并附带 'cached': True
+        """
+        with case_context(case_id):
+            t0 = time.perf_counter()
+            result = self._run_case(inputs, outputs, reinit, refresh, profiles or [])
+            logger.info('case finished', extra={'status': result['status'], 'solve_time': result['solve_time'],
+                                                'elapsed': time.perf_counter() - t0,
+                                                'cached': result.get('cached', False)})
+        return result
+
+    def _run_case(self, inputs: dict, outputs, reinit: bool, refresh: bool, profiles: list) -> dict:
+        self.recycle_if_needed()
+
+        manifest = None
+        if isinstance(outputs, OutputManifest):
+            manifest = outputs
+            outputs, profiles = manifest.paths, manifest.profiles
+
+        key = None
+        if self.result_cache is not None:
+            if self._archive_hash is None:
+                self._archive_hash = ResultCache.file_hash(os.path.join(self.file_dir, self.file_name))
+            key = self.result_cache.make_key(self._archive_hash, inputs)
+            result = None if refresh else self.result_cache.get(key, list(outputs) + list(profiles))
+            if result is not None:
+                if manifest is not None:
+                    result['outputs'] = dict(zip(manifest.names, manifest.assemble(result['outputs']).tolist()))
+                return result
+
+        for call_address1, value1 in inputs.items():
+            self.assign_node_value1(value1, call_address1)
+        try:
+            solve_time = self.run_simulation(reinit=reinit)
+        except SimulationTimeoutError:
+            # 超时可能是偶发的, 不写入缓存
+            values = {} if manifest is None else dict.fromkeys(manifest.names, np.nan)
+            return {'outputs': values, 'status': RunOutcome.TIMEOUT, 'solve_time': self.last_solve_time}
+
+        status = self.run_status()
+        values, row = {}, None
+        if not status.usable:
+            pass  # 出错的运行不读取输出
+        elif manifest is None:
+            values = {call_address1: self.get_target_value1(call_address1) for call_address1 in outputs}
+            for call_address1 in profiles:
+                values[call_address1] = self.get_profile(call_address1)[1].tolist()
+        else:
+            row = self.read_manifest(manifest)
+            values = dict(zip(manifest.paths, manifest._raw.tolist()))
+            values.update(zip(manifest.profiles, (values1.tolist() for values1 in manifest._profile_values)))
+        result = {
+            'outputs': values,
+            'status': status,
+            'solve_time': solve_time,
+        }
+        self.checkpoint(status)
+        if key is not None:
+            self.result_cache.put(key, result)
+        if manifest is not None:
+            row = manifest.new_row() if row is None else row
+            result['outputs'] = dict(zip(manifest.names, row.tolist()))
+        return result
 
 
 # sample use
@@ -157,12 +1119,7 @@ if __name__ == '__main__':
 
     # ---- ASPEN 模拟 ------------------------------------------------------------------------------
 
-    def random_x_values():
-        x_values = []
-        for i, x_col in enumerate(x_cols):
-            x_values.append(np.random.uniform(*x_range[x_col]))
-        return x_values
-
+    from aspen_sampling import latin_hypercube, scale_samples
 
     # 指定ASPEN文件名和所处目录.
     file_name = 'cstr.bkp'
@@ -176,11 +1133,12 @@ if __name__ == '__main__':
 
     x_records, y_records, status_records = [], [], []
     repeats = 10
+    # 拉丁超立方抽样: 各参数的取值范围被等分为 repeats 段, 每段恰好模拟一次.
+    x_samples = scale_samples(latin_hypercube(repeats, len(x_cols), seed=0), [x_range[x_col] for x_col in x_cols])
     for i in range(repeats):
         print(f'simulating {i}')
 
-        # 随机给定一个参数值.
-        x_values = random_x_values()
+        x_values = x_samples[i].tolist()
 
         pyaspen.assign_node_values(x_cols, x_values, call_address)
         pyaspen.run_simulation(reinit=False)
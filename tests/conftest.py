@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import py_aspen
+from fake_aspen import FakeAspenBackend
+
+import flowsheet
+
+ASPEN_FILE = 'demo.bkp'
+
+
+@pytest.fixture
+def file_dir(tmp_path):
+    """存放 demo.bkp 的目录, 文件内容对假后端无意义"""
+    (tmp_path / ASPEN_FILE).write_text('demo')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def make_session(file_dir):
+    """按给定的 FakeAspenBackend 参数开启已载入 demo.bkp 的会话"""
+    sessions = []
+
+    def make(**backend_options):
+        session = py_aspen.PyASPENPlus(backend=FakeAspenBackend(flowsheet.model, flowsheet.TREE, **backend_options))
+        session.init_app(None)
+        session.load_ap_file(ASPEN_FILE, file_dir)
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        if session.result_cache is not None:
+            session.result_cache.close()
+
+
+@pytest.fixture
+def session(make_session):
+    return make_session()
@@ -0,0 +1,30 @@
+"""测试用的流程模型, 放在模块中以便 spawn 的工作进程导入"""
+import os
+
+from fake_aspen import FakeAspenBackend, FakeSimulationError
+
+TEMP = r'\Data\Blocks\R1\Input\TEMP'
+PRES = r'\Data\Blocks\R1\Input\PRES'
+FLOW = r'\Data\Streams\PROD\Output\MOLEFLOW'
+ITER = r'\Data\Convergence\Results\ITER'
+TLIQ = r'\Data\Blocks\R1\Output\TLIQ'
+TREE = {TEMP: 0.0, PRES: 0.0, FLOW: 0.0, ITER: 0}
+
+
+def model(tree: dict) -> dict:
+    """TEMP > 5 时出错, TEMP >= 100 时为 severe error, TEMP < 0 时模拟引擎崩溃(所在进程退出)"""
+    temp, pres = float(tree[TEMP]), float(tree[PRES])
+    if temp < 0:
+        os._exit(3)
+    if temp >= 100:
+        raise FakeSimulationError('block R1 has a severe error', severe=True)
+    if temp > 5:
+        raise FakeSimulationError('block R1 did not converge')
+    return {FLOW: 10 * temp + pres, ITER: 3, TLIQ + '\\1': temp, TLIQ + '\\2': temp + 1}
+
+
+class CrashingBackend(FakeAspenBackend):
+    """开启文档时进程即退出的后端"""
+
+    def dispatch(self, prog_id: str):
+        os._exit(5)
@@ -0,0 +1,56 @@
+import ast
+import os
+
+import numpy as np
+import pytest
+
+# aspen_calc_best 是脚本, 导入时即连接 ASPEN(需要 win32com), 这里只取出 find_root 的定义
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'aspen_calc_best.py')
+with open(_PATH, encoding='utf-8') as _file:
+    _tree = ast.parse(_file.read())
+_namespace = {'np': np}
+exec(compile(ast.Module([node for node in _tree.body if isinstance(node, ast.FunctionDef) and node.name == 'find_root'],
+                        type_ignores=[]), _PATH, 'exec'), _namespace)
+find_root = _namespace['find_root']
+
+
+def cube(x):
+    return x ** 3 - 2
+
+
+@pytest.mark.parametrize('method', ['brent', 'illinois'])
+def test_find_root(method):
+    x, fx, evals, last = find_root(cube, 0, 2, 1e-6, xtol=1e-9, method=method, max_evals=50)
+    assert x == pytest.approx(2 ** (1 / 3), abs=1e-6)
+    assert abs(fx) <= 1e-6 and fx == cube(x)
+    assert evals < 50 and last is not None
+
+    # 靠近解的初值可减少计算次数
+    _, _, warm_evals, _ = find_root(cube, 0, 2, 1e-6, xtol=1e-9, method=method, max_evals=50, x0=1.26)
+    assert warm_evals < evals
+
+
+def test_find_root_not_bracketed():
+    x, fx, evals, _ = find_root(cube, 2, 3, 1e-6)
+    assert (x, fx, evals) == (None, None, 2)
+
+
+def test_find_root_failures():
+    evaluated = []
+
+    def failing(x):
+        evaluated.append(x)
+        return None if x > 1.8 else cube(x)
+
+    # b 端失败后向 a 收缩 1/4, 1.5 处恰好可算, 区间仍包含根
+    x, _, _, _ = find_root(failing, 0, 2, 1e-6, max_evals=50)
+    assert x == pytest.approx(2 ** (1 / 3), abs=1e-6)
+    assert evaluated[:3] == [0, 2, 1.5]
+
+    x, fx, evals, last = find_root(lambda x: None, 0, 2, 1e-6, max_failures=2)
+    assert (x, fx, evals, last) == (None, None, 3, 0.875)
+
+
+def test_find_root_unknown_method():
+    with pytest.raises(ValueError):
+        find_root(cube, 0, 2, 1e-6, method='newton')
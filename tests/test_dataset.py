@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aspen_dataset
+
+
+def _results() -> pd.DataFrame:
+    return pd.DataFrame({'fewt': [0.25, 0.25, 0.5], 'mf_H2PROD': [2.0, 0.0, np.nan], 'duty': [4.0, 3.0, 1.0],
+                         'status': ['OK', 'OK', 'error']}, index=pd.Index([1, 2, 3], name='case'))
+
+
+def test_dataset_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.dataset as ds
+    source = str(tmp_path / 'dataset')
+    aspen_dataset.write_dataset(_results(), source, metadata={'VarRange': [0.25, 0.5]}, partition_by=['fewt'])
+
+    frame = aspen_dataset.read_dataset(source)
+    pd.testing.assert_frame_equal(frame, _results())
+    assert frame.attrs['sweep'] == {'VarRange': [0.25, 0.5]}
+
+    part = aspen_dataset.read_dataset(source, columns=['duty'], filter=ds.field('fewt') == 0.25)
+    assert list(part.columns) == ['duty'] and list(part.index) == [1, 2]
+
+
+def test_export_excel(tmp_path):
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('xlsxwriter')
+    openpyxl = pytest.importorskip('openpyxl')
+    source = str(tmp_path / 'dataset')
+    aspen_dataset.write_dataset(_results(), source, metadata={'VarRange': [0.25, 0.5], 'note': 'demo'})
+
+    def summary(part):
+        return pd.DataFrame({'duty_per_H2': part['duty'] / part['mf_H2PROD']})
+
+    path = str(tmp_path / 'results.xlsx')
+    aspen_dataset.export_excel(source, path, {'Data': ['mf_H2PROD', 'status'], 'Summary': summary}, batch_size=2)
+
+    book = openpyxl.load_workbook(path)
+    assert book.sheetnames == ['Info', 'Data', 'Summary']
+    rows = {name: [list(row) for row in book[name].iter_rows(values_only=True)] for name in book.sheetnames}
+    assert rows['Info'] == [[None, 'VarRange'], [1, 0.25], [2, 0.5]]
+    assert rows['Data'] == [['case', 'mf_H2PROD', 'status'], [1, 2, 'OK'], [2, 0, 'OK'], [3, None, 'error']]
+    # xlsxwriter 把 inf 写成 =1/0 公式 (显示 #DIV/0!), NaN 为空单元格
+    assert rows['Summary'] == [['case', 'duty_per_H2'], [1, 2], [2, '=1/0'], [3, None]]
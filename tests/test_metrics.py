@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aspen_metrics
+import aspen_sweep
+
+
+def test_evaluate():
+    results = pd.DataFrame({'rb_FE3O4': [0.1, 0.2, np.nan], 'mf_H2PROD': [2.0, 4.0, 0.0], 'q-in': [10., 20., 5.]},
+                           index=pd.Index([3, 4, 5], name='case'))
+    table = aspen_metrics.MetricTable([
+        {'name': 'conversion', 'expr': '1 - `rb_FE3O4` * 4'},
+        {'name': 'duty', 'expr': '`q-in`', 'unit': 'kW', 'scalable': True},
+        {'name': 'specific_duty', 'expr': 'duty / `mf_H2PROD`', 'unit': 'kJ/kg'},
+        {'name': 'constant', 'expr': 0.5},
+    ], basis='`mf_H2PROD`', basis_value=8.0)
+    assert table.columns == ['rb_FE3O4', 'q-in', 'mf_H2PROD']
+
+    metrics = table.evaluate(results)
+    assert list(metrics.columns) == ['conversion', 'duty(kW)', 'specific_duty(kJ/kg)', 'constant']
+    assert list(metrics.index) == [3, 4, 5]
+    np.testing.assert_allclose(metrics['conversion'], [0.6, 0.2, np.nan])
+    np.testing.assert_allclose(metrics['duty(kW)'], [40.0, 40.0, np.inf])  # 按产量折算到 8.0
+    np.testing.assert_allclose(metrics['specific_duty(kJ/kg)'], [5.0, 5.0, np.inf])  # 引用未折算的 duty
+    np.testing.assert_array_equal(metrics['constant'], [0.5, 0.5, 0.5])
+
+
+def test_evaluate_result_store():
+    store = aspen_sweep.ResultStore(2, ['a', 'b'])
+    store.record(0, [1.0, 2.0], 'OK')
+    store.record(1, [3.0, None], 'error')
+    metrics = aspen_metrics.MetricTable([{'name': 'total', 'expr': '`a` + `b`'}]).evaluate(store)
+    np.testing.assert_array_equal(metrics['total'], [3.0, np.nan])
+
+
+def test_errors():
+    with pytest.raises(ValueError, match='duplicated'):
+        aspen_metrics.MetricTable([{'name': 'x', 'expr': '1'}, {'name': 'x', 'expr': '2'}])
+    table = aspen_metrics.MetricTable([{'name': 'x', 'expr': '`missing` * 2'}])
+    with pytest.raises(KeyError, match='missing'):
+        table.evaluate(pd.DataFrame({'a': [1.0]}))
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import py_aspen
+import aspen_pool
+from fake_aspen import FakeAspenBackend
+
+import flowsheet
+from conftest import ASPEN_FILE
+from flowsheet import TEMP, PRES, FLOW
+
+
+def test_map_cases(file_dir):
+    backend = FakeAspenBackend(flowsheet.model, flowsheet.TREE)
+    cases = [{TEMP: temp, PRES: 1} for temp in (1, 2, 9, 3, 4)]
+    finished = []
+    with aspen_pool.AspenWorkerPool(ASPEN_FILE, file_dir, n_workers=2, backend=backend, poll=0.1) as pool:
+        results = pool.map_cases(cases, [FLOW], callback=lambda index, result: finished.append(index))
+
+    assert sorted(finished) == list(range(len(cases)))
+    assert [result['status'] for result in results] == [py_aspen.RunOutcome.OK] * 2 + [py_aspen.RunOutcome.ERROR] \
+        + [py_aspen.RunOutcome.OK] * 2
+    assert [result['outputs'].get(FLOW) for result in results] == [11, 21, None, 31, 41]
+    assert {result['worker'] for result in results} <= {0, 1}
+
+
+def test_worker_killed_mid_case(file_dir):
+    backend = FakeAspenBackend(flowsheet.model, flowsheet.TREE)
+    cases = [{TEMP: temp, PRES: 1} for temp in (1, -1, 2, 3, -1, 4)]
+    with aspen_pool.AspenWorkerPool(ASPEN_FILE, file_dir, n_workers=2, backend=backend, poll=0.1) as pool:
+        results = pool.map_cases(cases, [FLOW])
+        assert all(process.is_alive() for process in pool._workers.values())
+        again = pool.map_cases(cases[:1], [FLOW])
+
+    assert [result['outputs'].get(FLOW) for result in results] == [11, None, 21, 31, None, 41]
+    for result in (results[1], results[4]):
+        assert result['status'] is py_aspen.RunOutcome.ERROR
+        assert result['exception'] == 'worker exited with code 3'
+    assert again[0]['outputs'] == {FLOW: 11}
+
+
+def test_respawns_are_capped(file_dir):
+    backend = flowsheet.CrashingBackend(flowsheet.model, flowsheet.TREE)
+    with aspen_pool.AspenWorkerPool(ASPEN_FILE, file_dir, n_workers=1, backend=backend, poll=0.1,
+                                    max_respawns=2) as pool:
+        with pytest.raises(RuntimeError, match='exited 3 times in a row, last exit code 5'):
+            pool.map_cases([{TEMP: 1, PRES: 1}], [FLOW])
+
+
+def test_async_pool(file_dir):
+    backend = FakeAspenBackend(flowsheet.model, flowsheet.TREE, solve_delay=0.2)
+    cases = [{TEMP: temp, PRES: 1} for temp in (1, 2, 9, 3)]
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async with aspen_pool.AsyncAspenPool(ASPEN_FILE, file_dir, n_sessions=2, backend=backend) as pool:
+            pids = {await session.start() for session in pool.sessions}
+            task = asyncio.create_task(ticker())
+            results = await pool.map_cases(cases, [FLOW])
+            task.cancel()
+        return pids, results, ticks
+
+    pids, results, ticks = asyncio.run(main())
+    assert len(pids) == 2
+    assert [result['outputs'].get(FLOW) for result in results] == [11, 21, None, 31]
+    assert results[2]['status'] is py_aspen.RunOutcome.ERROR
+    assert ticks >= 20  # 等待模拟时事件循环未被阻塞
@@ -0,0 +1,321 @@
+import os
+import json
+import math
+import logging
+import threading
+
+import numpy as np
+import pytest
+
+import py_aspen
+
+from flowsheet import TEMP, PRES, FLOW, TLIQ
+
+
+class CountingLock(object):
+    """记录进入次数的锁"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entered = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.entered += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        py_aspen.AspenBackend()
+
+
+@pytest.mark.parametrize('messages, expected', [
+    ('', py_aspen.RunOutcome.OK),
+    ('Results available with warnings', py_aspen.RunOutcome.WARNINGS),
+    ('block R1: error: did not converge', py_aspen.RunOutcome.ERROR),
+    ('block R1: severe error', py_aspen.RunOutcome.SEVERE),
+    # 与原先的 result_error 一样区分大小写
+    ('SEVERE ERROR in block R1\nerror', py_aspen.RunOutcome.ERROR),
+    ('ERROR in block R1', py_aspen.RunOutcome.OK),
+    ('Warning: block R1 error', py_aspen.RunOutcome.ERROR),
+])
+def test_classify(messages, expected):
+    assert py_aspen.RunOutcome.classify(messages) is expected
+
+
+def test_run_case_ok(session):
+    result = session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    assert result['status'] is py_aspen.RunOutcome.OK
+    assert result['outputs'] == {FLOW: 21}
+    assert result['solve_time'] is not None
+    assert 'cached' not in result
+
+
+@pytest.mark.parametrize('temp, expected', [(9, py_aspen.RunOutcome.ERROR), (100, py_aspen.RunOutcome.SEVERE)])
+def test_run_case_failure_reads_nothing(session, temp, expected):
+    result = session.run_case({TEMP: temp, PRES: 1}, [FLOW])
+    assert result['status'] is expected
+    assert result['outputs'] == {}
+    assert session.result_error() == 'error'
+
+
+def test_run_case_failure_with_manifest_is_nan(session):
+    manifest = py_aspen.OutputManifest([{'name': 'flow', 'path': FLOW}])
+    result = session.run_case({TEMP: 9, PRES: 1}, manifest)
+    assert result['status'] is py_aspen.RunOutcome.ERROR
+    assert math.isnan(result['outputs']['flow'])
+
+
+def test_run_case_cache(session, tmp_path):
+    session.result_cache = py_aspen.ResultCache(str(tmp_path / 'cache.db'))
+    first = session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    session.run_case({TEMP: 3, PRES: 1}, [FLOW])
+    runs = session.app.run_count
+
+    again = session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    assert again['cached'] is True
+    assert again['outputs'] == first['outputs']
+    assert session.app.run_count == runs
+    assert session.result_cache.hits == 1
+
+    refreshed = session.run_case({TEMP: 2, PRES: 1}, [FLOW], refresh=True)
+    assert 'cached' not in refreshed
+    assert session.app.run_count == runs + 1
+
+
+def test_run_case_caches_failures(session, tmp_path):
+    session.result_cache = py_aspen.ResultCache(str(tmp_path / 'cache.db'))
+    session.run_case({TEMP: 9, PRES: 1}, [FLOW])
+    result = session.run_case({TEMP: 9, PRES: 1}, [FLOW])
+    assert result['cached'] is True
+    assert result['status'] is py_aspen.RunOutcome.ERROR
+    assert session.app.run_count == 1
+
+
+def test_run_case_timeout_is_not_cached(make_session, tmp_path):
+    session = make_session(solve_delay=float('inf'))
+    session.result_cache = py_aspen.ResultCache(str(tmp_path / 'cache.db'))
+    session.run_timeout = 0.05
+    for _ in range(2):
+        result = session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+        assert result['status'] is py_aspen.RunOutcome.TIMEOUT
+        assert result['outputs'] == {}
+        assert 'cached' not in result
+    assert session.result_cache.hits == 0
+    assert session.result_cache.stats()['size'] == 0
+
+
+def test_restart_loads_snapshot_and_restores_inputs(session):
+    session.snapshot_interval = 2
+    session.run_case({TEMP: 1, PRES: 1}, [FLOW])
+    assert session.snapshot_path is None
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    snapshot = session.snapshot_path
+    assert snapshot is not None and os.path.exists(snapshot)
+
+    session.run_case({TEMP: 9, PRES: 4}, [FLOW])  # 出错的运行不保存快照
+    old_app = session.app
+    lock = CountingLock()
+    session.start_lock = lock
+    session.restart('test')
+
+    assert session.app is not old_app
+    assert session.app.archive_path == snapshot
+    assert session.snapshot_path == snapshot
+    assert session.get_target_value1(FLOW) == 21  # 来自快照中收敛的结果
+    assert session.get_target_value1(TEMP) == 9  # 重启前写入的输入
+    assert session.get_target_value1(PRES) == 4
+    assert lock.entered == 2  # init_app 和 load_ap_file 都在锁内识别引擎进程
+
+    result = session.run_case({TEMP: 3, PRES: 4}, [FLOW])
+    assert result['outputs'] == {FLOW: 34}
+
+
+def test_restart_without_snapshot_loads_original_file(session, file_dir):
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    session.restart('test')
+    assert session.app.archive_path == os.path.join(file_dir, 'demo.bkp')
+    assert session.snapshot_path is None
+    assert session.get_target_value1(TEMP) == 2
+
+
+def test_manifest_read_is_one_output_observation(session):
+    manifest = py_aspen.OutputManifest([{'name': 'flow', 'path': FLOW},
+                                        {'name': 'tliq_2', 'path': TLIQ, 'element': 1}])
+    session.metrics = py_aspen.Instrumentation()
+    result = session.run_case({TEMP: 2, PRES: 1}, manifest)
+    assert result['outputs'] == {'flow': 21, 'tliq_2': 3}
+    assert session.metrics.counts['output'] == 1
+    assert manifest.read_stats()['reads'] == 1
+
+    session.get_profile(TLIQ)
+    assert session.metrics.counts['output'] == 2
+
+
+def test_configure_logging_replaces_its_handler(tmp_path):
+    first, second = tmp_path / 'first.jsonl', tmp_path / 'second.jsonl'
+    py_aspen.configure_logging(str(first))
+    handler = py_aspen.configure_logging(str(second))
+    target = handler.target
+    try:
+        with py_aspen.case_context(7):
+            py_aspen.logger.info('case finished', extra={'solve_time': 1.5})
+        handler.flush()
+        assert py_aspen.logger.handlers == [handler]
+    finally:
+        py_aspen.logger.removeHandler(handler)
+        handler.close()
+        target.close()
+        py_aspen._log_handler = None
+        py_aspen.logger.propagate = True
+        py_aspen.logger.setLevel(logging.NOTSET)
+
+    assert first.read_text() == ''
+    lines = second.read_text().splitlines()
+    assert len(lines) == 1
+    event = json.loads(lines[0])
+    assert (event['event'], event['case_id'], event['solve_time']) == ('case finished', 7, 1.5)
+
+
+def test_node_cache(session, file_dir):
+    session.clear_node_cache()
+    hits, misses = session.node_cache_hits, session.node_cache_misses
+    node = session._find_node(FLOW)
+    assert session._find_node(FLOW) is node
+    assert (session.node_cache_hits - hits, session.node_cache_misses - misses) == (1, 1)
+
+    missing = r'\Data\Blocks\R2\Input\TEMP'
+    assert session._find_node(missing) is None
+    assert session._find_node(missing) is None  # 未找到的地址不缓存
+    assert session.node_cache_misses - misses == 3
+    assert session.node_cache_stats()['size'] == 1
+
+    session.load_ap_file('demo.bkp', file_dir)  # 重新载入后原节点对象失效
+    assert session.node_cache_stats()['size'] == 0
+    assert session._find_node(FLOW) is not node
+
+
+def test_get_profile(session):
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    session.app.set_value(TLIQ + '\\3', 'N/A')
+    labels, values = session.get_profile(TLIQ)
+    assert labels == ['1', '2', '3']
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, [2.0, 3.0, np.nan])
+
+    profiles = session.get_profiles(['TLIQ'], {'TLIQ': TLIQ})
+    assert profiles['TLIQ'][0] == labels
+    with pytest.raises(KeyError):
+        session.get_profile(r'\Data\Blocks\R2\Output\TLIQ')
+
+
+def test_run_simulation_returns_when_engine_finishes(make_session):
+    session = make_session(solve_delay=0.05)
+    session.assign_node_value1(2, TEMP)
+    solve_time = session.run_simulation(sleep=2.0)
+    assert 0.05 <= solve_time < 0.5  # 按退避间隔检测, 不等满 sleep
+    assert session.solve_times == [solve_time]
+    assert session.app.reinit_count == 1
+
+    with pytest.raises(py_aspen.SimulationTimeoutError):
+        session.run_simulation(reinit=False, timeout=0.01)
+    assert session.app.reinit_count == 1
+    assert session.run_status() is py_aspen.RunOutcome.SEVERE  # 超时后引擎被停止
+
+
+def test_input_cache_skips_unchanged_writes(session):
+    session.assign_node_value1(2, TEMP)
+    session.assign_node_value1(2, TEMP)
+    session.assign_node_values(['temp', 'pres'], [2, 1], {'temp': TEMP, 'pres': PRES})
+    assert session.input_cache_stats() == {'size': 2, 'writes': 2, 'skipped': 2}
+
+    session.app.set_value(TEMP, 7)  # 在外部修改输入, 读取时同步缓存
+    assert session.get_target_value1(TEMP) == 7
+    session.assign_node_value1(2, TEMP)
+    assert session.app.tree[TEMP] == 2
+    assert session.input_cache_stats()['writes'] == 3
+
+    session.invalidate()
+    session.assign_node_value1(2, TEMP)
+    assert session.input_cache_stats() == {'size': 1, 'writes': 4, 'skipped': 2}
+
+
+def test_history_reader_scans_only_new_content(tmp_path):
+    path = tmp_path / 'DEMO.his'
+    path.write_bytes(b' *** SEVERE ERROR\n     BLOCK R1 FAILED\n\n *  WARNING\n')
+    reader = py_aspen.HistoryReader()
+    status = reader.read(str(path))
+    assert (status.severe_errors, status.errors, status.warnings) == (1, 0, 1)
+    assert status.error_blocks == [' *** SEVERE ERROR\n     BLOCK R1 FAILED']
+    assert not status.ok
+
+    with open(path, 'ab') as f:
+        f.write(b' ** ERROR\n     BLOCK R2')  # 末尾不完整的一行留待下次读取
+    status = reader.read(str(path))
+    assert (status.severe_errors, status.errors, status.error_blocks) == (0, 1, [' ** ERROR'])
+    with open(path, 'ab') as f:
+        f.write(b' FAILED\n')
+    assert reader.read(str(path)).errors == 0  # 已读取的错误不重复计入
+    assert reader.read(str(path)) == py_aspen.HistoryStatus()
+
+    path.write_bytes(b' *  WARNING\n')  # 文件被重新创建
+    assert reader.read(str(path)).warnings == 1
+
+
+def test_check_simulation_status(session):
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    assert session.check_simulation_status() == [True]
+    session.run_case({TEMP: 100, PRES: 1}, [FLOW])
+    assert session.check_simulation_status() == [False]
+    assert session.last_history_status.error_blocks == [' *** SEVERE ERROR\n     block R1 has a severe error']
+    session.run_case({TEMP: 3, PRES: 1}, [FLOW])
+    assert session.check_simulation_status() == [True]
+
+
+def test_recycler_restarts_on_latency_drift(session):
+    session.recycler = py_aspen.EngineRecycler(max_rss_mb=None, max_handles=None, baseline_runs=2, window=2)
+    session.solve_times = [0.1, 0.1, 0.2]
+    assert session.recycler.check(session) is None
+    session.solve_times.append(0.5)
+    assert session.recycler.check(session) == 'solve time drifted from 0.10 s to 0.35 s'
+
+    old_app = session.app
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])  # 运行前检查并重启
+    assert session.app is not old_app
+    assert session.recycler.recycles == 1
+    assert session.runs_at_restart == 4
+    assert session.recycler.check(session) is None
+
+
+def test_recycler_max_runs(session):
+    session.recycler = py_aspen.EngineRecycler(max_rss_mb=None, max_handles=None, max_latency_ratio=None,
+                                               max_runs=2)
+    for temp in (1, 2, 3):
+        session.run_case({TEMP: temp, PRES: 1}, [FLOW])
+    assert session.recycler.recycles == 1
+    assert session.engine_pids == set()  # 假后端不启动进程, 不会误杀其他进程
+
+
+def test_instrumentation_phases(session):
+    session.metrics = py_aspen.Instrumentation()
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    metrics = session.metrics.to_dict()
+    assert {phase: stats['count'] for phase, stats in metrics['phases'].items()} == \
+        {'input': 2, 'reinit': 1, 'solve': 1, 'status': 1, 'output': 1}
+    assert metrics['com_calls'] > 0
+    assert json.loads(session.metrics.to_json()) == metrics
+
+    text = session.metrics.to_prometheus()
+    assert 'pyaspen_phase_seconds_bucket{phase="solve",le="+Inf"} 1' in text
+    assert 'pyaspen_phase_seconds_count{phase="input"} 2' in text
+    assert f"pyaspen_com_calls_total {metrics['com_calls']}" in text
+
+
+def test_instrumentation_disabled(session):
+    assert not session.metrics.enabled
+    session.run_case({TEMP: 2, PRES: 1}, [FLOW])
+    assert session.metrics.to_dict() == {'com_calls': 0, 'phases': {}}
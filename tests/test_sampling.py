@@ -0,0 +1,19 @@
+import numpy as np
+
+import aspen_sampling
+
+
+def test_refine_prefers_status_flip_over_smooth_gap():
+    # 0 到 0.5 之间输出平缓但差值大, 0.71 与 0.83 之间由正常翻转为出错
+    unit = np.array([[0.0], [0.5], [0.71], [0.83], [1.0]])
+    ok = unit[:, 0] < 0.8
+    targets = 10 * unit
+    new = aspen_sampling.refine_samples(unit, targets, ok, n_new=1, k=1)
+    np.testing.assert_allclose(new, [[0.77]])
+
+
+def test_refine_prefers_steep_change():
+    unit = np.array([[0.0], [0.4], [0.8], [0.85], [1.0]])
+    targets = np.array([0.0, 1.5, 2.0, 3.0, 3.1])  # 0.8 到 0.85 之间变化最快
+    new = aspen_sampling.refine_samples(unit, targets, np.ones(len(unit), bool), n_new=1, k=1)
+    np.testing.assert_allclose(new, [[0.825]])
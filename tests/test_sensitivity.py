@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import aspen_sensitivity
+import aspen_sweep
+
+from flowsheet import TEMP, PRES, FLOW, ITER
+
+
+def test_morris_design():
+    unit = aspen_sensitivity.morris_design(5, 3, levels=4, seed=0)
+    assert unit.shape == (5 * 4, 3)
+    assert unit.min() >= 0 and unit.max() <= 1
+    # 轨迹上每步只改变一个变量, 步长为 levels / (2 (levels - 1))
+    step = np.abs(np.diff(unit.reshape(5, 4, 3), axis=1))
+    assert ((step > 0).sum(axis=2) == 1).all()
+    np.testing.assert_allclose(step.max(axis=2), 2 / 3)
+    with pytest.raises(ValueError):
+        aspen_sensitivity.morris_design(5, 3, levels=3)
+
+
+def test_morris_indices_linear():
+    unit = aspen_sensitivity.morris_design(6, 2, seed=0)
+    y = 2 * unit[:, 0] - 3 * unit[:, 1]
+    y[1] = np.nan  # 出错的工况使相邻的两个基本效应无效
+    table = aspen_sensitivity.morris_indices(unit, y, 2, seed=0)
+    np.testing.assert_allclose(table['mu'], [2, -3])
+    np.testing.assert_allclose(table['mu_star'], [2, 3])
+    np.testing.assert_allclose(table['sigma'], [0, 0], atol=1e-12)
+    assert table['n'].sum() == 6 * 2 - 2
+
+
+def test_sobol_indices():
+    unit = aspen_sensitivity.saltelli_design(1024, 2, sampler='lhs', seed=0)
+    assert unit.shape == (1024 * 4, 2)
+    y = unit[:, 0].copy()
+    y[:4] = np.nan  # 第一组基础样本整组舍弃
+    table = aspen_sensitivity.sobol_indices(y, 2, n_boot=200, seed=0)
+    np.testing.assert_allclose(table['S1'], [1, 0], atol=0.1)
+    np.testing.assert_allclose(table['ST'], [1, 0], atol=0.1)
+    assert table['ST'][1] == 0
+    assert (table['n'] == 1023).all()
+
+
+def test_sensitivity_analysis(make_session):
+    spec = aspen_sweep.SweepSpec({
+        'variables': [{'name': 'temp', 'path': TEMP, 'values': [1], 'bounds': [0, 4]},
+                      {'name': 'pres', 'path': PRES, 'values': [0], 'bounds': [0, 1]},
+                      {'name': 'fixed', 'path': ITER, 'values': [0]}],
+        'outputs': [{'name': 'flow', 'path': FLOW}],
+    })
+    runner = aspen_sweep.SweepRunner(spec, session=make_session())
+    analysis = aspen_sensitivity.SensitivityAnalysis(runner, ['flow'], n=4, seed=1)
+    assert analysis.factors == ['temp', 'pres']
+
+    table = analysis.run()
+    assert len(analysis.results) == 4 * 3
+    assert list(table.loc['flow'].index) == ['temp', 'pres']
+    assert list(table['rank']) == [1, 2]
+    # flow = 10 temp + pres, 基本效应按 [0, 1] 内的单位步长计
+    np.testing.assert_allclose(table.loc['flow', 'mu_star'], [40, 1])
+
+    with pytest.raises(ValueError):
+        aspen_sensitivity.SensitivityAnalysis(runner, ['flow'], method='fast')
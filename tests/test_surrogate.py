@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aspen_surrogate
+
+
+def _results(status: list, n_pending: int) -> pd.DataFrame:
+    n_done = len(status)
+    temp = np.arange(n_done + n_pending, dtype=float)
+    flow = np.where(np.array(status) == 'OK', 10 * temp[:n_done], np.nan)
+    return pd.DataFrame({'temp': temp, 'flow': np.concatenate([flow, np.full(n_pending, np.nan)]),
+                         'status': list(status) + [None] * n_pending})
+
+
+@pytest.mark.parametrize('status, p_fail', [('OK', 0.0), ('error', 1.0)])
+def test_single_class_failure_probability(status, p_fail):
+    pytest.importorskip('sklearn')
+    screen = aspen_surrogate.SurrogateScreen(['flow'], features=['temp'], min_cases=4, batch=3)
+    results = _results([status] * 4, 3)
+    candidates = results.iloc[4:][['temp']]
+    run, skip, predictions = screen.plan(results, candidates)
+
+    assert (predictions['pred_p_fail'] == p_fail).all()
+    if status == 'OK':
+        assert sorted(run) == [4, 5, 6] and skip == []
+    else:
+        assert run == [] and skip == [4, 5, 6]  # 全部失败的区域不再交给 ASPEN
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aspen_sweep
+
+from flowsheet import TEMP, PRES, FLOW, ITER
+
+SPEC = {
+    'variables': [{'name': 'temp', 'path': TEMP, 'values': [1, 2, 9]},
+                  {'name': 'pres', 'path': PRES, 'start': 0, 'step': 1, 'num': 2}],
+    'outputs': [{'name': 'flow', 'path': FLOW}],
+}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_journal_resume(make_session, tmp_path):
+    spec = aspen_sweep.SweepSpec(SPEC)
+    expected = aspen_sweep.SweepRunner(spec, session=make_session()).run()
+
+    journal_path = str(tmp_path / 'journal.csv')
+
+    def interrupt(index, result):
+        if index == 2:
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        aspen_sweep.SweepRunner(spec, session=make_session(), journal_path=journal_path).run(callback=interrupt)
+    assert len(aspen_sweep.read_journal(journal_path)) == 3
+    with pytest.raises(FileExistsError):
+        aspen_sweep.SweepRunner(spec, session=make_session(), journal_path=journal_path).run()
+
+    ran = []
+    runner = aspen_sweep.SweepRunner(spec, session=make_session(), journal_path=journal_path)
+    frame = runner.run(resume=True, callback=lambda index, result: ran.append(index))
+    assert ran == [3, 4, 5]
+
+    columns = ['temp', 'pres', 'flow', 'status']
+    pd.testing.assert_frame_equal(frame[columns], expected[columns])
+    assert list(frame['status']) == ['OK', 'OK', 'OK', 'OK', 'error', 'error']
+    np.testing.assert_array_equal(frame['flow'].to_numpy(), [10, 11, 20, 21, np.nan, np.nan])
+
+    journal = aspen_sweep.read_journal(journal_path)
+    assert len(journal) == 6
+    pd.testing.assert_frame_equal(journal[columns].sort_index(), expected[columns], check_dtype=False)
+
+
+def test_warm_start_failure_with_iterations(session):
+    cases, _ = aspen_sweep.grid_cases({TEMP: [1, 2, 9], PRES: [0, 1]})
+    scheduler = aspen_sweep.WarmStartScheduler(session, iterations_path=ITER)
+    results = scheduler.run(cases, [FLOW])
+
+    assert [result['status'] for result in results] == ['OK'] * 4 + ['error'] * 2
+    assert [result['outputs'] for result in results[4:]] == [{}, {}]
+    assert [result['iterations'] for result in results] == [3, 3, 3, 3, None, None]
+    assert [result['attempts'] for result in results] == [1, 1, 1, 1, 2, 2]
+    assert results[4]['warm_solve_time'] is not None
+    assert scheduler.warm_ok == 4 and scheduler.fallbacks == 2
+
+
+def test_warm_start_columns_survive_resume(make_session, tmp_path):
+    spec = aspen_sweep.SweepSpec(SPEC)
+    journal_path = str(tmp_path / 'journal.csv')
+    finished = []
+
+    def interrupt(index, result):
+        finished.append(index)
+        if len(finished) == 4:
+            raise Interrupted
+
+    runner = aspen_sweep.SweepRunner(spec, session=make_session(), warm_start=True, iterations_path=ITER,
+                                     journal_path=journal_path)
+    with pytest.raises(Interrupted):
+        runner.run(callback=interrupt)
+    journal = aspen_sweep.read_journal(journal_path)
+    assert list(journal['iterations']) == [3, 3, 3, 3]
+
+    runner = aspen_sweep.SweepRunner(spec, session=make_session(), warm_start=True, iterations_path=ITER,
+                                     journal_path=journal_path)
+    frame = runner.run(resume=True)
+    assert list(frame.columns[-4:]) == aspen_sweep.WARM_COLUMNS
+    np.testing.assert_array_equal(frame['iterations'].to_numpy(float), [3, 3, 3, 3, np.nan, np.nan])
+    assert list(frame['warm']) == [True, True, True, True, False, False]
+    assert list(frame['attempts']) == [1, 1, 1, 1, 2, 2]
+    assert frame['warm_solve_time'].isna().sum() == 4
+    assert frame['warm_solve_time'].iloc[4:].notna().all()
+
+    journal = aspen_sweep.read_journal(journal_path)
+    np.testing.assert_array_equal(journal['attempts'].to_numpy(float), [1, 1, 1, 1, 2, 2])